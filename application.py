@@ -0,0 +1,120 @@
+"""The application factory.
+
+``create_app`` does no I/O beyond an optional schema version check, and the
+mail and push stacks are only imported once something is sent, so a worker
+(or a test) can build an app cheaply. ``main.py`` is the entry point that
+reads ``.env`` and builds the app gunicorn serves.
+"""
+import logging
+import os
+
+from flask import Flask
+from sqlalchemy import exc as db_exc
+
+import assets
+import auth
+import blog
+import commands
+import compression
+import dbrouting
+import metrics
+import migrations
+import notifications
+import sqlprofiler
+from dbrouting import normalize_database_url
+from extensions import bootstrap, ckeditor, db, login_manager, page_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+def database_url() -> str:
+    return normalize_database_url(os.getenv("DATABASE_URL") or "sqlite:///blog.db")
+
+
+def config_from_env() -> dict:
+    """Settings read from the environment; ``create_app(config)`` overrides any of them."""
+    return {
+        'SECRET_KEY': os.getenv('SECRET_KEY'),
+        'SQLALCHEMY_DATABASE_URI': database_url(),
+        # comma-separated read replicas, see dbrouting
+        'DATABASE_REPLICA_URLS': [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',')
+                                  if url.strip()],
+        # how long a visitor reads from the primary after writing; also the replica lag we tolerate
+        'DB_REPLICA_STICKY_SECONDS': float(os.getenv('DB_REPLICA_STICKY_SECONDS', 10)),
+        'DB_POOL_SIZE': int(os.getenv('DB_POOL_SIZE', 5)),
+        'DB_MAX_OVERFLOW': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'DB_POOL_TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'DB_POOL_RECYCLE': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'DB_POOL_PRE_PING': os.getenv('DB_POOL_PRE_PING', '1') == '1',
+        # shared by all gunicorn workers so /metrics covers every one of them, see metrics.py
+        'METRICS_DIR': os.getenv('METRICS_DIR'),
+        'METRICS_FLUSH_SECONDS': float(os.getenv('METRICS_FLUSH_SECONDS', 5)),
+        # when set, /metrics requires "Authorization: Bearer <token>"
+        'METRICS_TOKEN': os.getenv('METRICS_TOKEN'),
+        # Opt-in per-request query counting, see sqlprofiler.init_app
+        'SQL_PROFILE': os.getenv('SQL_PROFILE') == '1',
+        'SQL_PROFILE_REPEAT_THRESHOLD': int(os.getenv('SQL_PROFILE_REPEAT_THRESHOLD', 5)),
+        'PAGE_CACHE_REDIS_URL': os.getenv('PAGE_CACHE_REDIS_URL'),
+        # page versions must be shared by every process that writes, so without Redis the
+        # cache is opt-in, for setups where a single process serves and writes everything
+        'PAGE_CACHE_ENABLED': os.getenv('PAGE_CACHE_ENABLED', '1' if os.getenv('PAGE_CACHE_REDIS_URL') else '0') == '1',
+        # send post pages in chunks as they render, see blog.stream_post
+        'STREAM_POST_PAGES': os.getenv('STREAM_POST_PAGES', '1') == '1',
+        # gzip rendered pages and JSON, see compression.py
+        'COMPRESS_RESPONSES': os.getenv('COMPRESS_RESPONSES', '1') == '1',
+        'COMPRESS_LEVEL': int(os.getenv('COMPRESS_LEVEL', 6)),
+        'COMPRESS_MIN_SIZE': int(os.getenv('COMPRESS_MIN_SIZE', 500)),
+        # where `flask build-assets` writes hashed static files; defaults to <instance>/static-build
+        'ASSET_BUILD_DIR': os.getenv('ASSET_BUILD_DIR'),
+        # Skip the startup schema check with SCHEMA_CHECK=0
+        'SCHEMA_CHECK': os.getenv('SCHEMA_CHECK', '1') == '1',
+        'USER_CACHE_SIZE': int(os.getenv('USER_CACHE_SIZE', 1024)),
+        'USER_CACHE_TTL': float(os.getenv('USER_CACHE_TTL', 300)),
+        'VAPID_PUBLIC_KEY': os.getenv('VAPID_PUBLIC_KEY'),
+        'VAPID_PRIVATE_KEY': os.getenv('VAPID_PRIVATE_KEY'),
+        'PUSH_CONCURRENCY': int(os.getenv('PUSH_CONCURRENCY', 16)),
+        'MAIL_ADDRESS': os.getenv('MAIL_ADDRESS'),
+        'MAIL_APP_PW': os.getenv('MAIL_APP_PW'),
+        'MAIL_SERVER': os.getenv('MAIL_SERVER', 'smtp.gmail.com'),
+        'MAIL_PORT': int(os.getenv('MAIL_PORT', 587)),
+        'MAIL_POOL_SIZE': int(os.getenv('MAIL_POOL_SIZE', 2)),
+        'OUTBOX_MAX_ATTEMPTS': int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6)),
+        'OUTBOX_BACKOFF_SECONDS': int(os.getenv('OUTBOX_BACKOFF_SECONDS', 30)),
+        # defaults to <instance>/avatars
+        'AVATAR_CACHE_DIR': os.getenv('AVATAR_CACHE_DIR'),
+        'AVATAR_UPSTREAM': os.getenv('AVATAR_UPSTREAM', 'https://www.gravatar.com/avatar/{hash}?s=100&d=retro&r=g'),
+        'AVATAR_CACHE_MAX_BYTES': int(os.getenv('AVATAR_CACHE_MAX_BYTES', 50 * 1024 * 1024)),
+    }
+
+
+def create_app(config: dict | None = None) -> Flask:
+    app = Flask(__name__)
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+
+    dbrouting.configure(app)
+    db.init_app(app)
+    dbrouting.init_app(app, db)
+    login_manager.init_app(app)
+    ckeditor.init_app(app)
+    bootstrap.init_app(app)
+    page_cache.init_app(app)
+    sqlprofiler.init_app(app)
+    metrics.init_app(app)
+    compression.init_app(app)
+
+    auth.init_app(app)
+    blog.init_app(app)
+    app.register_blueprint(notifications.bp)
+    assets.init_app(app)
+    app.register_blueprint(commands.bp)
+
+    # Only verify the schema version here; creating and altering tables is `flask db-upgrade`'s job
+    if app.config['SCHEMA_CHECK']:
+        with app.app_context():
+            try:
+                migrations.check_schema(db.engine)
+            except db_exc.OperationalError:
+                logger.exception('Could not check the database schema version')
+    return app
@@ -0,0 +1,272 @@
+"""Fingerprinted, precompressed static files and the service worker that precaches them.
+
+``flask build-assets`` copies every file under ``static/`` to the build
+directory (``ASSET_BUILD_DIR``, default ``<instance>/static-build``) under a
+name carrying a hash of its contents, e.g. ``css/styles.3f2a9c1b0d4e.css``.
+Text files get ``.gz`` (and, with the ``brotli`` package, ``.br``) siblings.
+Background images get WebP copies in a few widths if Pillow is installed.
+Once a build exists, ``url_for('static', ...)`` points at the hashed names,
+which are served with the best encoding the client accepts and cached for
+a year as immutable. Without a build, or in debug mode, static files are
+served as they are.
+
+The content manifest maps each file's URL to its hash and is built once per
+process, so a deploy that changes any asset changes the service worker
+script too. Browsers then install the new worker, which fetches only the
+files whose hash changed and drops the old caches.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import Blueprint, current_app, render_template, request, send_from_directory, url_for
+from markupsafe import Markup
+
+
+bp = Blueprint('assets', __name__)
+
+HASH_LENGTH = 12
+OFFLINE_URL = '/offline'
+BUILD_MANIFEST = 'manifest.json'
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.map', '.json', '.svg', '.ico', '.txt', '.html', '.xml'}
+# file suffix of each precompressed encoding, in order of preference
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+# WebP widths made of the images under WEBP_FOLDER, smaller than the original; the full size is always made
+WEBP_FOLDER = 'assets/img'
+WEBP_WIDTHS = (640, 1280, 1920)
+WEBP_QUALITY = 80
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def _static_files(static_folder: str):
+    """``(relative name, path)`` of every file under ``static_folder``, in a stable order."""
+    for root, dirs, files in os.walk(static_folder):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, static_folder).replace(os.sep, '/'), path
+
+
+def build_manifest(static_folder: str, static_url_path: str) -> dict[str, str]:
+    """``{url: content hash}`` for every file under ``static_folder``."""
+    return {f'{static_url_path}/{relative}': file_hash(path) for relative, path in _static_files(static_folder)}
+
+
+def manifest_version(manifest: dict[str, str]) -> str:
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:HASH_LENGTH]
+
+
+def asset_manifest(app=None) -> dict[str, str]:
+    """The app's manifest, rebuilt on every call in debug mode so edits show up."""
+    app = app or current_app
+    manifest = app.extensions.get('asset_manifest')
+    if manifest is None or app.debug:
+        manifest = build_manifest(app.static_folder, app.static_url_path)
+        app.extensions['asset_manifest'] = manifest
+    return manifest
+
+
+def _write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def _precompress(path: str) -> list[str]:
+    """Write the encodings of the file at ``path`` that come out smaller than it and return their names."""
+    compressors = {'gzip': lambda data: gzip.compress(data, 9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        compressors['br'] = brotli.compress
+    with open(path, 'rb') as f:
+        data = f.read()
+    encodings = []
+    for encoding, suffix in ENCODINGS.items():
+        if os.path.exists(path + suffix):
+            # built before; the name is the content hash, so it is still right
+            encodings.append(encoding)
+        elif encoding in compressors:
+            compressed = compressors[encoding](data)
+            if len(compressed) < len(data):
+                _write(path + suffix, compressed)
+                encodings.append(encoding)
+    return encodings
+
+
+def _webp_variants(source: str, output_dir: str, hashed: str) -> dict[str, str]:
+    """Write WebP copies of an image in ``WEBP_WIDTHS`` and full size; ``{width: name}``."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return {}
+    variants = {}
+    stem = os.path.splitext(hashed)[0]
+    with Image.open(source) as image:
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        widths = [width for width in WEBP_WIDTHS if width < image.width] + [image.width]
+        for width in widths:
+            name = f'{stem}.{width}w.webp'
+            target = os.path.join(output_dir, name)
+            if not os.path.exists(target):
+                height = round(image.height * width / image.width)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                image.resize((width, height), Image.LANCZOS).save(target + '.tmp', 'WEBP', quality=WEBP_QUALITY)
+                os.replace(target + '.tmp', target)
+            variants[str(width)] = name
+    return variants
+
+
+def build_assets(static_folder: str, output_dir: str) -> dict:
+    """Write the hashed copies, their encodings and WebP variants to ``output_dir``, then its manifest.
+
+    Files from earlier builds are kept, so pages rendered before a deploy
+    can still load the assets they name. Unchanged files are not rewritten.
+    Returns the manifest: ``{name: {"file", "encodings", "webp"}}``.
+    """
+    manifest = {}
+    for relative, path in _static_files(static_folder):
+        stem, extension = os.path.splitext(relative)
+        hashed = f'{stem}.{file_hash(path)}{extension}'
+        target = os.path.join(output_dir, hashed)
+        entry = {'file': hashed, 'encodings': []}
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(path, target)
+        if extension.lower() in COMPRESSIBLE_EXTENSIONS:
+            entry['encodings'] = _precompress(target)
+        if relative.startswith(WEBP_FOLDER + '/') and extension.lower() in ('.jpg', '.jpeg', '.png'):
+            entry['webp'] = _webp_variants(path, output_dir, hashed)
+        manifest[relative] = entry
+    # replaced in one step, so a running server never reads half a manifest
+    _write(os.path.join(output_dir, BUILD_MANIFEST), json.dumps(manifest, indent=1, sort_keys=True).encode())
+    return manifest
+
+
+def build_dir(app=None) -> str:
+    app = app or current_app
+    return app.config['ASSET_BUILD_DIR'] or os.path.join(app.instance_path, 'static-build')
+
+
+def asset_build(app=None) -> dict | None:
+    """The last ``build-assets`` manifest with a reverse index by hashed name, or ``None`` if there is none.
+
+    Debug mode ignores the build, so edited files are served as they are.
+    """
+    app = app or current_app
+    if app.debug:
+        return None
+    if 'asset_build' not in app.extensions:
+        build = None
+        try:
+            with open(os.path.join(build_dir(app), BUILD_MANIFEST), encoding='utf-8') as f:
+                files = json.load(f)
+        except FileNotFoundError:
+            pass
+        else:
+            served = {entry['file']: entry for entry in files.values()}
+            for entry in files.values():
+                served.update({name: {'file': name, 'encodings': []} for name in entry.get('webp', {}).values()})
+            build = {'files': files, 'served': served}
+        app.extensions['asset_build'] = build
+    return app.extensions['asset_build']
+
+
+def hashed_static_urls(endpoint, values):
+    """``url_defaults`` hook pointing ``url_for('static', filename=...)`` at the file's hashed copy."""
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    build = asset_build()
+    entry = build and build['files'].get(values['filename'])
+    if entry:
+        values['filename'] = entry['file']
+
+
+def send_static(filename):
+    """The ``static`` endpoint: hashed files from the build, anything else from ``static/`` as usual."""
+    build = asset_build()
+    entry = build and build['served'].get(filename)
+    if entry is None:
+        return current_app.send_static_file(filename)
+    encoding = request.accept_encodings.best_match(entry['encodings']) if entry['encodings'] else None
+    response = send_from_directory(
+        build_dir(), filename + ENCODINGS[encoding] if encoding else filename,
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream', max_age=IMMUTABLE_MAX_AGE,
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if entry['encodings']:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def masthead_background(filename: str) -> Markup:
+    """A ``<style>`` block giving the page header ``filename`` as its background, as WebP where built.
+
+    Browsers without ``image-set()`` keep the first declaration; the rest
+    pick the WebP width nearest the viewport and fall back to the original.
+    """
+    original = url_for('static', filename=filename)
+    original_type = mimetypes.guess_type(filename)[0] or 'image/jpeg'
+    build = asset_build()
+    variants = ((build and build['files'].get(filename)) or {}).get('webp')
+    rules = [f'header.masthead{{background-image:url("{original}")}}']
+    if variants:
+        def image_set(name):
+            webp = url_for('static', filename=name)
+            return (f'header.masthead{{background-image:image-set(url("{webp}") type("image/webp"),'
+                    f'url("{original}") type("{original_type}"))}}')
+
+        widths = sorted(variants, key=int, reverse=True)
+        rules.append(image_set(variants[widths[0]]))
+        # narrowest last, so it wins where several queries match
+        rules.extend(f'@media (max-width:{width}px){{{image_set(variants[width])}}}' for width in widths[1:])
+    return Markup('<style>' + '\n'.join(rules) + '</style>')
+
+
+def init_app(app):
+    app.url_defaults(hashed_static_urls)
+    if app.has_static_folder:
+        app.view_functions['static'] = send_static
+    app.add_template_global(masthead_background)
+    app.register_blueprint(bp)
+
+
+@bp.route('/sw.js')
+def service_worker():
+    # served from the root so the worker may control every page
+    manifest = asset_manifest()
+    prefix = current_app.static_url_path + '/'
+    # precache the URLs pages actually use, which are the hashed ones once assets are built
+    urls = {url_for('static', filename=url[len(prefix):]): version for url, version in manifest.items()}
+    response = current_app.response_class(
+        render_template('service-worker.js', version=manifest_version(manifest), assets=urls,
+                        offline_url=OFFLINE_URL),
+        mimetype='application/javascript',
+    )
+    response.headers['Service-Worker-Allowed'] = '/'
+    response.headers['Cache-Control'] = 'no-cache'
+    # the script changes with the worker code as well as the manifest
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@bp.route(OFFLINE_URL)
+def offline():
+    return render_template('offline.html')
@@ -0,0 +1,166 @@
+from flask import Blueprint, current_app, flash, redirect, render_template, url_for
+from flask_login import UserMixin, current_user, login_user, logout_user
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import notifications
+from extensions import db, login_manager
+from forms import RegisterForm, LoginForm, PasswordResetRequestForm, PasswordResetForm
+from models import User, email_hash
+from pagecache import LRUCache
+
+
+bp = Blueprint('auth', __name__)
+
+
+class SessionUser(UserMixin):
+    """The fields templates and routes read from ``current_user``, detached from the DB."""
+
+    def __init__(self, id: int, name: str, is_admin: bool, email_hash: str):
+        self.id = id
+        self.name = name
+        self.is_admin = is_admin
+        self.email_hash = email_hash
+
+
+def init_app(app):
+    # Per-process, so other workers may serve a changed user for up to the TTL
+    app.extensions['user_cache'] = LRUCache(maxsize=app.config['USER_CACHE_SIZE'],
+                                            ttl=app.config['USER_CACHE_TTL'])
+    app.register_blueprint(bp)
+
+
+def user_cache() -> LRUCache:
+    return current_app.extensions['user_cache']
+
+
+def invalidate_user(user_id: int):
+    user_cache().delete(int(user_id))
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_cached_user(mapper, connection, user):
+    invalidate_user(user.id)
+
+
+def reset_serializer() -> URLSafeTimedSerializer:
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    user_id = int(user_id)
+    cache = user_cache()
+    session_user = cache.get(user_id)
+    if session_user is None:
+        row = db.session.execute(
+            db.select(User.id, User.name, User.is_admin, User.email_hash, User.email).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        session_user = SessionUser(row.id, row.name, row.is_admin, row.email_hash or email_hash(row.email))
+        cache.set(user_id, session_user)
+    return session_user
+
+
+# Hash the user's password when creating a new user.
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    form = RegisterForm()
+    if form.validate_on_submit():
+        existing_user = db.session.execute(db.select(User).where(User.email == form.email.data)).scalar()
+        if existing_user:
+            flash('Email already registered. Log in instead!')
+            return redirect(url_for('auth.login'))
+
+        hash_and_salted_password = generate_password_hash(
+            form.password.data,
+            method='pbkdf2:sha256',
+            salt_length=8
+        )
+        # the first account becomes the admin; an EXISTS probe stops at the first index entry
+        has_users = db.session.execute(db.select(db.select(User.id).exists())).scalar()
+        new_user = User(
+            email=form.email.data,
+            email_hash=email_hash(form.email.data),
+            name=form.name.data,
+            password=hash_and_salted_password,
+            is_admin=not has_users
+        )
+        db.session.add(new_user)
+        db.session.commit()
+
+        login_user(new_user)
+        return redirect(url_for("blog.get_all_posts"))
+
+    return render_template("register.html", form=form, current_user=current_user)
+
+
+@bp.route('/login', methods=["GET", "POST"])
+def login():
+    form = LoginForm()
+    if form.validate_on_submit():
+        email = form.email.data
+        password = form.password.data
+        result = db.session.execute(db.select(User).where(User.email == email))
+        user = result.scalar()
+
+        if not user:
+            flash("That email does not exist, please try again.")
+        elif not check_password_hash(user.password, password=password):
+            flash("Password incorrect, please try again.")
+            return redirect(url_for('auth.login'))
+        else:
+            login_user(user)
+            return redirect(url_for('blog.get_all_posts'))
+
+    return render_template("login.html", form=form, current_user=current_user)
+
+
+@bp.route('/logout')
+def logout():
+    logout_user()
+    return redirect(url_for('blog.get_all_posts'))
+
+
+# Request password reset
+@bp.route('/reset-password', methods=['GET', 'POST'])
+def reset_request():
+    form = PasswordResetRequestForm()
+    if form.validate_on_submit():
+        user = db.session.execute(db.select(User).where(User.email == form.email.data)).scalar()
+        if user:
+            token = reset_serializer().dumps(user.email, salt='password-reset')
+            reset_url = url_for('auth.reset_with_token', token=token, _external=True)
+            body = render_template('reset_email.txt', reset_url=reset_url)
+            notifications.send_email(to_addr=user.email, subject='Password Reset', body=body)
+        flash('If that email exists in our system, a reset link has been sent.')
+        return redirect(url_for('auth.login'))
+    return render_template('reset_request.html', form=form, current_user=current_user)
+
+
+# Reset password via token
+@bp.route('/reset/<token>', methods=['GET', 'POST'])
+def reset_with_token(token: str):
+    try:
+        email = reset_serializer().loads(token, salt='password-reset', max_age=3600)
+    except (SignatureExpired, BadSignature):
+        flash('The reset link is invalid or has expired.')
+        return redirect(url_for('auth.reset_request'))
+
+    form = PasswordResetForm()
+    if form.validate_on_submit():
+        user = db.session.execute(db.select(User).where(User.email == email)).scalar()
+        if user:
+            user.password = generate_password_hash(
+                form.password.data,
+                method='pbkdf2:sha256',
+                salt_length=8,
+            )
+            db.session.commit()
+            invalidate_user(user.id)
+            flash('Your password has been updated.')
+            return redirect(url_for('auth.login'))
+    return render_template('reset_password.html', form=form, current_user=current_user)
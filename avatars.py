@@ -0,0 +1,97 @@
+import os
+import tempfile
+import threading
+import urllib.request
+
+from pagecache import LRUCache
+
+
+def sniff_image_type(data: bytes) -> str | None:
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+class AvatarStore:
+    """On-disk cache of avatar images fetched from an upstream such as Gravatar.
+
+    Files are named after the email hash. Hits refresh the file's mtime, and
+    when the directory grows past ``max_bytes`` the least recently used files
+    are removed. Hashes the upstream has no image for, or that failed to
+    fetch, are not asked for again until ``miss_ttl`` seconds have passed.
+    """
+
+    def __init__(self, cache_dir: str, upstream_url: str, max_bytes: int = 50 * 1024 * 1024,
+                 timeout: float = 3, max_image_bytes: int = 1024 * 1024, miss_ttl: float = 300):
+        self.cache_dir = cache_dir
+        self.upstream_url = upstream_url
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_image_bytes = max_image_bytes
+        self._lock = threading.Lock()
+        self._misses = LRUCache(maxsize=4096, ttl=miss_ttl)
+
+    def _path(self, email_hash: str) -> str:
+        return os.path.join(self.cache_dir, email_hash)
+
+    def get(self, email_hash: str) -> str | None:
+        """Return the path of the cached image, fetching it first if needed; ``None`` if unavailable."""
+        path = self._path(email_hash)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        if self._misses.get(email_hash):
+            return None
+        data = self._fetch(email_hash)
+        if data is None:
+            self._misses.set(email_hash, True)
+            return None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write then rename so concurrent readers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def _fetch(self, email_hash: str) -> bytes | None:
+        url = self.upstream_url.format(hash=email_hash)
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                if response.status != 200:
+                    return None
+                data = response.read(self.max_image_bytes + 1)
+        except (OSError, ValueError):
+            return None
+        if len(data) > self.max_image_bytes or sniff_image_type(data) is None:
+            return None
+        return data
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.startswith('.tmp-'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -0,0 +1,351 @@
+"""Load benchmark for the real routes, in-process or against a local gunicorn.
+
+    python -m bench.load --users 200 --posts 200 --requests 500 --concurrency 8
+    python -m bench.load --mode gunicorn --workers 4 --concurrency 16 --baseline bench/baseline.json
+    python -m bench.load ... --baseline bench/baseline.json --save-baseline
+
+Without ``--database`` a temporary SQLite database is seeded first (see
+``bench.seed``), so every run starts from the same data. Scenarios run one
+after another, reads before writes:
+
+- ``index``: anonymous ``GET /``
+- ``post``: anonymous ``GET /post/<id>``
+- ``login``: ``POST /login`` from a fresh session
+- ``comment``: a logged-in user ``POST``\\ s a comment
+- ``new-post``: the admin ``POST``\\ s to ``/new-post``
+
+Each scenario reports throughput, p50/p95/p99 latency, error rate and
+queries per request (from the ``X-SQL-Queries`` header, so ``SQL_PROFILE``
+is switched on). Streamed post pages run their queries after the headers
+are sent, so their counts are read from ``/_debug/sql`` once the scenario
+ends; with several gunicorn workers that is one worker's share of them.
+The page cache is switched off, so anonymous reads measure rendering rather
+than cache hits. With ``--baseline`` the run fails when a scenario is slower
+or does more queries than the saved one by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, text
+
+from bench.seed import ADMIN_EMAIL, PASSWORD, SeedSpec, seed_database
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('index', 'post', 'login', 'comment', 'new-post')
+_CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"|value="([^"]+)"[^>]*name="csrf_token"')
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method: str, path: str, data: dict | None = None):
+        response = self._client.open(path, method=method, data=data)
+        return response.status_code, response.headers, response.get_data(as_text=True)
+
+
+class HTTPClient:
+    def __init__(self, base_url: str):
+        import requests
+
+        self.base_url = base_url
+        self._session = requests.Session()
+
+    def request(self, method: str, path: str, data: dict | None = None):
+        response = self._session.request(method, self.base_url + path, data=data, allow_redirects=False)
+        return response.status_code, response.headers, response.text
+
+
+class Worker:
+    """One simulated visitor with its own cookies and random stream."""
+
+    def __init__(self, client, rng: random.Random, post_count: int, user_count: int):
+        self.client = client
+        self.rng = rng
+        self.post_count = post_count
+        self.user_count = user_count
+        self.csrf_token = None
+        self.path = None
+
+    def _request(self, method: str, path: str, data: dict | None = None):
+        self.path = path
+        return self.client.request(method, path, data)
+
+    def _fetch_csrf_token(self):
+        _, _, body = self.client.request('GET', '/login')
+        match = _CSRF_TOKEN.search(body)
+        self.csrf_token = match and (match.group(1) or match.group(2))
+
+    def login(self, email: str):
+        self._fetch_csrf_token()
+        return self.client.request('POST', '/login', {
+            'email': email, 'password': PASSWORD, 'submit': 'Let Me In!', 'csrf_token': self.csrf_token,
+        })
+
+    def random_user(self) -> str:
+        user_id = self.rng.randint(2, max(self.user_count, 2))
+        return f'user{user_id}@bench.local'
+
+    def setup(self, scenario: str):
+        if scenario == 'comment':
+            self.login(self.random_user())
+        elif scenario == 'new-post':
+            self.login(ADMIN_EMAIL)
+
+    def step(self, scenario: str):
+        if scenario == 'index':
+            return self._request('GET', '/')
+        if scenario == 'post':
+            return self._request('GET', f'/post/{self.rng.randint(1, self.post_count)}')
+        if scenario == 'login':
+            self._fetch_csrf_token()
+            return self._request('POST', '/login', {
+                'email': self.random_user(), 'password': PASSWORD, 'submit': 'Let Me In!',
+                'csrf_token': self.csrf_token,
+            })
+        if scenario == 'comment':
+            return self._request('POST', f'/post/{self.rng.randint(1, self.post_count)}', {
+                'comment_text': f'Benchmark comment {self.rng.random()}', 'submit': 'Submit Comment',
+                'csrf_token': self.csrf_token,
+            })
+        if scenario == 'new-post':
+            return self._request('POST', '/new-post', {
+                'title': f'Benchmark post {self.rng.getrandbits(64):x}', 'subtitle': 'Load test',
+                'img_url': 'https://example.com/image.jpg', 'body': '<p>Benchmark body</p>' * 20,
+                'submit': 'Submit Post', 'csrf_token': self.csrf_token,
+            })
+        raise ValueError(f'Unknown scenario: {scenario}')
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def streamed_query_counts(client, paths: set[str], count: int) -> list[int]:
+    """Query counts of the last ``count`` profiled requests for ``paths``, from ``/_debug/sql``."""
+    status, _, body = client.request('GET', '/_debug/sql')
+    if status != 200:
+        return []
+    return [report['queries'] for report in json.loads(body) if report['path'] in paths][-count:]
+
+
+def run_scenario(scenario: str, make_client, requests: int, concurrency: int, seed: int,
+                 post_count: int, user_count: int, warmup: int = 0) -> dict:
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    latencies, queries, errors = [], [], []
+    # paths of streamed responses, which carry no X-SQL-Queries header
+    unreported = []
+    lock = threading.Lock()
+
+    def work(index):
+        worker = Worker(make_client(), random.Random(f'{seed}-{scenario}-{index}'), post_count, user_count)
+        worker.setup(scenario)
+        samples = []
+        # the first ``warmup`` requests fill caches and open connections and are not counted
+        for step in range(warmup + per_worker[index]):
+            if scenario == 'login':
+                # every login starts from a fresh, anonymous session
+                worker.client = make_client()
+            started = time.perf_counter()
+            status, headers, _ = worker.step(scenario)
+            if step >= warmup:
+                samples.append((time.perf_counter() - started, status, headers.get('X-SQL-Queries'), worker.path))
+        with lock:
+            for elapsed, status, query_count, path in samples:
+                latencies.append(elapsed * 1000)
+                if status >= 400:
+                    errors.append(status)
+                if query_count is not None:
+                    queries.append(int(query_count))
+                elif status < 400:
+                    unreported.append(path)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(work, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    if unreported:
+        queries.extend(streamed_query_counts(make_client(), set(unreported), len(unreported)))
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'error_rate': len(errors) / len(latencies) if latencies else 0.0,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'mean_ms': statistics.fmean(latencies) if latencies else 0.0,
+        'queries_per_request': statistics.fmean(queries) if queries else None,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Describe every way ``results`` is worse than ``baseline``; empty if it is not."""
+    regressions = []
+    for scenario, base in baseline.get('scenarios', {}).items():
+        current = results['scenarios'].get(scenario)
+        if current is None:
+            continue
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{scenario}: p95 {current["p95_ms"]:.1f} ms vs baseline {base["p95_ms"]:.1f} ms')
+        if current['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            regressions.append(f'{scenario}: {current["throughput_rps"]:.1f} req/s '
+                               f'vs baseline {base["throughput_rps"]:.1f} req/s')
+        if current['error_rate'] > base['error_rate']:
+            regressions.append(f'{scenario}: error rate {current["error_rate"]:.1%} '
+                               f'vs baseline {base["error_rate"]:.1%}')
+        # query counts don't depend on the machine, so any real increase counts
+        if (base.get('queries_per_request') is not None and current['queries_per_request'] is not None
+                and current['queries_per_request'] > base['queries_per_request'] + 0.5):
+            regressions.append(f'{scenario}: {current["queries_per_request"]:.1f} queries/request '
+                               f'vs baseline {base["queries_per_request"]:.1f}')
+    return regressions
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(database: str, workers: int, threads: int):
+    port = _free_port()
+    env = dict(os.environ, DATABASE_URL=database, SQL_PROFILE='1', SCHEMA_CHECK='0', PAGE_CACHE_ENABLED='0',
+               SECRET_KEY=os.getenv('SECRET_KEY', 'bench-secret'))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'main:app'],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start listening in time')
+
+
+def run(args) -> dict:
+    database = args.database
+    tmpdir = None
+    if database is None:
+        tmpdir = tempfile.TemporaryDirectory(prefix='blog-bench-')
+        database = f'sqlite:///{os.path.join(tmpdir.name, "bench.db")}'
+        seed_database(database, SeedSpec(users=args.users, posts=args.posts, seed=args.seed))
+
+    engine = create_engine(database)
+    with engine.connect() as connection:
+        post_count = connection.execute(text('SELECT MAX(id) FROM blog_posts')).scalar() or 1
+        user_count = connection.execute(text('SELECT MAX(id) FROM users')).scalar() or 1
+    engine.dispose()
+
+    server = None
+    if args.mode == 'gunicorn':
+        server, base_url = start_gunicorn(database, args.workers, args.threads)
+        make_client = lambda: HTTPClient(base_url)
+    else:
+        from application import create_app
+
+        app = create_app({'SQLALCHEMY_DATABASE_URI': database, 'SQL_PROFILE': True, 'SCHEMA_CHECK': False,
+                          'PAGE_CACHE_ENABLED': False, 'SQL_PROFILE_HISTORY': 10000,
+                          'SECRET_KEY': os.getenv('SECRET_KEY', 'bench-secret')})
+        make_client = lambda: InProcessClient(app)
+
+    try:
+        scenarios = {}
+        for scenario in args.scenarios:
+            scenarios[scenario] = run_scenario(scenario, make_client, args.requests, args.concurrency,
+                                               args.seed, post_count, user_count, args.warmup)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    return {
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'requests_per_scenario': args.requests,
+        'warmup': args.warmup,
+        'python': platform.python_version(),
+        'scenarios': scenarios,
+    }
+
+
+def print_report(results: dict):
+    print(f'{"scenario":<10} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7} {"queries":>8}')
+    for name, result in results['scenarios'].items():
+        queries = result['queries_per_request']
+        print(f'{name:<10} {result["throughput_rps"]:>8.1f} {result["p50_ms"]:>8.1f} {result["p95_ms"]:>8.1f} '
+              f'{result["p99_ms"]:>8.1f} {result["errors"]:>7} {"-" if queries is None else f"{queries:.1f}":>8}')
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Drive the blog routes and report latency and throughput.')
+    parser.add_argument('--mode', choices=('inprocess', 'gunicorn'), default='inprocess')
+    parser.add_argument('--database', help='seeded database URL (default: seed a temporary SQLite file)')
+    parser.add_argument('--users', type=int, default=100, help='users to seed without --database')
+    parser.add_argument('--posts', type=int, default=50, help='posts to seed without --database')
+    parser.add_argument('--scenarios', type=lambda value: value.split(','), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=3, help='uncounted requests per client before measuring')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the results as JSON here')
+    parser.add_argument('--baseline', help='baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown before a scenario counts as a regression (default 25%%)')
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    results = run(args)
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
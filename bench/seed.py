@@ -0,0 +1,183 @@
+"""Synthetic data for benchmarks: users, posts and comment trees of realistic shape.
+
+Everything is drawn from a seeded ``random.Random``, so the same arguments
+always produce the same database::
+
+    python -m bench.seed --database sqlite:////tmp/bench.db --users 500 --posts 300
+
+Post lengths are log-normal (a few long reads among many short posts),
+comment counts per post are heavy-tailed (most posts get a handful, a few get
+hundreds), and replies favour recent comments, which grows deep threads.
+``--chain-depth`` adds one straight reply chain of that depth to the first post.
+"""
+import argparse
+import math
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+
+# Every seeded account uses this password; the admin is admin@bench.local
+PASSWORD = 'bench-password'
+ADMIN_EMAIL = 'admin@bench.local'
+BATCH_SIZE = 1000
+
+WORDS = (
+    'system latency cache thread query index worker replica request response page post comment reply '
+    'quantum coffee garden river mountain signal network kernel compiler buffer socket packet memory '
+    'design pattern window light shadow market budget travel winter summer ocean forest engine museum '
+    'history science theory model sample measure result method problem answer question story journey'
+).split()
+
+
+@dataclass
+class SeedSpec:
+    users: int = 100
+    posts: int = 50
+    # mean comments per post; the distribution is heavy-tailed around it
+    comments_per_post: float = 8
+    max_comments_per_post: int = 500
+    reply_ratio: float = 0.6
+    max_depth: int = 12
+    chain_depth: int = 0
+    # median post length in words
+    post_words: int = 600
+    seed: int = 42
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _body(rng: random.Random, words: int) -> str:
+    paragraphs = []
+    while words > 0:
+        length = min(words, rng.randint(40, 120))
+        paragraphs.append(f'<p>{_sentence(rng, length)}</p>')
+        words -= length
+    return ''.join(paragraphs)
+
+
+def _post_words(rng: random.Random, median: int) -> int:
+    return max(20, min(int(rng.lognormvariate(math.log(median), 0.8)), median * 15))
+
+
+def _comment_count(rng: random.Random, spec: SeedSpec) -> int:
+    # Pareto with shape 1.5 has mean 3 * scale
+    count = int(rng.paretovariate(1.5) * spec.comments_per_post / 3)
+    return min(count, spec.max_comments_per_post)
+
+
+def generate(db, spec: SeedSpec) -> dict:
+    """Insert the data described by ``spec`` into an empty, migrated database and return the row counts."""
+    import migrations
+    from content import compile_content
+    from models import COMMENT_PATH_WIDTH, BlogPost, Comment, User, email_hash
+
+    rng = random.Random(spec.seed)
+    password = generate_password_hash(PASSWORD, method='pbkdf2:sha256', salt_length=8)
+    counts = {'users': 0, 'posts': 0, 'comments': 0}
+
+    def insert(model, rows):
+        if rows:
+            db.session.execute(db.insert(model), rows)
+            counts[model.__tablename__.replace('blog_', '')] += len(rows)
+        rows.clear()
+
+    users = []
+    for user_id in range(1, spec.users + 1):
+        email = ADMIN_EMAIL if user_id == 1 else f'user{user_id}@bench.local'
+        users.append({'id': user_id, 'name': f'User {user_id}', 'email': email, 'email_hash': email_hash(email),
+                      'password': password, 'is_admin': user_id == 1})
+        if len(users) >= BATCH_SIZE:
+            insert(User, users)
+    insert(User, users)
+
+    now = datetime(2025, 1, 1)
+    posts, comments = [], []
+    comment_id = 0
+    for post_id in range(1, spec.posts + 1):
+        published_at = now - timedelta(hours=6 * (spec.posts - post_id))
+        compiled = compile_content(_body(rng, _post_words(rng, spec.post_words)))
+        posts.append({
+            'id': post_id, 'title': f'{_sentence(rng, rng.randint(3, 8))[:-1]} #{post_id}',
+            'subtitle': _sentence(rng, rng.randint(5, 12)), 'date': published_at.strftime('%B %d, %Y'),
+            'published_at': published_at, 'body': compiled.html, 'body_html': compiled.html,
+            'excerpt': compiled.excerpt, 'word_count': compiled.word_count,
+            'reading_minutes': compiled.reading_minutes, 'content_hash': compiled.content_hash,
+            'author_id': 1, 'img_url': f'https://picsum.photos/seed/{post_id}/1200/600',
+        })
+
+        thread = []  # (id, path, depth) of this post's comments so far
+        count = _comment_count(rng, spec)
+        chain = spec.chain_depth if post_id == 1 else 0
+        for index in range(count + chain):
+            comment_id += 1
+            if index < chain:
+                parent = thread[-1] if thread else None
+            elif thread and rng.random() < spec.reply_ratio:
+                # recent comments attract most replies
+                parent = thread[-1 - min(int(rng.expovariate(0.5)), len(thread) - 1)]
+                if parent[2] >= spec.max_depth:
+                    parent = None
+            else:
+                parent = None
+            segment = str(comment_id).zfill(COMMENT_PATH_WIDTH)
+            path = f'{parent[1]}/{segment}' if parent else segment
+            depth = parent[2] + 1 if parent else 0
+            thread.append((comment_id, path, depth))
+            comments.append({
+                'id': comment_id, 'content': f'<p>{_sentence(rng, max(3, int(rng.lognormvariate(3, 0.7))))}</p>',
+                'author_id': rng.randint(1, spec.users), 'post_id': post_id,
+                'created_at': published_at + timedelta(minutes=index + 1),
+                'parent_id': parent[0] if parent else None, 'path': path, 'depth': depth,
+            })
+        if len(posts) >= BATCH_SIZE or len(comments) >= BATCH_SIZE:
+            insert(BlogPost, posts)
+            insert(Comment, comments)
+    insert(BlogPost, posts)
+    insert(Comment, comments)
+    migrations.recount_activity(db.session.connection(), db.metadata)
+    db.session.commit()
+    return counts
+
+
+def seed_database(url: str, spec: SeedSpec, index: bool = True) -> dict:
+    import migrations
+    from application import create_app
+    from extensions import db, search_index
+    from models import BlogPost, Comment
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': url, 'SCHEMA_CHECK': False})
+    with app.app_context():
+        migrations.upgrade(db.engine, db.metadata)
+        counts = generate(db, spec)
+        if index:
+            search_index.rebuild(db.select(BlogPost), db.select(Comment))
+    return counts
+
+
+def main(argv=None):
+    defaults = SeedSpec()
+    parser = argparse.ArgumentParser(description='Fill an empty database with synthetic blog data.')
+    parser.add_argument('--database', required=True, help='SQLAlchemy URL of an empty database')
+    parser.add_argument('--users', type=int, default=defaults.users)
+    parser.add_argument('--posts', type=int, default=defaults.posts)
+    parser.add_argument('--comments-per-post', type=float, default=defaults.comments_per_post)
+    parser.add_argument('--max-depth', type=int, default=defaults.max_depth)
+    parser.add_argument('--chain-depth', type=int, default=defaults.chain_depth)
+    parser.add_argument('--post-words', type=int, default=defaults.post_words)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--no-index', action='store_true', help='skip building the search index')
+    args = parser.parse_args(argv)
+    spec = SeedSpec(users=args.users, posts=args.posts, comments_per_post=args.comments_per_post,
+                    max_depth=args.max_depth, chain_depth=args.chain_depth, post_words=args.post_words,
+                    seed=args.seed)
+    counts = seed_database(args.database, spec, index=not args.no_index)
+    print(', '.join(f'{count} {name}' for name, count in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
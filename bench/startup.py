@@ -0,0 +1,73 @@
+"""Cold-start benchmark: how long ``import main`` and the first response take.
+
+Each run is a fresh interpreter, so nothing is shared between samples::
+
+    python -m bench.startup --runs 10 --max-import-ms 800 --max-first-response-ms 1200
+
+Exits non-zero when the median of either measurement is over its budget.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON line of timings in milliseconds
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+with main.app.app_context():
+    main.db.create_all()
+response = main.app.test_client().get('/')
+responded = time.perf_counter()
+assert response.status_code == 200, response.status_code
+heavy = [name for name in ('smtplib', 'pywebpush', 'cryptography') if name in sys.modules]
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_response_ms': (responded - started) * 1000,
+    'heavy_modules': heavy,
+}))
+"""
+
+
+def sample() -> dict:
+    env = dict(os.environ, DATABASE_URL='sqlite:///:memory:', SECRET_KEY='bench', SCHEMA_CHECK='0')
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float, default=None)
+    parser.add_argument('--max-first-response-ms', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    samples = [sample() for _ in range(args.runs)]
+    import_ms = statistics.median(s['import_ms'] for s in samples)
+    first_response_ms = statistics.median(s['first_response_ms'] for s in samples)
+    heavy = sorted({name for s in samples for name in s['heavy_modules']})
+    print(f'import main:     {import_ms:8.1f} ms (median of {args.runs})')
+    print(f'first response:  {first_response_ms:8.1f} ms')
+    if heavy:
+        print(f'eagerly loaded:  {", ".join(heavy)}')
+
+    over = []
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        over.append(f'import took {import_ms:.0f} ms, budget {args.max_import_ms:.0f} ms')
+    if args.max_first_response_ms is not None and first_response_ms > args.max_first_response_ms:
+        over.append(f'first response took {first_response_ms:.0f} ms, budget {args.max_first_response_ms:.0f} ms')
+    for message in over:
+        print(f'OVER BUDGET: {message}', file=sys.stderr)
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,464 @@
+import os
+from datetime import date, datetime
+from functools import wraps
+
+from flask import Blueprint, abort, current_app, flash, make_response, redirect, render_template, request, \
+    send_file, send_from_directory, session, stream_with_context, url_for
+from flask_login import current_user, login_required
+from markupsafe import Markup
+from sqlalchemy.orm import joinedload, defer
+
+import notifications
+from avatars import AvatarStore, sniff_image_type
+from content import sanitize_html
+from dbrouting import read_only
+from extensions import admin_required, db, page_cache, search_index
+from forms import CreatePostForm, CommentForm
+from models import BlogPost, Comment, User, apply_post_body, comment_path, email_hash
+from pagecache import LRUCache
+
+
+bp = Blueprint('blog', __name__)
+
+AVATAR_MAX_AGE = 7 * 24 * 3600
+DEFAULT_AVATAR_MAX_AGE = 3600
+
+
+def init_app(app):
+    app.extensions['avatar_store'] = AvatarStore(
+        app.config['AVATAR_CACHE_DIR'] or os.path.join(app.instance_path, 'avatars'),
+        app.config['AVATAR_UPSTREAM'],
+        max_bytes=app.config['AVATAR_CACHE_MAX_BYTES'],
+    )
+    app.extensions['avatar_hashes'] = LRUCache(maxsize=4096)
+    app.register_blueprint(bp)
+
+
+POSTS_PER_PAGE = 10
+
+
+def encode_post_cursor(post: BlogPost) -> str:
+    return f'{post.published_at.isoformat()}_{post.id}'
+
+
+def decode_post_cursor(cursor: str) -> tuple[datetime, int]:
+    published_at, _, post_id = cursor.rpartition('_')
+    return datetime.fromisoformat(published_at), int(post_id)
+
+
+@bp.route('/')
+@read_only
+@page_cache.cached(lambda: ['posts', 'activity'])
+def get_all_posts():
+    query = (
+        db.select(BlogPost)
+        .options(defer(BlogPost.body), defer(BlogPost.body_html), joinedload(BlogPost.author))
+        .order_by(BlogPost.published_at.desc(), BlogPost.id.desc())
+        .limit(POSTS_PER_PAGE + 1)
+    )
+    before = request.args.get('before')
+    if before:
+        try:
+            published_at, post_id = decode_post_cursor(before)
+        except ValueError:
+            abort(400)
+        query = query.where(db.or_(
+            BlogPost.published_at < published_at,
+            db.and_(BlogPost.published_at == published_at, BlogPost.id < post_id),
+        ))
+    posts = db.session.execute(query).scalars().all()
+    next_cursor = None
+    if len(posts) > POSTS_PER_PAGE:
+        posts = posts[:POSTS_PER_PAGE]
+        next_cursor = encode_post_cursor(posts[-1])
+    return render_template("index.html", all_posts=posts, next_cursor=next_cursor, current_user=current_user)
+
+
+# Threads shown per page of a post, and per streamed chunk of that page
+COMMENT_THREADS_PER_PAGE = 100
+COMMENT_CHUNK_SIZE = 20
+
+
+class CommentThreads:
+    """A page of a post's comment threads, newest first, read ``chunk_size`` threads at a time.
+
+    Top-level comments come from a server-side cursor; each chunk's replies
+    are fetched in one range scan over the materialized paths of its roots.
+    Iterating yields ``(roots, replies_by_parent)`` pairs with replies in the
+    order they were written. Once exhausted, ``next_before`` is the cursor of
+    the following page, or ``None`` on the last one.
+    """
+
+    def __init__(self, post_id: int, before: int | None = None, limit: int | None = None,
+                 chunk_size: int | None = None):
+        self.post_id = post_id
+        self.before = before
+        self.limit = limit or COMMENT_THREADS_PER_PAGE
+        self.chunk_size = chunk_size or COMMENT_CHUNK_SIZE
+        self.next_before = None
+
+    def __iter__(self):
+        query = (
+            db.select(Comment)
+            .where(Comment.post_id == self.post_id, Comment.parent_id.is_(None))
+            .options(joinedload(Comment.author))
+            .order_by(Comment.id.desc())
+            .limit(self.limit + 1)
+            .execution_options(yield_per=self.chunk_size)
+        )
+        if self.before:
+            query = query.where(Comment.id < self.before)
+        self.next_before = None
+        shown, last_id = 0, None
+        for roots in db.session.scalars(query).partitions():
+            if shown + len(roots) > self.limit:
+                # the extra row only tells us there is another page
+                roots = roots[:self.limit - shown]
+                self.next_before = roots[-1].id if roots else last_id
+            if roots:
+                shown += len(roots)
+                last_id = roots[-1].id
+                # most threads have no replies; then there is nothing to look up
+                replies = self._replies(roots) if any(root.reply_count for root in roots) else {}
+                yield roots, replies
+
+    def collect(self):
+        """The whole page at once: its roots and one ``{parent_id: [replies]}`` mapping."""
+        comments, replies_by_parent = [], {}
+        for roots, replies in self:
+            comments.extend(roots)
+            replies_by_parent.update(replies)
+        return comments, replies_by_parent
+
+    def _replies(self, roots):
+        # roots come newest first, so every path under them sorts between these bounds
+        low, high = comment_path(None, roots[-1].id), comment_path(None, roots[0].id)
+        replies = db.session.scalars(
+            db.select(Comment)
+            .where(Comment.post_id == self.post_id, Comment.parent_id.is_not(None),
+                   Comment.path >= low, Comment.path < high + '0')
+            .options(joinedload(Comment.author))
+            .order_by(Comment.created_at, Comment.id)
+        )
+        replies_by_parent = {}
+        for reply in replies:
+            replies_by_parent.setdefault(reply.parent_id, []).append(reply)
+        return replies_by_parent
+
+
+def more_comments_url(threads: CommentThreads) -> str | None:
+    if threads.next_before is None:
+        return None
+    return url_for('blog.more_comments', post_id=threads.post_id, before=threads.next_before)
+
+
+def stream_post(post: BlogPost, form: CommentForm):
+    """Send the header and article right away, then the comment threads chunk by chunk."""
+    threads = CommentThreads(post.id)
+
+    def generate():
+        yield render_template('_post_top.html', post=post, form=form)
+        for roots, replies_by_parent in threads:
+            yield render_template('_comments.html', comments=roots, replies_by_parent=replies_by_parent,
+                                  form=form)
+        more_url = more_comments_url(threads)
+        if more_url:
+            yield render_template('_comments.html', comments=[], replies_by_parent={}, form=form, more_url=more_url)
+        yield render_template('_post_bottom.html')
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='text/html')
+
+
+def offline_cacheable(view):
+    """Mark pages anonymous visitors get with ``X-Offline-Cacheable``, so the service worker keeps them.
+
+    Decided before the view runs, since rendering consumes the flashed messages.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cacheable = request.method == 'GET' and not current_user.is_authenticated and not session.get('_flashes')
+        response = make_response(view(*args, **kwargs))
+        if cacheable and response.status_code == 200:
+            response.headers['X-Offline-Cacheable'] = '1'
+        return response
+
+    return wrapper
+
+
+@bp.route("/post/<int:post_id>", methods=["GET", "POST"])
+@read_only
+@offline_cacheable
+@page_cache.cached(lambda post_id: ['posts', f'post:{post_id}'])
+def show_post(post_id):
+    requested_post = db.get_or_404(BlogPost, post_id, options=[joinedload(BlogPost.author)])
+    form = CommentForm()
+    parent_id = request.form.get('parent_id')
+    if form.validate_on_submit():
+        if not current_user.is_authenticated:
+            flash("You need to log in or register to comment.")
+
+        parent = None
+        if parent_id:
+            if not parent_id.isdecimal():
+                abort(400)
+            parent = db.session.get(Comment, int(parent_id))
+            if parent is None or parent.post_id != post_id:
+                abort(400)
+        comment = Comment(
+            content=sanitize_html(form.comment_text.data),
+            author_id=current_user.id, 
+            post_id=post_id,
+            parent_id=parent.id if parent else None,
+            depth=parent.depth + 1 if parent else 0,
+        )
+        db.session.add(comment)
+        db.session.flush()
+        comment.path = comment_path(parent, comment.id)
+        count_comments(post_id, 1, comment.created_at)
+        if parent:
+            db.session.execute(
+                db.update(Comment).where(Comment.id == parent.id).values(reply_count=Comment.reply_count + 1),
+                execution_options={'synchronize_session': False},
+            )
+        search_index.index_comment(comment)
+        post_author = requested_post.author
+        if post_author.email:
+            notifications.enqueue_notification('email', to_addr=post_author.email, subject='New comment', body=form.comment_text.data)
+        notifications.enqueue_notification('push', title='New comment', body=form.comment_text.data, user_id=post_author.id)
+        db.session.commit()
+        page_cache.invalidate(f'post:{post_id}', 'activity')
+        flash("Comment added successfully.")
+        return redirect(url_for('blog.show_post', post_id=post_id))
+    
+    if current_app.config['STREAM_POST_PAGES']:
+        return stream_post(requested_post, form)
+    threads = CommentThreads(post_id)
+    comments, replies_by_parent = threads.collect()
+    return render_template("post.html", post=requested_post, current_user=current_user, form=form,
+                           comments=comments, replies_by_parent=replies_by_parent, more_url=more_comments_url(threads))
+
+
+@bp.route("/post/<int:post_id>/comments")
+@read_only
+@page_cache.cached(lambda post_id: [f'post:{post_id}'])
+def more_comments(post_id):
+    """A later page of a post's threads as an HTML fragment for the "Load more comments" link."""
+    threads = CommentThreads(post_id, before=request.args.get('before', type=int))
+    comments, replies_by_parent = threads.collect()
+    return render_template("_comments.html", comments=comments, replies_by_parent=replies_by_parent,
+                           form=CommentForm(), more_url=more_comments_url(threads))
+
+
+def count_comments(post_id: int, change: int, created_at: datetime | None = None):
+    """Add ``change`` to a post's comment count in SQL, so concurrent writers never lose an update.
+
+    A new comment passes its ``created_at``; after deletions the last
+    comment time is looked up again, since the newest one may be gone.
+    """
+    if created_at is not None:
+        last_comment_at = db.case((BlogPost.last_comment_at > created_at, BlogPost.last_comment_at),
+                                  else_=created_at)
+    else:
+        last_comment_at = (db.select(db.func.max(Comment.created_at))
+                           .where(Comment.post_id == post_id).scalar_subquery())
+    db.session.execute(
+        db.update(BlogPost).where(BlogPost.id == post_id)
+        .values(comment_count=BlogPost.comment_count + change, last_comment_at=last_comment_at),
+        execution_options={'synchronize_session': False},
+    )
+
+
+def comment_subtree(comment: Comment) -> tuple:
+    """Criteria matching a comment and all of its replies: one range of the materialized paths."""
+    if not comment.path:
+        # not backfilled yet: walk parent_id instead, once, since deleting detaches the replies
+        subtree = db.select(Comment.id).where(Comment.id == comment.id).cte('subtree', recursive=True)
+        subtree = subtree.union_all(db.select(Comment.id).where(Comment.parent_id == subtree.c.id))
+        return (Comment.id.in_(db.session.execute(db.select(subtree.c.id)).scalars().all()),)
+    # reply paths continue with '/', which sorts just before '0'
+    return Comment.post_id == comment.post_id, Comment.path >= comment.path, Comment.path < comment.path + '0'
+
+
+def delete_comments(*criteria) -> list[int]:
+    """Delete the comments matching ``criteria`` in bulk and return their ids.
+
+    SQLite runs ``ON DELETE CASCADE`` row by row as nested triggers, so a
+    long reply chain would run past its trigger depth limit; detaching the
+    matched rows from their parents first leaves nothing to cascade.
+    Postgres cascades after the statement, when the rows are already gone.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(
+            db.update(Comment).where(*criteria, Comment.parent_id.is_not(None)).values(parent_id=None),
+            execution_options={'synchronize_session': False},
+        )
+    return db.session.execute(
+        db.delete(Comment).where(*criteria).returning(Comment.id),
+        execution_options={'synchronize_session': False},
+    ).scalars().all()
+
+
+@bp.route('/search')
+@read_only
+def search():
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    hits, has_next = search_index.search(query, page=page)
+    post_ids = {hit.post_id for hit in hits}
+    titles = dict(db.session.execute(
+        db.select(BlogPost.id, BlogPost.title).where(BlogPost.id.in_(post_ids))
+    ).all()) if post_ids else {}
+    return render_template("search.html", query=query, hits=hits, titles=titles, page=page,
+                           has_next=has_next, current_user=current_user)
+
+
+@bp.route("/new-post", methods=["GET", "POST"])
+@login_required
+@admin_required
+def add_new_post():
+    form = CreatePostForm()
+    if form.validate_on_submit():
+        new_post = BlogPost(
+            title=form.title.data,
+            subtitle=form.subtitle.data,
+            img_url=form.img_url.data,
+            author_id=current_user.id,
+            date=date.today().strftime("%B %d, %Y"),
+            published_at=datetime.utcnow(),
+        )
+        apply_post_body(new_post, form.body.data)
+        db.session.add(new_post)
+        db.session.flush()
+        search_index.index_post(new_post)
+        notifications.enqueue_notification('email_all', subject=f'New post: {new_post.title}', body=new_post.subtitle)
+        notifications.enqueue_notification('push', title='New post', body=new_post.title)
+        db.session.commit()
+        page_cache.invalidate('posts')
+        return redirect(url_for("blog.get_all_posts"))
+    
+    return render_template("make-post.html", form=form, current_user=current_user)
+
+
+@bp.route("/edit-post/<int:post_id>", methods=["GET", "POST"])
+@login_required
+@admin_required
+def edit_post(post_id):
+    post = db.get_or_404(BlogPost, post_id)
+    edit_form = CreatePostForm(
+        title=post.title,
+        subtitle=post.subtitle,
+        img_url=post.img_url,
+        author=post.author,
+        body=post.body
+    )
+    if edit_form.validate_on_submit():
+        post.title = edit_form.title.data
+        post.subtitle = edit_form.subtitle.data
+        post.img_url = edit_form.img_url.data
+        post.author_id = current_user.id
+        apply_post_body(post, edit_form.body.data)
+        search_index.index_post(post)
+        db.session.commit()
+        page_cache.invalidate('posts', f'post:{post.id}')
+        return redirect(url_for("blog.show_post", post_id=post.id))
+    
+    return render_template("make-post.html", form=edit_form, is_edit=True, current_user=current_user)
+
+@bp.route("/delete/<int:post_id>")
+@login_required
+@admin_required
+def delete_post(post_id):
+    post_to_delete = db.get_or_404(BlogPost, post_id)
+    comment_ids = delete_comments(Comment.post_id == post_id)
+    search_index.remove(post_ids=[post_id], comment_ids=comment_ids)
+    db.session.delete(post_to_delete)
+    db.session.commit()
+    page_cache.invalidate('posts', f'post:{post_id}')
+    return redirect(url_for('blog.get_all_posts'))
+
+
+@bp.route('/avatar/<int:user_id>')
+def avatar(user_id):
+    hash_ = current_app.extensions['avatar_hashes'].get(user_id)
+    if hash_ is None:
+        row = db.session.execute(db.select(User.email_hash, User.email).where(User.id == user_id)).first()
+        if row is None:
+            abort(404)
+        hash_ = row.email_hash
+        if not hash_:
+            # registered before hashes were stored
+            hash_ = email_hash(row.email)
+            db.session.execute(db.update(User).where(User.id == user_id).values(email_hash=hash_))
+            db.session.commit()
+        current_app.extensions['avatar_hashes'].set(user_id, hash_)
+    store = current_app.extensions['avatar_store']
+    # a second try refetches an image another request evicted after get() returned it
+    for _ in range(2):
+        path = store.get(hash_)
+        if path is None:
+            break
+        try:
+            with open(path, 'rb') as image:
+                mimetype = sniff_image_type(image.read(16))
+            return send_file(path, mimetype=mimetype, max_age=AVATAR_MAX_AGE)
+        except FileNotFoundError:
+            continue
+    return send_from_directory(current_app.static_folder, 'assets/img/default-profile.jpg',
+                               max_age=DEFAULT_AVATAR_MAX_AGE)
+
+
+@bp.route("/about")
+def about():
+    return render_template("about.html")
+
+@bp.route("/delete-comment/<int:comment_id>")
+@login_required
+def delete_comment(comment_id):
+    comment = db.get_or_404(Comment,comment_id)
+    if comment.author_id != current_user.id and not current_user.is_admin:
+        abort(403)
+    post_id, parent_id = comment.post_id, comment.parent_id
+    removed = delete_comments(*comment_subtree(comment))
+    db.session.expunge(comment)
+    search_index.remove(comment_ids=removed)
+    count_comments(post_id, -len(removed))
+    if parent_id:
+        db.session.execute(
+            db.update(Comment).where(Comment.id == parent_id).values(reply_count=Comment.reply_count - 1),
+            execution_options={'synchronize_session': False},
+        )
+    db.session.commit()
+    page_cache.invalidate(f'post:{post_id}', 'activity')
+    flash("Comment deleted successfully.")
+    return redirect(url_for("blog.show_post", post_id=post_id))
+
+
+@bp.route("/contact", methods=["GET", "POST"])
+def contact():
+    if request.method == "POST":
+        name = request.form['name']
+        email = request.form['email']
+        phone = request.form['phone']
+        message = request.form['message']
+
+        notifications.send_email(
+            to_addr=current_app.config['MAIL_ADDRESS'],
+            subject=f"Message from {name} <{email}>",
+            body=message
+        )
+        flash("Thanks! Your note is on its way.")
+        return redirect(url_for("blog.contact"))
+    
+    return render_template("contact.html")
+
+
+@bp.app_template_filter('sanitize_html')
+def sanitize_html_filter(markup):
+    # only for rows saved before bodies were compiled on write
+    return Markup(sanitize_html(markup))
+
+
+@bp.app_context_processor
+def inject_now():
+    return {'now': datetime.utcnow, 'vapid_public_key': current_app.config['VAPID_PUBLIC_KEY']}
@@ -0,0 +1,100 @@
+import sys
+import time
+
+import click
+from flask import Blueprint, current_app
+
+import assets
+import migrations
+import transfer
+from extensions import db, page_cache, search_index
+from models import BlogPost, Comment
+
+
+bp = Blueprint('commands', __name__, cli_group=None)
+
+
+@bp.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations."""
+    applied = migrations.upgrade(db.engine, db.metadata)
+    if applied:
+        click.echo(f'Applied migrations {", ".join(map(str, applied))}.')
+    click.echo(f'Schema is at version {migrations.LATEST_VERSION}.')
+
+
+@bp.cli.command('db-version')
+def db_version_command():
+    """Show the database's schema version."""
+    with db.engine.connect() as connection:
+        click.echo(f'{migrations.current_version(connection)} (latest {migrations.LATEST_VERSION})')
+
+
+@bp.cli.command('search-rebuild')
+def search_rebuild_command():
+    """Rebuild the full-text index from all posts and comments."""
+    count = search_index.rebuild(db.select(BlogPost), db.select(Comment))
+    click.echo(f'Indexed {count} documents.')
+
+
+@bp.cli.command('build-assets')
+def build_assets_command():
+    """Write hashed, precompressed copies of the static files for the app to serve."""
+    app = current_app
+    output = assets.build_dir(app)
+    manifest = assets.build_assets(app.static_folder, output)
+    encoded = sum(bool(entry['encodings']) for entry in manifest.values())
+    webp = sum(len(entry.get('webp', {})) for entry in manifest.values())
+    click.echo(f'Built {len(manifest)} files into {output} ({encoded} precompressed, {webp} WebP variants).')
+    click.echo('Restart the app to serve them.')
+
+
+@bp.cli.command('repair-counters')
+def repair_counters_command():
+    """Recompute comment counts, last comment times and reply counts from the comments table."""
+    with db.engine.begin() as connection:
+        migrations.recount_activity(connection, db.metadata)
+    page_cache.invalidate('posts', 'activity')
+    click.echo('Recounted post and comment activity.')
+
+
+def _progress_reporter():
+    started = time.monotonic()
+
+    def report(kind, count):
+        rate = count / max(time.monotonic() - started, 1e-9)
+        click.echo(f'{kind}: {count} rows ({rate:.0f}/s)', err=True)
+
+    return report
+
+
+@bp.cli.command('export-data')
+@click.argument('output', type=click.Path(dir_okay=False, allow_dash=True), default='-')
+@click.option('--batch-size', default=transfer.BATCH_SIZE, show_default=True, help='Rows fetched per round trip.')
+@click.option('--resume', is_flag=True, help='Continue an interrupted export into OUTPUT.')
+def export_data_command(output, batch_size, resume):
+    """Write users, posts, comments and push subscriptions to OUTPUT as JSON lines."""
+    if resume and output == '-':
+        raise click.UsageError('--resume needs an OUTPUT file.')
+    start = transfer.last_exported(output) if resume else None
+    if start:
+        click.echo(f'Resuming after {start[0]} {start[1]}.', err=True)
+    out = sys.stdout if output == '-' else open(output, 'a' if resume else 'w', encoding='utf-8')
+    try:
+        counts = transfer.export_records(db, out.write, batch_size, start=start, progress=_progress_reporter())
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    click.echo('Exported ' + ', '.join(f'{count} {kind}s' for kind, count in counts.items()) + '.', err=True)
+
+
+@bp.cli.command('import-data')
+@click.argument('input', type=click.File('r', encoding='utf-8'), default='-')
+@click.option('--batch-size', default=transfer.BATCH_SIZE, show_default=True, help='Rows per transaction.')
+@click.option('--resume', is_flag=True, help='Skip the rows an interrupted import already committed.')
+def import_data_command(input, batch_size, resume):
+    """Load JSON lines written by export-data (or in the same format) into the database."""
+    counts = transfer.import_records(db, input, batch_size, resume=resume, progress=_progress_reporter())
+    page_cache.invalidate('posts')
+    click.echo('Imported ' + ', '.join(f'{count} {kind}s' for kind, count in counts.items()) + '.', err=True)
+    click.echo('Run `flask search-rebuild` to index the imported posts and comments.', err=True)
@@ -0,0 +1,69 @@
+"""gzip for rendered responses.
+
+Pages, fragments and JSON are compressed on the way out when the client
+accepts gzip. Streamed post pages are compressed chunk by chunk with a sync
+flush after each, so the browser still gets the top of the page right away.
+Files under ``static/`` are left alone here: ``flask build-assets``
+precompresses them once, see assets.py.
+"""
+import gzip
+import zlib
+
+from flask import request
+
+from streaming import after_stream
+
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'application/xml', 'image/svg+xml',
+}
+# wbits for zlib's gzip container
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def _gzip_chunks(body, level: int):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in body:
+        data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        # flush every chunk, or a streamed page would sit in the compressor's buffer
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response, level: int = 6, min_size: int = 500):
+    """gzip ``response`` in place if it is text the client accepts compressed; otherwise leave it be."""
+    if (request.method == 'HEAD'
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    if response.is_streamed:
+        body = response.response
+        response.response = after_stream(body, chunks=_gzip_chunks(body, level))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(gzip.compress(data, level, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # the same entity in another encoding: still a match for If-None-Match, which compares weakly
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    @app.after_request
+    def compress(response):
+        if not app.config['COMPRESS_RESPONSES']:
+            return response
+        return compress_response(response, app.config['COMPRESS_LEVEL'], app.config['COMPRESS_MIN_SIZE'])
@@ -0,0 +1,135 @@
+import hashlib
+import math
+import re
+from dataclasses import dataclass
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+
+ALLOWED_TAGS = {
+    'a', 'b', 'blockquote', 'br', 'code', 'del', 'div', 'em', 'figcaption', 'figure', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 's', 'span', 'strong', 'sub', 'sup',
+    'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+    'ol': {'start'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_SCHEMES = {'', 'http', 'https', 'mailto'}
+VOID_TAGS = {'br', 'hr', 'img'}
+# dropped together with everything inside them
+DROP_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'template', 'noscript'}
+
+WORDS_PER_MINUTE = 200
+EXCERPT_WORDS = 40
+
+_SPACES = re.compile(r'\s+')
+
+
+def _safe_url(value: str) -> bool:
+    # browsers ignore whitespace and control characters inside the scheme
+    cleaned = ''.join(ch for ch in value if ch > ' ').lower()
+    return urlparse(cleaned).scheme in ALLOWED_SCHEMES
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.text = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping:
+            return
+        self.text.append(' ')
+        if tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        rendered = ''
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES and not _safe_url(value):
+                continue
+            rendered += f' {name}="{escape(value, quote=True)}"'
+        if tag == 'a' and 'href' in rendered:
+            rendered += ' rel="nofollow noopener"'
+        self.out.append(f'<{tag}{rendered}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # close anything left open inside this element so the output stays balanced
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.out.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+        self.text.append(' ')
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.out.append(escape(data, quote=False))
+            self.text.append(data)
+
+    def result(self) -> tuple[str, str]:
+        self.close()
+        closing = ''.join(f'</{tag}>' for tag in reversed(self.open_tags))
+        return ''.join(self.out) + closing, _SPACES.sub(' ', ''.join(self.text)).strip()
+
+
+def sanitize_html(markup: str | None) -> str:
+    """Keep a safe subset of the editor's HTML: known tags, known attributes and safe URLs."""
+    sanitizer = _Sanitizer()
+    sanitizer.feed(markup or '')
+    return sanitizer.result()[0]
+
+
+def html_to_text(markup: str | None) -> str:
+    sanitizer = _Sanitizer()
+    sanitizer.feed(markup or '')
+    return sanitizer.result()[1]
+
+
+@dataclass
+class CompiledContent:
+    html: str
+    text: str
+    excerpt: str
+    word_count: int
+    reading_minutes: int
+    content_hash: str
+
+
+def compile_content(markup: str | None, excerpt_words: int = EXCERPT_WORDS) -> CompiledContent:
+    """Everything the read paths need from a rich-text body, computed once when it is saved."""
+    sanitizer = _Sanitizer()
+    sanitizer.feed(markup or '')
+    html, text = sanitizer.result()
+    words = text.split()
+    excerpt = ' '.join(words[:excerpt_words])
+    if len(words) > excerpt_words:
+        excerpt += '…'
+    return CompiledContent(
+        html=html,
+        text=text,
+        excerpt=excerpt,
+        word_count=len(words),
+        reading_minutes=max(1, math.ceil(len(words) / WORDS_PER_MINUTE)),
+        content_hash=hashlib.sha256(html.encode()).hexdigest(),
+    )
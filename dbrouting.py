@@ -0,0 +1,199 @@
+"""Primary/replica routing and connection pool settings.
+
+Replicas are engines built from ``DATABASE_REPLICA_URLS`` and named
+``replica_<n>``. They are kept out of Flask-SQLAlchemy's binds so
+``db.create_all()`` and migrations never touch them. ``RoutingSession`` sends a request's reads to one of them when the view is marked
+``@read_only`` and nothing in the request has written yet. Everything else
+goes to the primary (the default bind), including every read for a few
+seconds after the visitor's own writes so they always see them.
+"""
+import logging
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, jsonify, request, session as http_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+REPLICA_PREFIX = 'replica_'
+# flask session key holding the time until which this visitor reads from the primary
+STICKY_KEY = '_db_primary_until'
+
+
+def normalize_database_url(url: str) -> str:
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url
+
+
+def is_memory_sqlite(url: str) -> bool:
+    url = make_url(url)
+    return url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:')
+
+
+def pool_options(url: str, config) -> dict:
+    """Engine pool options from ``DB_POOL_*`` settings; in-memory SQLite keeps its single static connection."""
+    if is_memory_sqlite(url):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def enable_sqlite_foreign_keys(engine):
+    """SQLite ignores foreign keys, ``ON DELETE CASCADE`` included, unless each connection turns them on."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _foreign_keys_on(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+def read_only(view):
+    """Let GET/HEAD requests to ``view`` read from a replica."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            g.db_read_only = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def _note_write():
+    if has_request_context():
+        g.db_wrote = True
+
+
+class RoutingSession(Session):
+    """``db.session`` that sends the reads of read-only requests to a replica."""
+
+    def _reads_from_replica(self, clause) -> bool:
+        if not has_request_context() or not g.get('db_read_only') or g.get('db_wrote'):
+            return False
+        if self._flushing or getattr(clause, 'is_dml', False):
+            return False
+        now = time.time()
+        if http_session.get(STICKY_KEY, 0) > now:
+            return False
+        # pages rebuilt right after someone else's write must not be cached from a lagging replica
+        lag = current_app.config['DB_REPLICA_STICKY_SECONDS']
+        return g.get('data_changed_at', 0) <= now - lag
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if getattr(clause, 'is_dml', False):
+                _note_write()
+            elif self._reads_from_replica(clause):
+                replica = g.get('db_replica')
+                replicas = current_app.extensions['db_replicas']
+                if replica is None and replicas:
+                    replica = g.db_replica = random.choice(list(replicas.values()))
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    _note_write()
+
+
+class PoolMonitor:
+    """Counts checkouts per engine and logs when a pool has no idle connection left."""
+
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.checkouts = 0
+        self.saturated = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'checkout', self._checkout)
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        pool = self.engine.pool
+        checked_out = pool.checkedout() if hasattr(pool, 'checkedout') else 0
+        with self._lock:
+            self.checkouts += 1
+            self.peak = max(self.peak, checked_out)
+            limit = self.limit()
+            saturated = bool(limit and checked_out >= limit)
+            if saturated:
+                self.saturated += 1
+        metrics.POOL_CHECKOUTS.inc(bind=self.name)
+        if saturated:
+            metrics.POOL_SATURATED.inc(bind=self.name)
+            logger.warning('Connection pool for %s is saturated (%s connections in use)', self.name, checked_out)
+
+    def limit(self) -> int | None:
+        """Most connections the pool hands out at once, or ``None`` if unbounded."""
+        pool = self.engine.pool
+        max_overflow = getattr(pool, '_max_overflow', -1)
+        if not hasattr(pool, 'size') or max_overflow < 0:
+            return None
+        return pool.size() + max_overflow
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        return {
+            'pool': type(pool).__name__,
+            'size': pool.size() if hasattr(pool, 'size') else None,
+            'limit': self.limit(),
+            'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+            'peak_checked_out': self.peak,
+            'checkouts': self.checkouts,
+            'saturated_checkouts': self.saturated,
+        }
+
+
+def pool_stats(app=None) -> dict:
+    """Pool usage of every bind, keyed by ``primary`` and the replica bind names."""
+    app = app or current_app
+    return {name: monitor.stats() for name, monitor in app.extensions['db_pool_monitors'].items()}
+
+
+def configure(app):
+    """Apply the ``DB_POOL_*`` settings to the primary engine; must run before ``db.init_app(app)``."""
+    config = app.config
+    config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', pool_options(config['SQLALCHEMY_DATABASE_URI'], config))
+
+
+def init_app(app, db):
+    replicas = {}
+    for index, url in enumerate(app.config['DATABASE_REPLICA_URLS']):
+        url = normalize_database_url(url)
+        replicas[f'{REPLICA_PREFIX}{index}'] = create_engine(url, **pool_options(url, app.config))
+    app.extensions['db_replicas'] = replicas
+    with app.app_context():
+        engines = {'primary': db.engine, **replicas}
+    # replicas only ever hold rows the primary already checked
+    enable_sqlite_foreign_keys(engines['primary'])
+    app.extensions['db_pool_monitors'] = {name: PoolMonitor(name, engine) for name, engine in engines.items()}
+
+    @app.after_request
+    def stick_to_primary_after_writes(response):
+        if g.get('db_wrote') and app.config['DATABASE_REPLICA_URLS']:
+            http_session[STICKY_KEY] = time.time() + app.config['DB_REPLICA_STICKY_SECONDS']
+        return response
+
+    if app.config.get('SQL_PROFILE'):
+        @app.route('/_debug/pool')
+        def db_pool_report():
+            return jsonify(pool_stats(app))
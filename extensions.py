@@ -0,0 +1,36 @@
+"""Extension objects shared by the blueprints; ``create_app`` binds them to an app."""
+from functools import wraps
+
+from flask import flash, redirect, url_for
+from flask_bootstrap import Bootstrap5
+from flask_ckeditor import CKEditor
+from flask_login import LoginManager, current_user
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import DeclarativeBase
+
+from dbrouting import RoutingSession
+from pagecache import PageCache
+from search import SearchIndex
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
+login_manager = LoginManager()
+ckeditor = CKEditor()
+bootstrap = Bootstrap5()
+page_cache = PageCache()
+search_index = SearchIndex(db)
+
+
+# Admin-only decorator
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kargs):
+        if not current_user.is_authenticated or not current_user.is_admin:
+            flash('Only admins can access this page.')
+            return redirect(url_for('blog.get_all_posts'))
+        return f(*args, **kargs)
+    return decorated_function
@@ -0,0 +1,27 @@
+"""Gunicorn settings, picked up automatically by ``gunicorn main:app``.
+
+They give the workers a shared ``METRICS_DIR`` so ``/metrics`` reports all
+of them, whichever worker answers the scrape.
+"""
+import os
+import shutil
+import tempfile
+
+import metrics
+
+
+# one directory per master, set before the workers fork so they all inherit it
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'blog-metrics-{os.getpid()}'))
+
+
+def on_starting(server):
+    metrics.clear_directory(os.environ['METRICS_DIR'])
+
+
+def child_exit(server, worker):
+    metrics.mark_process_dead(worker.pid, os.environ['METRICS_DIR'])
+
+
+def on_exit(server):
+    if os.path.basename(os.environ['METRICS_DIR']).startswith('blog-metrics-'):
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
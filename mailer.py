@@ -0,0 +1,169 @@
+import queue
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from email.message import EmailMessage
+
+import metrics
+
+
+# Errors after which the session is unusable and we should dial again.
+# 421 is the server telling us to go away (throttling, idle timeout, shutdown).
+def _is_disconnect(exc: Exception) -> bool:
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)):
+        return True
+    return isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code == 421
+
+
+class BulkSendError(Exception):
+    """Raised by ``send_bulk`` when some recipients could not be delivered to."""
+
+    def __init__(self, failed: dict[str, Exception]):
+        self.failed = failed
+        super().__init__(f'{len(failed)} message(s) failed: {", ".join(failed)}')
+
+
+class _PooledConnection:
+    def __init__(self, pool: 'SMTPPool'):
+        self.pool = pool
+        self.smtp = pool._connect()
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def reconnect(self):
+        self.close()
+        self.smtp = self.pool._connect()
+        self.sent = 0
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+
+
+class SMTPPool:
+    """A small pool of logged-in SMTP sessions that are reused across messages.
+
+    At most ``size`` sessions are open at once. A session is recycled after
+    ``max_messages_per_connection`` messages (most providers cap this) and is
+    probed with NOOP before reuse when it has been idle for ``idle_check`` seconds.
+    """
+
+    def __init__(self, host: str, port: int, username: str | None = None, password: str | None = None,
+                 starttls: bool = True, size: int = 2, timeout: float = 30,
+                 max_messages_per_connection: int = 100, idle_check: float = 30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.max_messages_per_connection = max_messages_per_connection
+        self.idle_check = idle_check
+        self._idle: queue.LifoQueue[_PooledConnection] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def _checkout(self) -> _PooledConnection:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            return _PooledConnection(self)
+        if time.monotonic() - conn.last_used > self.idle_check:
+            try:
+                status, _ = conn.smtp.noop()
+                if status != 250:
+                    conn.reconnect()
+            except Exception:
+                conn.reconnect()
+        return conn
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        except Exception as exc:
+            # don't hand a broken session to the next caller
+            if conn is not None and _is_disconnect(exc):
+                conn.close()
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                conn.last_used = time.monotonic()
+                self._idle.put(conn)
+            self._slots.release()
+
+    def _send_one(self, conn: _PooledConnection, message: EmailMessage):
+        if conn.sent >= self.max_messages_per_connection:
+            conn.reconnect()
+        with metrics.SMTP_SECONDS.time():
+            try:
+                conn.smtp.send_message(message)
+            except Exception as exc:
+                if not _is_disconnect(exc):
+                    raise
+                # the server dropped us mid-batch: dial again and retry this message once
+                conn.reconnect()
+                conn.smtp.send_message(message)
+        conn.sent += 1
+
+    def send(self, message: EmailMessage):
+        with self.connection() as conn:
+            self._send_one(conn, message)
+
+    def send_bulk(self, messages: list[EmailMessage], chunk_size: int = 50):
+        """Send many messages, ``chunk_size`` per checkout, over as few sessions as possible.
+
+        Delivery continues past individual failures; if any occurred a
+        ``BulkSendError`` mapping recipient to exception is raised at the end.
+        If the server can't be reached at all, every message not yet tried
+        counts as failed, so a retry never repeats the ones already sent.
+        """
+        failed: dict[str, Exception] = {}
+        position = 0
+        try:
+            while position < len(messages):
+                with self.connection() as conn:
+                    for message in messages[position:position + chunk_size]:
+                        position += 1
+                        try:
+                            self._send_one(conn, message)
+                        except Exception as exc:
+                            failed[message['To']] = exc
+                            if _is_disconnect(exc):
+                                conn.reconnect()
+        except Exception as exc:
+            # connecting or reconnecting failed
+            for message in messages[position:]:
+                failed[message['To']] = exc
+        if failed:
+            raise BulkSendError(failed)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def build_message(from_addr: str, to_addr: str, subject: str, body: str) -> EmailMessage:
+    message = EmailMessage()
+    message['From'] = from_addr
+    message['To'] = to_addr
+    message['Subject'] = subject
+    message.set_content(body)
+    return message
@@ -0,0 +1,426 @@
+"""Prometheus metrics: request latency per endpoint, DB/SMTP/push timings, pool and outbox gauges.
+
+Every process counts on its own. With ``METRICS_DIR`` set (gunicorn.conf.py
+sets it for all workers), each process also writes its counts to
+``<METRICS_DIR>/<pid>.json`` every ``METRICS_FLUSH_SECONDS`` and on exit,
+and ``/metrics`` adds up the files of every worker, so it doesn't matter
+which worker answers the scrape. When a worker dies, gunicorn's
+``child_exit`` hook calls ``mark_process_dead``, which folds its counters and
+histograms into ``archive.json`` so totals survive restarts, and drops its
+gauges. Each file lists which of its metrics are gauges, since the gunicorn
+master that archives them never builds the app that registers them.
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from flask import Response, abort, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from streaming import after_stream
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+ARCHIVE = 'archive.json'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry:
+    """The metrics of one process, and the snapshot files shared with the other workers."""
+
+    def __init__(self):
+        self.metrics = {}
+        # name -> Gauge whose values are read from a callback when snapshotting
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.directory = None
+        self.flush_interval = 5.0
+        self._flusher_pid = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def configure(self, directory: str | None, flush_interval: float = 5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            data = {name: metric.samples() for name, metric in self.metrics.items()}
+        for name, gauge in list(self.gauges.items()):
+            data[name] = gauge.samples()
+        return data
+
+    def flush(self, pid: int | None = None):
+        if not self.directory:
+            return
+        _write_json(os.path.join(self.directory, f'{pid or os.getpid()}.json'),
+                    {'gauges': sorted(self.gauges), 'samples': self.snapshot()})
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def start_flusher(self):
+        """Flush in the background from this process; a no-op if already running here."""
+        if not self.directory:
+            return
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self.lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+        atexit.register(self.flush)
+
+    def collect(self) -> dict:
+        """Samples of every process: the snapshot files when sharing a directory, else just this one."""
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        totals = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            data, gauges = _read_snapshot(os.path.join(self.directory, name))
+            if name != ARCHIVE and not _is_alive(int(name[:-5])):
+                # its child_exit never came; counters are still valid, gauges are not
+                data = {key: value for key, value in data.items() if key not in gauges}
+            _merge(totals, data)
+        return totals
+
+    def expose(self) -> str:
+        totals = self.collect()
+        lines = []
+        for metric in sorted([*self.metrics.values(), *self.gauges.values()], key=lambda metric: metric.name):
+            lines.extend(metric.expose(totals.get(metric.name, [])))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry: Registry | None = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry or REGISTRY
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, **extra) -> str:
+        pairs = [*zip(self.labelnames, key), *extra.items()]
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def _header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.registry.register(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.start_flusher()
+
+    def samples(self) -> list:
+        return [[list(key), value] for key, value in self._values.items()]
+
+    def expose(self, samples: list) -> list[str]:
+        return self._header() + [f'{self.name}{self._labels(key)} {_number(value)}' for key, value in samples]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self.registry.register(self)
+
+    def observe(self, seconds: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.registry.lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + seconds)
+        self.registry.start_flusher()
+
+    @contextmanager
+    def time(self, **labels):
+        """Time the block; an ``outcome`` label, if declared, becomes ``ok`` or ``error``."""
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            if 'outcome' in self.labelnames:
+                labels['outcome'] = outcome
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list:
+        return [[list(key), list(counts), total] for key, (counts, total) in self._values.items()]
+
+    def expose(self, samples: list) -> list[str]:
+        lines = self._header()
+        for key, counts, total in samples:
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{self._labels(key, le=_number(bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(key)} {_number(total)}')
+            lines.append(f'{self.name}_count{self._labels(key)} {cumulative}')
+        return lines
+
+
+class Gauge(Metric):
+    """A value read from ``callback()`` (``{label values tuple: value}``) each time the registry snapshots.
+
+    Values from live workers are added up, so report this process's share.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple, callback, registry: Registry | None = None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.callback = callback
+        self.registry.gauges[name] = self
+
+    def samples(self) -> list:
+        return [[list(key), value] for key, value in self.callback().items()]
+
+    def expose(self, samples: list) -> list[str]:
+        return self._header() + [f'{self.name}{self._labels(key)} {_number(value)}' for key, value in samples]
+
+
+def _merge(totals: dict, data: dict):
+    """Add the samples in ``data`` into ``totals``, matching series by label values."""
+    for name, samples in data.items():
+        series = {tuple(sample[0]): sample for sample in totals.get(name, [])}
+        for sample in samples:
+            key = tuple(sample[0])
+            current = series.get(key)
+            if current is None:
+                series[key] = [list(key), *sample[1:]]
+            elif len(sample) == 3:
+                current[1] = [a + b for a, b in zip(current[1], sample[1])]
+                current[2] += sample[2]
+            else:
+                current[1] += sample[1]
+        totals[name] = list(series.values())
+
+
+def _write_json(path: str, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # removed by child_exit between listdir and open
+        return {}
+
+
+def _read_snapshot(path: str) -> tuple[dict, set]:
+    """The samples in a snapshot file and the names of its gauges."""
+    data = _read_json(path)
+    return data.get('samples', {}), set(data.get('gauges', ()))
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value) -> str:
+    if isinstance(value, str):
+        return value
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def mark_process_dead(pid: int, directory: str):
+    """Fold a dead worker's counters and histograms into the archive and forget its gauges."""
+    path = os.path.join(directory, f'{pid}.json')
+    if not os.path.exists(path):
+        return
+    samples, gauges = _read_snapshot(path)
+    data = {name: values for name, values in samples.items() if name not in gauges}
+    archive_path = os.path.join(directory, ARCHIVE)
+    archive, _ = _read_snapshot(archive_path)
+    _merge(archive, data)
+    _write_json(archive_path, {'gauges': [], 'samples': archive})
+    os.remove(path)
+
+
+def clear_directory(directory: str):
+    """Start a fresh set of snapshots; call once in the gunicorn master before workers start."""
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith('.json') or name.endswith('.tmp'):
+            os.remove(os.path.join(directory, name))
+
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to handle a request, by Flask endpoint.',
+                            ('endpoint', 'method'))
+REQUESTS = Counter('http_requests_total', 'Responses sent, by Flask endpoint and status code.',
+                   ('endpoint', 'method', 'status'))
+DB_SECONDS = Histogram('db_query_duration_seconds', 'Time spent executing SQL statements.',
+                       ('bind', 'operation'), buckets=DB_BUCKETS)
+SMTP_SECONDS = Histogram('smtp_send_duration_seconds', 'Time to hand one email to the SMTP server.', ('outcome',))
+PUSH_SECONDS = Histogram('push_send_duration_seconds', 'Time to deliver one web push, by push service status.',
+                         ('status',))
+POOL_CHECKOUTS = Counter('db_pool_checkouts_total', 'Connections checked out of each pool.', ('bind',))
+POOL_SATURATED = Counter('db_pool_saturated_total', 'Checkouts that left a pool with no idle connection.',
+                         ('bind',))
+
+# engine -> bind name as reported by dbrouting ("primary", "replica_0", ...)
+_engine_names = weakref.WeakKeyDictionary()
+_installed = False
+_OPERATIONS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_start', None)
+    if start is None:
+        return
+    operation = statement.lstrip()[:6].upper()
+    DB_SECONDS.observe(time.perf_counter() - start, bind=_engine_names.get(conn.engine, 'other'),
+                       operation=operation if operation in _OPERATIONS else 'OTHER')
+
+
+def install():
+    global _installed
+    if not _installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _installed = True
+
+
+def observe_request(start: float, endpoint: str, method: str, status: int):
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, method=method)
+    REQUESTS.inc(endpoint=endpoint, method=method, status=status)
+
+
+def _pool_gauge(app_ref, field):
+    def callback():
+        app = app_ref()
+        if app is None:
+            return {}
+        return {(name,): monitor.stats()[field] or 0 for name, monitor in app.extensions['db_pool_monitors'].items()}
+    return callback
+
+
+def outbox_depth() -> dict:
+    from extensions import db
+    from models import OutboxMessage
+
+    rows = db.session.execute(
+        db.select(OutboxMessage.status, db.func.count()).where(OutboxMessage.status != 'sent')
+        .group_by(OutboxMessage.status)
+    ).all()
+    depth = {(status,): 0 for status in ('pending', 'sending', 'dead')}
+    depth.update({(status,): count for status, count in rows})
+    return depth
+
+
+def init_app(app):
+    """Time every request and serve ``/metrics`` (behind ``METRICS_TOKEN`` if set)."""
+    install()
+    REGISTRY.configure(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_SECONDS'])
+    for name, monitor in app.extensions['db_pool_monitors'].items():
+        _engine_names[monitor.engine] = name
+    app_ref = weakref.ref(app)
+    Gauge('db_pool_checked_out', 'Connections currently checked out of each pool.', ('bind',),
+          _pool_gauge(app_ref, 'checked_out'))
+    Gauge('db_pool_limit', 'Most connections each pool will hand out at once.', ('bind',),
+          _pool_gauge(app_ref, 'limit'))
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        if response.is_streamed:
+            # the time to render the body counts too
+            method, status = request.method, response.status_code
+            response.response = after_stream(response.response,
+                                             lambda: observe_request(start, endpoint, method, status))
+        else:
+            observe_request(start, endpoint, request.method, response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_failed_request(exc):
+        # after_request is skipped when an exception propagates
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            observe_request(start, request.endpoint or 'unmatched', request.method, 500)
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+        # the queue is shared by every worker, so it is read once per scrape rather than summed
+        depth = outbox_depth()
+        lines = [
+            '# HELP outbox_messages Queued notifications that have not been sent, by status.',
+            '# TYPE outbox_messages gauge',
+            *(f'outbox_messages{{status="{status}"}} {count}' for (status,), count in sorted(depth.items())),
+        ]
+        return Response(REGISTRY.expose() + '\n'.join(lines) + '\n', content_type=CONTENT_TYPE)
@@ -0,0 +1,244 @@
+"""Versioned schema migrations.
+
+Each migration is a function of a connection and the app's metadata and is
+written to be safe on a database that already has some of its changes, since
+databases created before versioning existed start at version 0. Run them with
+``flask --app main db-upgrade``.
+"""
+import hashlib
+import logging
+from datetime import datetime
+
+from sqlalchemy import func, inspect, select, text
+
+from content import compile_content, sanitize_html
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_TABLE = 'schema_version'
+# must match models.COMMENT_PATH_WIDTH
+COMMENT_PATH_WIDTH = 10
+BATCH_SIZE = 1000
+
+
+def _columns(connection, table: str) -> set[str]:
+    return {column['name'] for column in inspect(connection).get_columns(table)}
+
+
+def _add_columns(connection, metadata, table: str, names: list[str]):
+    existing = _columns(connection, table)
+    for name in names:
+        if name in existing:
+            continue
+        column = metadata.tables[table].c[name]
+        column_type = column.type.compile(dialect=connection.dialect)
+        default = ''
+        if column.server_default is not None:
+            default = f" DEFAULT '{column.server_default.arg}'"
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}{default}'))
+
+
+def create_tables(connection, metadata):
+    """Create any tables that don't exist yet (everything, on a fresh database)."""
+    metadata.create_all(connection, checkfirst=True)
+
+
+def add_denormalized_columns(connection, metadata):
+    """Columns added after the first release: push keys, comment paths, post timestamps and compiled bodies."""
+    _add_columns(connection, metadata, 'users', ['email_hash'])
+    _add_columns(connection, metadata, 'push_subscriptions', ['endpoint', 'p256dh', 'auth'])
+    _add_columns(connection, metadata, 'comments', ['path', 'depth'])
+    _add_columns(connection, metadata, 'blog_posts', [
+        'published_at', 'body_html', 'excerpt', 'word_count', 'reading_minutes', 'content_hash',
+    ])
+
+
+def backfill_derived_data(connection, metadata):
+    """Fill the new columns for rows written before they existed."""
+    posts = metadata.tables['blog_posts']
+    comments = metadata.tables['comments']
+    users = metadata.tables['users']
+
+    for post_id, date_string in connection.execute(
+        posts.select().with_only_columns(posts.c.id, posts.c.date).where(posts.c.published_at.is_(None))
+    ).all():
+        try:
+            published_at = datetime.strptime(date_string, '%B %d, %Y')
+        except (TypeError, ValueError):
+            logger.warning('Post %s has an unparseable date %r; using now', post_id, date_string)
+            published_at = datetime.utcnow()
+        connection.execute(posts.update().where(posts.c.id == post_id).values(published_at=published_at))
+
+    for post_id, body in connection.execute(
+        posts.select().with_only_columns(posts.c.id, posts.c.body).where(posts.c.body_html.is_(None))
+    ).all():
+        compiled = compile_content(body)
+        connection.execute(posts.update().where(posts.c.id == post_id).values(
+            body_html=compiled.html, excerpt=compiled.excerpt, word_count=compiled.word_count,
+            reading_minutes=compiled.reading_minutes, content_hash=compiled.content_hash,
+        ))
+
+    for user_id, email in connection.execute(
+        users.select().with_only_columns(users.c.id, users.c.email).where(users.c.email_hash.is_(None))
+    ).all():
+        email_hash = hashlib.md5((email or '').strip().lower().encode()).hexdigest()
+        connection.execute(users.update().where(users.c.id == user_id).values(email_hash=email_hash))
+
+    # parents always have smaller ids than their replies, so one pass in id order suffices
+    paths = {}
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            comments.select()
+            .with_only_columns(comments.c.id, comments.c.parent_id, comments.c.path, comments.c.content)
+            .where(comments.c.id > last_id).order_by(comments.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for comment_id, parent_id, path, content in rows:
+            segment = str(comment_id).zfill(COMMENT_PATH_WIDTH)
+            parent_path = paths.get(parent_id)
+            new_path = f'{parent_path}/{segment}' if parent_path else segment
+            paths[comment_id] = new_path
+            values = {}
+            if path != new_path:
+                values.update(path=new_path, depth=new_path.count('/'))
+            cleaned = sanitize_html(content)
+            if cleaned != content:
+                values['content'] = cleaned
+            if values:
+                connection.execute(comments.update().where(comments.c.id == comment_id).values(**values))
+        last_id = rows[-1][0]
+
+
+def add_indexes(connection, metadata):
+    """Indexes for the hot foreign keys and the thread/index page queries."""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def recount_activity(connection, metadata):
+    """Recompute every post's comment count and last comment time, and every comment's reply count."""
+    posts = metadata.tables['blog_posts']
+    comments = metadata.tables['comments']
+    replies = comments.alias('replies')
+    connection.execute(posts.update().values(
+        comment_count=select(func.count()).where(comments.c.post_id == posts.c.id).scalar_subquery(),
+        last_comment_at=select(func.max(comments.c.created_at))
+        .where(comments.c.post_id == posts.c.id).scalar_subquery(),
+    ))
+    connection.execute(comments.update().values(
+        reply_count=select(func.count()).where(replies.c.parent_id == comments.c.id).scalar_subquery(),
+    ))
+
+
+def add_activity_counters(connection, metadata):
+    """Comment counts and last activity on posts, reply counts on comments, filled from the existing rows."""
+    _add_columns(connection, metadata, 'blog_posts', ['comment_count', 'last_comment_at'])
+    _add_columns(connection, metadata, 'comments', ['reply_count'])
+    recount_activity(connection, metadata)
+
+
+def _foreign_keys_missing_cascade(connection, metadata, table: str) -> list[dict]:
+    """Reflected foreign keys of ``table`` that the models declare ``ON DELETE CASCADE`` but the database does not."""
+    wanted = {fk.parent.name for fk in metadata.tables[table].foreign_keys if fk.ondelete == 'CASCADE'}
+    return [fk for fk in inspect(connection).get_foreign_keys(table)
+            if fk['constrained_columns'][0] in wanted and (fk['options'].get('ondelete') or '').upper() != 'CASCADE']
+
+
+def _rebuild_sqlite_table(connection, metadata, table: str):
+    """Recreate ``table`` as the models define it and copy its rows over; SQLite can't alter constraints."""
+    old = f'{table}__old'
+    connection.execute(text(f'ALTER TABLE {table} RENAME TO {old}'))
+    # index names are global in SQLite, so the old ones have to go before the new table gets its own
+    for index in inspect(connection).get_indexes(old):
+        connection.execute(text(f'DROP INDEX {index["name"]}'))
+    metadata.tables[table].create(connection)
+    existing = _columns(connection, old)
+    columns = ', '.join(name for name in metadata.tables[table].c.keys() if name in existing)
+    connection.execute(text(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {old}'))
+    connection.execute(text(f'DROP TABLE {old}'))
+
+
+def cascade_comment_deletes(connection, metadata):
+    """Let the database delete a post's comments and a comment's replies (ON DELETE CASCADE)."""
+    stale = _foreign_keys_missing_cascade(connection, metadata, 'comments')
+    if not stale:
+        return
+    if connection.dialect.name == 'sqlite':
+        # checked at commit instead of per statement, so orphans can go in any order
+        connection.execute(text('PRAGMA defer_foreign_keys = ON'))
+        # foreign keys were never enforced here, so earlier deletes may have left orphans behind
+        orphans = connection.execute(text(
+            'DELETE FROM comments WHERE post_id NOT IN (SELECT id FROM blog_posts)'
+        )).rowcount
+        while deleted := connection.execute(text(
+            'DELETE FROM comments WHERE parent_id IS NOT NULL AND parent_id NOT IN (SELECT id FROM comments)'
+        )).rowcount:
+            orphans += deleted
+        if orphans:
+            logger.warning('Deleted %s comments whose post or parent comment no longer exists', orphans)
+        _rebuild_sqlite_table(connection, metadata, 'comments')
+        return
+    for fk in stale:
+        column, = fk['constrained_columns']
+        connection.execute(text(f'ALTER TABLE comments DROP CONSTRAINT {fk["name"]}'))
+        connection.execute(text(
+            f'ALTER TABLE comments ADD CONSTRAINT {fk["name"]} FOREIGN KEY ({column}) '
+            f'REFERENCES {fk["referred_table"]} ({fk["referred_columns"][0]}) ON DELETE CASCADE'
+        ))
+
+
+MIGRATIONS = [
+    (1, create_tables),
+    (2, add_denormalized_columns),
+    (3, backfill_derived_data),
+    (4, add_indexes),
+    (5, add_activity_counters),
+    (6, cascade_comment_deletes),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(connection) -> int:
+    if not inspect(connection).has_table(SCHEMA_VERSION_TABLE):
+        return 0
+    version = connection.execute(text(f'SELECT MAX(version) FROM {SCHEMA_VERSION_TABLE}')).scalar()
+    return version or 0
+
+
+def upgrade(engine, metadata, target: int = LATEST_VERSION) -> list[int]:
+    """Apply pending migrations, each in its own transaction, and return the versions applied."""
+    with engine.begin() as connection:
+        connection.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} '
+            '(version INTEGER PRIMARY KEY, applied_at TIMESTAMP NOT NULL)'
+        ))
+    applied = []
+    for version, migration in MIGRATIONS:
+        if version > target:
+            break
+        with engine.begin() as connection:
+            if version <= current_version(connection):
+                continue
+            logger.info('Applying migration %s: %s', version, migration.__name__)
+            migration(connection, metadata)
+            connection.execute(
+                text(f'INSERT INTO {SCHEMA_VERSION_TABLE} (version, applied_at) VALUES (:version, :applied_at)'),
+                {'version': version, 'applied_at': datetime.utcnow()},
+            )
+        applied.append(version)
+    return applied
+
+
+def check_schema(engine) -> bool:
+    """Cheap startup check: warn instead of touching the schema when migrations are pending."""
+    with engine.connect() as connection:
+        version = current_version(connection)
+    if version < LATEST_VERSION:
+        logger.warning('Database schema is at version %s but the code expects %s; '
+                       'run "flask --app main db-upgrade"', version, LATEST_VERSION)
+        return False
+    return True
@@ -0,0 +1,128 @@
+import hashlib
+from datetime import datetime
+
+from flask_login import UserMixin
+from sqlalchemy import Integer, String, Text, Boolean, ForeignKey, DateTime, Index
+from sqlalchemy.orm import relationship, Mapped, mapped_column
+
+from content import compile_content
+from extensions import db
+
+
+# CONFIGURE TABLES 
+class User(UserMixin, db.Model):
+    __tablename__ = 'users'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(100))
+    email: Mapped[str] = mapped_column(String, unique=True)
+    # md5 of the normalized email, as Gravatar expects; set once at registration
+    email_hash: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    password: Mapped[str] = mapped_column(String(100))
+    is_admin: Mapped[bool] = mapped_column(Boolean, default=False)
+    posts = relationship('BlogPost', back_populates='author')
+    comments = relationship('Comment', back_populates='author')
+    push_subscriptions = relationship('PushSubscription', back_populates='user', cascade='all, delete-orphan')
+
+
+class BlogPost(db.Model):
+    __tablename__ = "blog_posts"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    title: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
+    subtitle: Mapped[str] = mapped_column(String(250), nullable=False)
+    date: Mapped[str] = mapped_column(String(250), nullable=False)
+    published_at: Mapped[datetime | None] = mapped_column(DateTime, default=datetime.utcnow)
+    # body is the editor's raw input; the rest is derived from it on save by apply_post_body
+    body: Mapped[str] = mapped_column(Text, nullable=False)
+    body_html: Mapped[str | None] = mapped_column(Text, nullable=True)
+    excerpt: Mapped[str | None] = mapped_column(Text, nullable=True)
+    word_count: Mapped[int] = mapped_column(Integer, default=0)
+    reading_minutes: Mapped[int] = mapped_column(Integer, default=1)
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # kept up to date by the comment create/delete paths; "flask repair-counters" recomputes them
+    comment_count: Mapped[int] = mapped_column(Integer, default=0, server_default='0')
+    last_comment_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    author_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), index=True)
+    author = relationship('User', back_populates='posts')
+    img_url: Mapped[str] = mapped_column(String(250), nullable=False)
+    # the database deletes a post's comments (ON DELETE CASCADE), so the ORM never loads them for it
+    comments = relationship('Comment', back_populates='post', cascade='all, delete-orphan', passive_deletes=True)
+
+    __table_args__ = (
+        # serves the home page's keyset pagination
+        Index('ix_blog_posts_published_at_id', 'published_at', 'id'),
+    )
+
+
+class Comment(db.Model):
+    __tablename__ = 'comments'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    author_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'))
+    post_id: Mapped[int] = mapped_column(Integer, ForeignKey('blog_posts.id', ondelete='CASCADE'))
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    parent_id: Mapped[int | None] = mapped_column(Integer, ForeignKey('comments.id', ondelete='CASCADE'),
+                                                  nullable=True, index=True)
+    # Materialized path of zero-padded ids from the thread root, e.g. "0000000003/0000000007".
+    # Sorting a post's comments by path yields every thread in reply order.
+    path: Mapped[str | None] = mapped_column(String(1000), nullable=True)
+    depth: Mapped[int] = mapped_column(Integer, default=0)
+    # direct replies only
+    reply_count: Mapped[int] = mapped_column(Integer, default=0, server_default='0')
+    parent = relationship('Comment', remote_side='Comment.id', back_populates='replies')
+    replies = relationship('Comment', back_populates='parent', cascade='all, delete-orphan', passive_deletes=True)
+    author = relationship('User', back_populates='comments')
+    post = relationship('BlogPost', back_populates='comments')
+
+    __table_args__ = (
+        Index('ix_comments_post_id_path', 'post_id', 'path'),
+        Index('ix_comments_post_parent_created', 'post_id', 'parent_id', 'created_at'),
+    )
+
+
+class PushSubscription(db.Model):
+    __tablename__ = 'push_subscriptions'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), index=True)
+    data: Mapped[str] = mapped_column(Text)
+    # parsed once at subscribe time so broadcasts never touch the JSON blob
+    endpoint: Mapped[str | None] = mapped_column(Text, nullable=True)
+    p256dh: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    auth: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    user = relationship('User', back_populates='push_subscriptions')
+
+
+# Notifications waiting to be delivered by the outbox worker. Rows are written
+# in the same transaction as the post/comment that triggered them.
+class OutboxMessage(db.Model):
+    __tablename__ = 'outbox'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(20), nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), default='pending', index=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    claimed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+def email_hash(email: str | None) -> str:
+    return hashlib.md5((email or '').strip().lower().encode()).hexdigest()
+
+
+def apply_post_body(post: BlogPost, body: str):
+    compiled = compile_content(body)
+    post.body = body
+    post.body_html = compiled.html
+    post.excerpt = compiled.excerpt
+    post.word_count = compiled.word_count
+    post.reading_minutes = compiled.reading_minutes
+    post.content_hash = compiled.content_hash
+
+
+COMMENT_PATH_WIDTH = 10
+
+
+def comment_path(parent: Comment | None, comment_id: int) -> str:
+    segment = str(comment_id).zfill(COMMENT_PATH_WIDTH)
+    return f'{parent.path}/{segment}' if parent else segment
@@ -0,0 +1,276 @@
+"""Email and web push delivery, and the outbox that queues them.
+
+``mailer`` (and with it smtplib) is imported when the first email goes out,
+and ``push`` defers pywebpush and its crypto stack the same way, so web
+workers that never send anything don't pay for them at startup.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, abort, current_app, request
+from flask_login import current_user, login_required
+
+from extensions import db
+from models import OutboxMessage, PushSubscription, User
+from push import PushDispatcher, parse_subscription
+
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('notifications', __name__, cli_group=None)
+
+PUSH_BATCH_SIZE = 1000
+OUTBOX_MAX_BACKOFF_SECONDS = 3600
+OUTBOX_EMAIL_BATCH_SIZE = 100
+# A claimed message whose worker died is handed out again after this long
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def mail_pool():
+    pool = current_app.extensions.get('mail_pool')
+    if pool is None:
+        from mailer import SMTPPool
+
+        config = current_app.config
+        pool = current_app.extensions.setdefault('mail_pool', SMTPPool(
+            config['MAIL_SERVER'],
+            config['MAIL_PORT'],
+            config['MAIL_ADDRESS'],
+            config['MAIL_APP_PW'],
+            size=config['MAIL_POOL_SIZE'],
+        ))
+    return pool
+
+
+def push_dispatcher():
+    dispatcher = current_app.extensions.get('push_dispatcher')
+    if dispatcher is None:
+        config = current_app.config
+        dispatcher = current_app.extensions.setdefault('push_dispatcher', PushDispatcher(
+            config['VAPID_PRIVATE_KEY'],
+            subject=f"mailto:{config['MAIL_ADDRESS']}" if config['MAIL_ADDRESS'] else "",
+            max_workers=config['PUSH_CONCURRENCY'],
+        ))
+    return dispatcher
+
+
+def send_email(to_addr: str, subject: str, body: str):
+    from mailer import build_message
+
+    mail_pool().send(build_message(current_app.config['MAIL_ADDRESS'], to_addr, subject, body))
+
+
+def send_bulk_email(to_addrs: list[str], subject: str, body: str):
+    """Send the same message to many recipients over pooled sessions.
+
+    Raises ``BulkSendError`` listing the recipients that failed.
+    """
+    from mailer import build_message
+
+    sender = current_app.config['MAIL_ADDRESS']
+    mail_pool().send_bulk([build_message(sender, to_addr, subject, body) for to_addr in to_addrs])
+
+
+def send_push(subscription_info: dict, payload: dict) -> int:
+    return push_dispatcher().send(parse_subscription(subscription_info), json.dumps(payload))
+
+
+def broadcast_push(title: str, body: str, user_id: int | None = None,
+                   subscription_ids: list[int] | None = None) -> list[int]:
+    """Push to all (or the given user's) subscriptions and prune the expired ones.
+
+    Returns the ids of subscriptions that failed for another reason so the
+    caller can retry just those.
+    """
+    query = db.select(PushSubscription.id, PushSubscription.endpoint, PushSubscription.p256dh,
+                      PushSubscription.auth, PushSubscription.data).order_by(PushSubscription.id)
+    if user_id:
+        query = query.where(PushSubscription.user_id == user_id)
+    if subscription_ids is not None:
+        query = query.where(PushSubscription.id.in_(subscription_ids))
+    dispatcher = push_dispatcher()
+    payload = {"title": title, "body": body}
+    gone, failed = [], []
+    batch = {}
+    rows = db.session.execute(query.execution_options(yield_per=PUSH_BATCH_SIZE))
+    for sub_id, endpoint, p256dh, auth, data in rows:
+        if endpoint:
+            batch[sub_id] = {'endpoint': endpoint, 'p256dh': p256dh, 'auth': auth}
+        else:
+            # subscribed before the columns existed
+            try:
+                batch[sub_id] = parse_subscription(data)
+            except ValueError:
+                gone.append(sub_id)
+        if len(batch) >= PUSH_BATCH_SIZE:
+            result = dispatcher.dispatch(batch, payload)
+            gone.extend(result.gone)
+            failed.extend(result.failed)
+            batch = {}
+    if batch:
+        result = dispatcher.dispatch(batch, payload)
+        gone.extend(result.gone)
+        failed.extend(result.failed)
+    if gone:
+        db.session.execute(db.delete(PushSubscription).where(PushSubscription.id.in_(gone)))
+        db.session.commit()
+    return failed
+
+
+@bp.route('/subscribe', methods=['POST'])
+@login_required
+def subscribe():
+    data = request.get_json(silent=True)
+    if not data:
+        abort(400)
+    try:
+        fields = parse_subscription(data)
+    except ValueError:
+        abort(400)
+    existing = db.session.execute(
+        db.select(PushSubscription).where(PushSubscription.user_id == current_user.id)
+    ).scalars().first()
+    if existing:
+        existing.data = json.dumps(data)
+        existing.endpoint = fields['endpoint']
+        existing.p256dh = fields['p256dh']
+        existing.auth = fields['auth']
+    else:
+        sub = PushSubscription(user_id=current_user.id, data=json.dumps(data), **fields)
+        db.session.add(sub)
+    db.session.commit()
+    return '', 201
+
+
+# Outbox delivery
+def enqueue_notification(kind: str, **payload):
+    """Queue a notification in the current session; it is sent once the caller commits."""
+    db.session.add(OutboxMessage(kind=kind, payload=json.dumps(payload)))
+
+
+def deliver_notification(message: OutboxMessage):
+    payload = json.loads(message.payload)
+    if message.kind == 'email':
+        send_email(payload['to_addr'], payload['subject'], payload['body'])
+    elif message.kind == 'email_all':
+        # Fan out into batches that each go over one SMTP session
+        emails = [email for email in db.session.execute(
+            db.select(User.email).where(User.email != None).order_by(User.id)
+        ).scalars() if email]
+        for start in range(0, len(emails), OUTBOX_EMAIL_BATCH_SIZE):
+            enqueue_notification('email_batch', to_addrs=emails[start:start + OUTBOX_EMAIL_BATCH_SIZE],
+                                 subject=payload['subject'], body=payload['body'])
+    elif message.kind == 'email_batch':
+        from mailer import BulkSendError
+
+        try:
+            send_bulk_email(payload['to_addrs'], payload['subject'], payload['body'])
+        except BulkSendError as exc:
+            # the rest went out; only the failed recipients are retried
+            for to_addr in exc.failed:
+                enqueue_notification('email', to_addr=to_addr, subject=payload['subject'], body=payload['body'])
+    elif message.kind == 'push':
+        failed = broadcast_push(payload['title'], payload['body'], payload.get('user_id'),
+                                payload.get('subscription_ids'))
+        if failed:
+            enqueue_notification('push', title=payload['title'], body=payload['body'], subscription_ids=failed)
+    else:
+        raise ValueError(f'Unknown outbox message kind: {message.kind}')
+
+
+def claim_outbox_messages(limit: int) -> list[int]:
+    """Mark up to ``limit`` due messages as being sent and return their ids.
+
+    The UPDATE that claims them checks again that they are due, so two
+    workers never get the same message, even where ``SKIP LOCKED`` does
+    nothing (SQLite).
+    """
+    now = datetime.utcnow()
+    due = db.or_(
+        db.and_(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now),
+        db.and_(OutboxMessage.status == 'sending', OutboxMessage.claimed_at <= now - OUTBOX_CLAIM_TIMEOUT),
+    )
+    candidates = db.session.execute(
+        db.select(OutboxMessage.id).where(due).order_by(OutboxMessage.id).limit(limit)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    claimed = []
+    if candidates:
+        claimed = db.session.execute(
+            db.update(OutboxMessage).where(OutboxMessage.id.in_(candidates), due)
+            .values(status='sending', claimed_at=now).returning(OutboxMessage.id),
+            execution_options={'synchronize_session': False},
+        ).scalars().all()
+    db.session.commit()
+    return sorted(claimed)
+
+
+def process_outbox(limit: int = 50) -> int:
+    """Deliver up to ``limit`` due messages and return how many were attempted."""
+    max_attempts = current_app.config['OUTBOX_MAX_ATTEMPTS']
+    backoff = current_app.config['OUTBOX_BACKOFF_SECONDS']
+    message_ids = claim_outbox_messages(limit)
+    for message_id in message_ids:
+        message = db.session.get(OutboxMessage, message_id)
+        try:
+            deliver_notification(message)
+        except Exception as exc:
+            db.session.rollback()
+            message = db.session.get(OutboxMessage, message_id)
+            message.attempts += 1
+            message.last_error = repr(exc)
+            if message.attempts >= max_attempts:
+                message.status = 'dead'
+                logger.error('Outbox message %s moved to dead letter: %r', message_id, exc)
+            else:
+                delay = min(backoff * 2 ** (message.attempts - 1), OUTBOX_MAX_BACKOFF_SECONDS)
+                message.status = 'pending'
+                message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        else:
+            message.status = 'sent'
+        db.session.commit()
+    return len(message_ids)
+
+
+def run_outbox_worker(app, poll_interval: float, batch_size: int, stop: threading.Event):
+    while not stop.is_set():
+        with app.app_context():
+            try:
+                processed = process_outbox(batch_size)
+            except Exception:
+                logger.exception('Outbox worker iteration failed')
+                processed = 0
+        if not processed:
+            stop.wait(poll_interval)
+
+
+@bp.cli.command('outbox-worker')
+@click.option('--threads', default=2, show_default=True, help='Number of delivery threads.')
+@click.option('--batch-size', default=50, show_default=True)
+@click.option('--poll-interval', default=2.0, show_default=True, help='Seconds to sleep when the queue is empty.')
+@click.option('--once', is_flag=True, help='Drain the currently due messages and exit.')
+def outbox_worker_command(threads, batch_size, poll_interval, once):
+    """Deliver queued emails and push notifications."""
+    if once:
+        total = 0
+        while processed := process_outbox(batch_size):
+            total += processed
+        click.echo(f'Processed {total} outbox messages.')
+        return
+    app = current_app._get_current_object()
+    stop = threading.Event()
+    workers = [
+        threading.Thread(target=run_outbox_worker, args=(app, poll_interval, batch_size, stop), daemon=True)
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
@@ -0,0 +1,199 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+
+from streaming import after_stream
+
+
+class LRUCache:
+    """A thread-safe LRU mapping with an optional time-to-live per entry."""
+
+    def __init__(self, maxsize: int = 256, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LocalVersionStore:
+    """Per-process namespace versions; only coherent when one process serves and writes everything."""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str) -> tuple[int, float]:
+        with self._lock:
+            return self._versions.setdefault(namespace, (0, time.time()))
+
+    def bump(self, namespace: str):
+        with self._lock:
+            version, _ = self._versions.get(namespace, (0, 0))
+            self._versions[namespace] = (version + 1, time.time())
+
+
+class RedisVersionStore:
+    """Namespace versions kept in Redis so every gunicorn worker sees the same ones."""
+
+    def __init__(self, url: str, prefix: str = 'pagecache:'):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, namespace: str) -> tuple[int, float]:
+        version, changed_at = self._redis.hmget(self.prefix + namespace, 'version', 'changed_at')
+        if version is None:
+            return 0, 0.0
+        return int(version), float(changed_at)
+
+    def bump(self, namespace: str):
+        key = self.prefix + namespace
+        pipeline = self._redis.pipeline()
+        pipeline.hincrby(key, 'version', 1)
+        pipeline.hset(key, 'changed_at', time.time())
+        pipeline.execute()
+
+
+def _store_when_sent(pages: LRUCache, key: str, body, mimetype: str):
+    """Pass a streamed body through and cache it once the last chunk is out.
+
+    A stream the client abandons never completes, so it is never cached.
+    """
+    chunks = []
+    for chunk in body:
+        chunks.append(chunk.encode() if isinstance(chunk, str) else chunk)
+        yield chunk
+    pages.set(key, (b''.join(chunks), mimetype))
+
+
+class PageCache:
+    """Caches rendered HTML for anonymous GETs, keyed by the versions of the data it shows.
+
+    Views declare which namespaces they depend on; write paths call
+    ``invalidate`` to bump those versions, which retires every cached page and
+    ETag built from the old ones. The rendered bodies live in a per-process
+    LRU, while the versions live in a (possibly shared) version store. Both
+    belong to the app passed to ``init_app``.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PAGE_CACHE_REDIS_URL', None)
+        # other workers, CLI commands and the outbox worker can't bump another process's versions
+        app.config.setdefault('PAGE_CACHE_ENABLED', bool(app.config['PAGE_CACHE_REDIS_URL']))
+        app.config.setdefault('PAGE_CACHE_SIZE', 256)
+        if app.config['PAGE_CACHE_REDIS_URL']:
+            store = RedisVersionStore(app.config['PAGE_CACHE_REDIS_URL'])
+        else:
+            store = LocalVersionStore()
+        app.extensions['page_cache'] = (LRUCache(app.config['PAGE_CACHE_SIZE']), store)
+
+    @property
+    def pages(self) -> LRUCache:
+        return current_app.extensions['page_cache'][0]
+
+    @property
+    def store(self):
+        return current_app.extensions['page_cache'][1]
+
+    def invalidate(self, *namespaces: str):
+        for namespace in namespaces:
+            self.store.bump(namespace)
+
+    def _cacheable(self) -> bool:
+        return (
+            current_app.config['PAGE_CACHE_ENABLED']
+            and request.method in ('GET', 'HEAD')
+            and not current_user.is_authenticated
+            and not session.get('_flashes')
+        )
+
+    def cached(self, namespaces):
+        """Decorate a view; ``namespaces(**view_args)`` names the data the page depends on."""
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self._cacheable():
+                    return view(*args, **kwargs)
+                versions = [(namespace, *self.store.get(namespace)) for namespace in namespaces(**kwargs)]
+                key = f'{request.full_path}|' + '|'.join(f'{ns}={version}' for ns, version, _ in versions)
+                etag = hashlib.sha1(key.encode()).hexdigest()
+                last_modified = max((changed_at for _, _, changed_at in versions), default=0)
+
+                if request.if_none_match:
+                    # weak comparison, so a gzipped copy (weak ETag) still matches
+                    not_modified = request.if_none_match.contains_weak(etag)
+                else:
+                    since = request.if_modified_since
+                    not_modified = bool(since and last_modified and int(last_modified) <= since.timestamp())
+                if not_modified:
+                    response = current_app.response_class(status=304)
+                else:
+                    cached = self.pages.get(key)
+                    if cached is None:
+                        # lets the DB router avoid replicas that may not have the latest write yet
+                        g.data_changed_at = last_modified
+                        response = make_response(view(*args, **kwargs))
+                        if response.status_code != 200:
+                            return response
+                        if response.is_streamed:
+                            body = response.response
+                            response.response = after_stream(
+                                body, chunks=_store_when_sent(self.pages, key, body, response.mimetype))
+                        else:
+                            self.pages.set(key, (response.get_data(), response.mimetype))
+                    else:
+                        body, mimetype = cached
+                        response = current_app.response_class(body, mimetype=mimetype)
+                response.set_etag(etag)
+                if last_modified:
+                    response.headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+                response.headers['Cache-Control'] = 'no-cache'
+                response.vary.add('Cookie')
+                return response
+
+            return wrapper
+
+        return decorator
@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+import metrics
+
+
+# Push services answer 404/410 once a subscription has been revoked or expired
+GONE_STATUSES = (404, 410)
+# VAPID JWTs may live up to 24h; re-sign well before the 12h we ask for runs out
+VAPID_TTL = 12 * 60 * 60
+VAPID_REFRESH_MARGIN = 60 * 60
+
+
+def parse_subscription(data) -> dict:
+    """Validate a PushSubscription.toJSON() blob and return its endpoint and keys.
+
+    Raises ``ValueError`` if anything the push service needs is missing.
+    """
+    if isinstance(data, str):
+        data = json.loads(data)
+    try:
+        endpoint = data['endpoint']
+        p256dh = data['keys']['p256dh']
+        auth = data['keys']['auth']
+    except (KeyError, TypeError):
+        raise ValueError('Subscription must contain an endpoint and p256dh/auth keys')
+    if urlparse(endpoint).scheme not in ('http', 'https') or not p256dh or not auth:
+        raise ValueError('Subscription endpoint or keys are invalid')
+    return {'endpoint': endpoint, 'p256dh': p256dh, 'auth': auth}
+
+
+@dataclass
+class DispatchResult:
+    sent: int = 0
+    gone: list = field(default_factory=list)
+    failed: dict = field(default_factory=dict)
+
+
+class PushDispatcher:
+    """Sends web pushes concurrently, reusing HTTP connections per push service origin.
+
+    pywebpush, py_vapid and requests are imported on first use so that
+    importing this module (e.g. for ``parse_subscription``) stays cheap.
+
+    The VAPID key is parsed once and its signed headers are cached per
+    audience (push service origin) until shortly before they expire.
+    """
+
+    def __init__(self, private_key: str | None, subject: str, max_workers: int = 16, timeout: float = 10,
+                 ttl: int = 0):
+        self.private_key = private_key
+        self.subject = subject
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vapid = None
+        self._vapid_headers: dict[str, tuple[float, dict]] = {}
+        self._sessions: dict = {}
+
+    def _origin(self, endpoint: str) -> str:
+        url = urlparse(endpoint)
+        return f'{url.scheme}://{url.netloc}'
+
+    def _vapid_headers_for(self, origin: str) -> dict:
+        now = time.time()
+        with self._lock:
+            cached = self._vapid_headers.get(origin)
+            if cached and cached[0] - VAPID_REFRESH_MARGIN > now:
+                return cached[1]
+            if self._vapid is None:
+                from py_vapid import Vapid
+
+                self._vapid = Vapid.from_string(private_key=self.private_key)
+            expires = int(now) + VAPID_TTL
+            headers = self._vapid.sign({'sub': self.subject, 'aud': origin, 'exp': expires})
+            self._vapid_headers[origin] = (expires, headers)
+            return headers
+
+    def _session_for(self, origin: str):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with self._lock:
+            session = self._sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                session.mount(origin, adapter)
+                self._sessions[origin] = session
+            return session
+
+    def send(self, subscription: dict, data: str) -> int:
+        """POST one encrypted message and return the push service's status code."""
+        from pywebpush import WebPusher
+
+        origin = self._origin(subscription['endpoint'])
+        subscription_info = {
+            'endpoint': subscription['endpoint'],
+            'keys': {'p256dh': subscription['p256dh'], 'auth': subscription['auth']},
+        }
+        pusher = WebPusher(subscription_info, requests_session=self._session_for(origin))
+        headers = dict(self._vapid_headers_for(origin))
+        start = time.perf_counter()
+        try:
+            response = pusher.send(data, headers=headers, ttl=self.ttl, timeout=self.timeout)
+        except Exception:
+            metrics.PUSH_SECONDS.observe(time.perf_counter() - start, status='error')
+            raise
+        metrics.PUSH_SECONDS.observe(time.perf_counter() - start, status=response.status_code)
+        return response.status_code
+
+    def dispatch(self, subscriptions: dict, payload: dict) -> DispatchResult:
+        """Push ``payload`` to every subscription in ``{key: subscription}``.
+
+        Keys of subscriptions the service reports as gone are collected in
+        ``result.gone``; other failures land in ``result.failed``.
+        """
+        data = json.dumps(payload)
+        result = DispatchResult()
+        if not subscriptions:
+            return result
+
+        def deliver(item):
+            key, subscription = item
+            try:
+                return key, self.send(subscription, data)
+            except Exception as exc:
+                return key, exc
+
+        workers = min(self.max_workers, len(subscriptions))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='push') as executor:
+            for key, outcome in executor.map(deliver, subscriptions.items()):
+                if isinstance(outcome, Exception):
+                    result.failed[key] = outcome
+                elif outcome in GONE_STATUSES:
+                    result.gone.append(key)
+                elif outcome > 202:
+                    result.failed[key] = outcome
+                else:
+                    result.sent += 1
+        return result
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
@@ -0,0 +1,192 @@
+from dataclasses import dataclass
+
+from markupsafe import Markup, escape
+from sqlalchemy import event, text
+
+from content import html_to_text
+
+
+# Highlight delimiters the database wraps around matches; swapped for <mark>
+# only after the snippet has been escaped.
+START_MARK = '\x02'
+STOP_MARK = '\x03'
+
+def post_doc_id(post_id: int) -> int:
+    return post_id * 2
+
+
+def comment_doc_id(comment_id: int) -> int:
+    return comment_id * 2 + 1
+
+
+@dataclass
+class SearchHit:
+    kind: str
+    ref_id: int
+    post_id: int
+    snippet: Markup
+    rank: float
+
+
+def _highlight(snippet: str) -> Markup:
+    escaped = str(escape(snippet or ''))
+    return Markup(escaped.replace(START_MARK, '<mark>').replace(STOP_MARK, '</mark>'))
+
+
+class SQLiteBackend:
+    """FTS5 virtual table whose rowid is the document id, so updates never scan."""
+
+    def create_schema(self, connection):
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+            "kind UNINDEXED, ref_id UNINDEXED, post_id UNINDEXED, title, subtitle, body, "
+            "tokenize = 'porter unicode61')"
+        ))
+
+    def drop_schema(self, connection):
+        connection.execute(text('DROP TABLE IF EXISTS search_index'))
+
+    def upsert(self, session, doc_id, kind, ref_id, post_id, title, subtitle, body):
+        session.execute(text('DELETE FROM search_index WHERE rowid = :doc_id'), {'doc_id': doc_id})
+        session.execute(text(
+            'INSERT INTO search_index (rowid, kind, ref_id, post_id, title, subtitle, body) '
+            'VALUES (:doc_id, :kind, :ref_id, :post_id, :title, :subtitle, :body)'
+        ), {'doc_id': doc_id, 'kind': kind, 'ref_id': ref_id, 'post_id': post_id,
+            'title': title, 'subtitle': subtitle, 'body': body})
+
+    def delete(self, session, doc_ids):
+        if doc_ids:
+            session.execute(text('DELETE FROM search_index WHERE rowid = :doc_id'),
+                            [{'doc_id': doc_id} for doc_id in doc_ids])
+
+    def search(self, session, query, limit, offset):
+        # quote every term so user input can't inject FTS5 query syntax
+        match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+        return session.execute(text(
+            'SELECT kind, ref_id, post_id, '
+            f"snippet(search_index, -1, '{START_MARK}', '{STOP_MARK}', '…', 16) AS snippet, "
+            'bm25(search_index, 0, 0, 0, 10.0, 4.0, 1.0) AS rank '
+            'FROM search_index WHERE search_index MATCH :match '
+            'ORDER BY rank LIMIT :limit OFFSET :offset'
+        ), {'match': match, 'limit': limit, 'offset': offset}).all()
+
+
+class PostgresBackend:
+    """A weighted tsvector per document with a GIN index."""
+
+    def create_schema(self, connection):
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS search_documents ('
+            'id BIGINT PRIMARY KEY, kind VARCHAR(10) NOT NULL, ref_id INTEGER NOT NULL, '
+            'post_id INTEGER NOT NULL, title TEXT, body TEXT, document TSVECTOR NOT NULL)'
+        ))
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_search_documents_document ON search_documents USING GIN (document)'
+        ))
+
+    def drop_schema(self, connection):
+        connection.execute(text('DROP TABLE IF EXISTS search_documents'))
+
+    def upsert(self, session, doc_id, kind, ref_id, post_id, title, subtitle, body):
+        session.execute(text(
+            'INSERT INTO search_documents (id, kind, ref_id, post_id, title, body, document) '
+            "VALUES (:doc_id, :kind, :ref_id, :post_id, :title, :body, "
+            "setweight(to_tsvector('english', coalesce(:title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(:subtitle, '')), 'B') || "
+            "setweight(to_tsvector('english', coalesce(:body, '')), 'C')) "
+            'ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body, '
+            'post_id = EXCLUDED.post_id, document = EXCLUDED.document'
+        ), {'doc_id': doc_id, 'kind': kind, 'ref_id': ref_id, 'post_id': post_id,
+            'title': title, 'subtitle': subtitle, 'body': body})
+
+    def delete(self, session, doc_ids):
+        if doc_ids:
+            session.execute(text('DELETE FROM search_documents WHERE id = ANY(:doc_ids)'),
+                            {'doc_ids': list(doc_ids)})
+
+    def search(self, session, query, limit, offset):
+        return session.execute(text(
+            "WITH q AS (SELECT websearch_to_tsquery('english', :query) AS query) "
+            'SELECT kind, ref_id, post_id, '
+            f"ts_headline('english', body, q.query, 'StartSel={START_MARK}, StopSel={STOP_MARK}, "
+            "MaxFragments=1, MaxWords=30, MinWords=10') AS snippet, "
+            'ts_rank(document, q.query) AS rank '
+            'FROM search_documents, q WHERE document @@ q.query '
+            'ORDER BY rank DESC LIMIT :limit OFFSET :offset'
+        ), {'query': query, 'limit': limit, 'offset': offset}).all()
+
+
+BACKENDS = {'sqlite': SQLiteBackend, 'postgresql': PostgresBackend}
+
+
+class SearchIndex:
+    """Full-text index over posts and comments, kept in the app's own database.
+
+    Index updates go through ``db.session`` so they commit or roll back with
+    the write that caused them. The index table is created whenever
+    ``db.create_all()`` runs.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        event.listen(db.metadata, 'after_create', self._create_schema)
+
+    def _backend(self, dialect_name: str):
+        try:
+            return BACKENDS[dialect_name]()
+        except KeyError:
+            raise RuntimeError(f'Full-text search is not supported on {dialect_name}')
+
+    def _session_backend(self):
+        return self._backend(self.db.session.get_bind().dialect.name)
+
+    def _create_schema(self, target, connection, **kwargs):
+        if connection.dialect.name in BACKENDS:
+            self._backend(connection.dialect.name).create_schema(connection)
+
+    def index_post(self, post):
+        self._session_backend().upsert(
+            self.db.session, post_doc_id(post.id), 'post', post.id, post.id,
+            post.title, post.subtitle, html_to_text(post.body),
+        )
+
+    def index_comment(self, comment):
+        self._session_backend().upsert(
+            self.db.session, comment_doc_id(comment.id), 'comment', comment.id, comment.post_id,
+            '', '', html_to_text(comment.content),
+        )
+
+    def remove(self, post_ids=(), comment_ids=()):
+        doc_ids = [post_doc_id(i) for i in post_ids] + [comment_doc_id(i) for i in comment_ids]
+        self._session_backend().delete(self.db.session, doc_ids)
+
+    def search(self, query: str, page: int = 1, per_page: int = 10) -> tuple[list[SearchHit], bool]:
+        """Return one page of hits, best first, and whether another page follows."""
+        if not query.strip():
+            return [], False
+        rows = self._session_backend().search(self.db.session, query, per_page + 1, (page - 1) * per_page)
+        hits = [
+            SearchHit(kind, int(ref_id), int(post_id), _highlight(snippet), rank)
+            for kind, ref_id, post_id, snippet, rank in rows[:per_page]
+        ]
+        return hits, len(rows) > per_page
+
+    def rebuild(self, post_query, comment_query, batch_size: int = 500) -> int:
+        """Drop and refill the index from the rows of two selects, in one transaction.
+
+        The queries are only run once the index table has been recreated;
+        SQLite refuses to drop a table while a cursor is open on the connection.
+        """
+        connection = self.db.session.connection()
+        backend = self._backend(connection.dialect.name)
+        backend.drop_schema(connection)
+        backend.create_schema(connection)
+        count = 0
+        for post in self.db.session.scalars(post_query.execution_options(yield_per=batch_size)):
+            self.index_post(post)
+            count += 1
+        for comment in self.db.session.scalars(comment_query.execution_options(yield_per=batch_size)):
+            self.index_comment(comment)
+            count += 1
+        self.db.session.commit()
+        return count
@@ -0,0 +1,158 @@
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from flask import g, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from streaming import after_stream
+
+
+_local = threading.local()
+_installed = False
+
+_WHITESPACE = re.compile(r'\s+')
+_IN_LIST = re.compile(r'IN \((?:[^()]*)\)', re.IGNORECASE)
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def statement_shape(statement: str) -> str:
+    """Reduce a statement to its shape so the same query with other parameters groups together."""
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    shape = _IN_LIST.sub('IN (...)', shape)
+    return _LITERAL.sub('?', shape)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.total_time += duration
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold: int) -> dict[str, int]:
+        return {shape: count for shape, count in self.shapes.items() if count > threshold}
+
+    def as_dict(self, threshold: int) -> dict:
+        return {
+            'queries': self.count,
+            'time_ms': round(self.total_time * 1000, 2),
+            'repeated': self.repeated(threshold),
+        }
+
+
+def _collectors() -> list:
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    return _local.collectors
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _collectors():
+        conn.info.setdefault('sqlprofiler_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collectors = _collectors()
+    if not collectors:
+        return
+    starts = conn.info.get('sqlprofiler_start')
+    duration = time.perf_counter() - starts.pop() if starts else 0.0
+    for stats in collectors:
+        stats.record(statement, duration)
+
+
+def install():
+    """Listen on every engine once; the listeners are no-ops unless something is collecting."""
+    global _installed
+    if not _installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _installed = True
+
+
+@contextmanager
+def collect_queries():
+    """Collect the statements run on this thread while the block executes."""
+    install()
+    stats = QueryStats()
+    _collectors().append(stats)
+    try:
+        yield stats
+    finally:
+        _collectors().remove(stats)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """Fail if the block runs more than ``limit`` SQL statements, listing what ran."""
+    with collect_queries() as stats:
+        yield stats
+    if stats.count > limit:
+        details = '\n'.join(f'  {count}x {shape}' for shape, count in stats.shapes.most_common())
+        raise AssertionError(f'Expected at most {limit} queries, got {stats.count}:\n{details}')
+
+
+def init_app(app):
+    """Report query counts per request when ``SQL_PROFILE`` is enabled.
+
+    Each response gets ``X-SQL-Queries``/``X-SQL-Time-ms`` headers; a request
+    that runs the same statement shape more than ``SQL_PROFILE_REPEAT_THRESHOLD``
+    times is logged as a likely N+1. Recent reports are served at ``/_debug/sql``.
+    Streamed responses get no headers, since their queries run after the
+    headers are sent; their report is recorded when the stream ends.
+    """
+    if not app.config.get('SQL_PROFILE'):
+        return
+    install()
+    threshold = app.config.get('SQL_PROFILE_REPEAT_THRESHOLD', 5)
+    reports = deque(maxlen=app.config.get('SQL_PROFILE_HISTORY', 200))
+
+    @app.before_request
+    def start_sql_profile():
+        g.sql_stats = QueryStats()
+        _collectors().append(g.sql_stats)
+
+    def finish(stats, endpoint, path):
+        if stats in _collectors():
+            _collectors().remove(stats)
+        report = {'endpoint': endpoint, 'path': path, **stats.as_dict(threshold)}
+        reports.append(report)
+        if report['repeated']:
+            app.logger.warning('Possible N+1 on %s: %s', endpoint, report['repeated'])
+        return report
+
+    @app.after_request
+    def report_sql_profile(response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+        if response.is_streamed:
+            # the body runs its queries after the headers are sent; it is only in the report
+            endpoint, path = request.endpoint, request.path
+            response.response = after_stream(response.response, lambda: finish(stats, endpoint, path))
+            return response
+        report = finish(stats, request.endpoint, request.path)
+        response.headers['X-SQL-Queries'] = str(stats.count)
+        response.headers['X-SQL-Time-ms'] = str(report['time_ms'])
+        if report['repeated']:
+            response.headers['X-SQL-Repeated'] = str(max(report['repeated'].values()))
+        return response
+
+    @app.teardown_request
+    def stop_sql_profile(exc):
+        # after_request is skipped on unhandled errors; don't leak the collector
+        stats = g.pop('sql_stats', None)
+        if stats is not None and stats in _collectors():
+            _collectors().remove(stats)
+
+    @app.route('/_debug/sql')
+    def sql_profile_report():
+        return jsonify(list(reports))
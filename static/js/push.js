@@ -1,6 +1,6 @@
 document.addEventListener('DOMContentLoaded', async () => {
   if (!('serviceWorker' in navigator)) return;
-  const reg = await navigator.serviceWorker.register('/static/js/service-worker.js');
+  const reg = await navigator.serviceWorker.register('/sw.js', { scope: '/' });
   let sub = await reg.pushManager.getSubscription();
   if (!sub) {
     const key = document.querySelector('meta[name="vapid-key"]').content;
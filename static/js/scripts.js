@@ -27,3 +27,16 @@ window.addEventListener('DOMContentLoaded', () => {
         scrollPos = currentTop;
     });
 })
+
+// "Load more comments" swaps the link for the next page of threads
+document.addEventListener('click', async (event) => {
+    const link = event.target.closest('a[data-more-comments]');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+    const response = await fetch(link.href);
+    if (response.ok) {
+        link.closest('li').outerHTML = await response.text();
+    }
+});
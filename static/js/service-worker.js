@@ -1,6 +0,0 @@
-self.addEventListener('push', function(event) {
-  const data = event.data.json();
-  event.waitUntil(
-    self.registration.showNotification(data.title, { body: data.body })
-  );
-});
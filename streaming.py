@@ -0,0 +1,18 @@
+"""Hooks that run once a streamed response body has been sent."""
+
+
+def after_stream(body, callback=None, chunks=None):
+    """Yield ``chunks`` (``body`` itself by default), then close ``body`` and call ``callback``.
+
+    ``chunks`` is for wrappers that rewrite or watch the body on its way out;
+    it must read from ``body``. The server only closes the outermost iterable,
+    and the inner one may hold the request context, so ``body`` is closed
+    here whether or not the client read it all.
+    """
+    try:
+        yield from body if chunks is None else chunks
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+        if callback is not None:
+            callback()
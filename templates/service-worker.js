@@ -0,0 +1,126 @@
+// Rendered by assets.service_worker; the version changes whenever a static file does.
+const VERSION = {{ version|tojson }};
+const ASSETS = {{ assets|tojson }};
+const OFFLINE_URL = {{ offline_url|tojson }};
+const STATIC_CACHE = `static-${VERSION}`;
+const PAGES_CACHE = 'pages';
+const MANIFEST_KEY = '/__asset-manifest';
+
+// Reuse unchanged files from the previous version instead of downloading them again
+async function previousAssets() {
+  for (const name of await caches.keys()) {
+    if (name.startsWith('static-') && name !== STATIC_CACHE) {
+      const cache = await caches.open(name);
+      const manifest = await cache.match(MANIFEST_KEY);
+      if (manifest) {
+        return { cache, manifest: await manifest.json() };
+      }
+    }
+  }
+  return { cache: null, manifest: {} };
+}
+
+async function precache() {
+  const cache = await caches.open(STATIC_CACHE);
+  const previous = await previousAssets();
+  await Promise.all(Object.entries(ASSETS).map(async ([url, hash]) => {
+    if (previous.cache && previous.manifest[url] === hash) {
+      const response = await previous.cache.match(url);
+      if (response) {
+        return cache.put(url, response);
+      }
+    }
+    const response = await fetch(new Request(url, { cache: 'reload' }));
+    if (!response.ok) {
+      throw new Error(`Precaching ${url} failed with ${response.status}`);
+    }
+    return cache.put(url, response);
+  }));
+  const offline = await fetch(new Request(OFFLINE_URL, { cache: 'reload' }));
+  if (!offline.ok) {
+    throw new Error(`Precaching ${OFFLINE_URL} failed with ${offline.status}`);
+  }
+  await cache.put(OFFLINE_URL, offline);
+  await cache.put(MANIFEST_KEY, new Response(JSON.stringify(ASSETS)));
+}
+
+self.addEventListener('install', (event) => {
+  event.waitUntil(precache().then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', (event) => {
+  event.waitUntil((async () => {
+    for (const name of await caches.keys()) {
+      if (name.startsWith('static-') && name !== STATIC_CACHE) {
+        await caches.delete(name);
+      }
+    }
+    await self.clients.claim();
+  })());
+});
+
+async function cacheFirst(request, path) {
+  const cached = await caches.match(path, { cacheName: STATIC_CACHE });
+  return cached || fetch(request);
+}
+
+// Serve the stored copy of a post at once and refresh it in the background
+async function staleWhileRevalidate(event) {
+  const cache = await caches.open(PAGES_CACHE);
+  const cached = await cache.match(event.request);
+  const refresh = fetch(event.request).then(async (response) => {
+    // only pages rendered for anonymous visitors are marked, see blog.offline_cacheable
+    if (response.ok && response.headers.has('X-Offline-Cacheable')) {
+      await cache.put(event.request, response.clone());
+    }
+    return response;
+  });
+  if (cached) {
+    event.waitUntil(refresh.catch(() => {}));
+    return cached;
+  }
+  try {
+    return await refresh;
+  } catch (error) {
+    return caches.match(OFFLINE_URL, { cacheName: STATIC_CACHE });
+  }
+}
+
+async function networkWithOfflineFallback(request) {
+  try {
+    return await fetch(request);
+  } catch (error) {
+    return caches.match(OFFLINE_URL, { cacheName: STATIC_CACHE });
+  }
+}
+
+self.addEventListener('fetch', (event) => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) {
+    return;
+  }
+  if (request.method !== 'GET') {
+    // logging in or out, commenting, posting: stored pages may be stale or belong to someone else
+    event.waitUntil(caches.delete(PAGES_CACHE));
+    return;
+  }
+  if (url.pathname === '/logout') {
+    event.waitUntil(caches.delete(PAGES_CACHE));
+    return;
+  }
+  if (url.pathname in ASSETS) {
+    event.respondWith(cacheFirst(request, url.pathname));
+  } else if (request.mode === 'navigate' && /^\/post\/\d+$/.test(url.pathname)) {
+    event.respondWith(staleWhileRevalidate(event));
+  } else if (request.mode === 'navigate') {
+    event.respondWith(networkWithOfflineFallback(request));
+  }
+});
+
+self.addEventListener('push', function(event) {
+  const data = event.data.json();
+  event.waitUntil(
+    self.registration.showNotification(data.title, { body: data.body })
+  );
+});
@@ -0,0 +1,105 @@
+import gzip
+import json
+import re
+
+from assets import BUILD_MANIFEST, build_assets, build_manifest, file_hash, manifest_version
+from test_routes import create_post, create_test_app, register_admin
+
+
+def test_manifest_hashes_follow_file_contents(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'site.css').write_text('body { color: red }')
+    (tmp_path / 'logo.png').write_bytes(b'\x89PNG')
+    manifest = build_manifest(str(tmp_path), '/static')
+    assert manifest == {
+        '/static/css/site.css': file_hash(str(tmp_path / 'css' / 'site.css')),
+        '/static/logo.png': file_hash(str(tmp_path / 'logo.png')),
+    }
+
+    (tmp_path / 'css' / 'site.css').write_text('body { color: blue }')
+    changed = build_manifest(str(tmp_path), '/static')
+    assert changed['/static/logo.png'] == manifest['/static/logo.png']
+    assert changed['/static/css/site.css'] != manifest['/static/css/site.css']
+    assert manifest_version(changed) != manifest_version(manifest)
+
+
+def test_service_worker_is_served_from_the_root_with_the_manifest():
+    app, db = create_test_app()
+    client = app.test_client()
+    response = client.get('/sw.js')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/javascript'
+    assert response.headers['Service-Worker-Allowed'] == '/'
+
+    script = response.get_data(as_text=True)
+    assets = json.loads(re.search(r'const ASSETS = (.*);', script).group(1))
+    assert assets['/static/css/styles.css'] == file_hash(f'{app.static_folder}/css/styles.css')
+    assert '/static/js/push.js' in assets
+    assert f'const VERSION = "{manifest_version(assets)}";' in script
+
+    assert client.get('/sw.js', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/offline').status_code == 200
+
+
+def test_built_assets_are_hashed_precompressed_and_served_immutable(tmp_path):
+    app, db = create_test_app(ASSET_BUILD_DIR=str(tmp_path))
+    manifest = build_assets(app.static_folder, str(tmp_path))
+    styles = manifest['css/styles.css']
+    assert styles['file'] == f"css/styles.{file_hash(f'{app.static_folder}/css/styles.css')}.css"
+    assert 'gzip' in styles['encodings']
+    assert manifest['assets/img/home-bg.jpg']['encodings'] == []
+    # a second build finds everything in place
+    assert build_assets(app.static_folder, str(tmp_path)) == manifest
+
+    client = app.test_client()
+    html = client.get('/about').get_data(as_text=True)
+    hashed_url = f"/static/{styles['file']}"
+    assert hashed_url in html and '/static/css/styles.css' not in html
+    assert f"/static/{manifest['assets/img/about-bg.jpg']['file']}" in html
+
+    with open(f'{app.static_folder}/css/styles.css', 'rb') as f:
+        original = f.read()
+    compressed = client.get(hashed_url, headers={'Accept-Encoding': 'br;q=1, gzip;q=0.8'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert 'immutable' in compressed.headers['Cache-Control']
+    assert 'max-age=31536000' in compressed.headers['Cache-Control']
+    assert compressed.mimetype == 'text/css'
+    assert gzip.decompress(compressed.get_data()) == original
+    plain = client.get(hashed_url, headers={'Accept-Encoding': 'gzip;q=0'})
+    assert 'Content-Encoding' not in plain.headers and plain.get_data() == original
+    compressed.close(), plain.close()
+
+    # unhashed names still work, and the service worker precaches what pages link to
+    assert client.get('/static/js/push.js').status_code == 200
+    script = client.get('/sw.js').get_data(as_text=True)
+    assert hashed_url in json.loads(re.search(r'const ASSETS = (.*);', script).group(1))
+
+
+def test_masthead_background_offers_webp_widths_when_built(tmp_path):
+    (tmp_path / BUILD_MANIFEST).write_text(json.dumps({'assets/img/about-bg.jpg': {
+        'file': 'assets/img/about-bg.abc.jpg', 'encodings': [],
+        'webp': {'640': 'assets/img/about-bg.abc.640w.webp', '2000': 'assets/img/about-bg.abc.2000w.webp'},
+    }}))
+    app, db = create_test_app(ASSET_BUILD_DIR=str(tmp_path))
+    html = app.test_client().get('/about').get_data(as_text=True)
+    assert 'background-image:url("/static/assets/img/about-bg.abc.jpg")' in html
+    assert ('image-set(url("/static/assets/img/about-bg.abc.2000w.webp") type("image/webp"),'
+            'url("/static/assets/img/about-bg.abc.jpg") type("image/jpeg"))') in html
+    assert html.index('about-bg.abc.2000w.webp') < html.index('@media (max-width:640px)') \
+        < html.index('about-bg.abc.640w.webp')
+
+
+def test_anonymous_post_pages_are_marked_for_offline_reading_without_the_page_cache():
+    app, db = create_test_app(PAGE_CACHE_ENABLED=False)
+    admin = app.test_client()
+    with app.app_context():
+        register_admin(admin)
+        create_post(admin)
+    anonymous = app.test_client().get('/post/1')
+    anonymous.get_data()
+    assert anonymous.headers['X-Offline-Cacheable'] == '1' and 'ETag' not in anonymous.headers
+    logged_in = admin.get('/post/1')
+    logged_in.get_data()
+    assert 'X-Offline-Cacheable' not in logged_in.headers
+    assert "headers.has('X-Offline-Cacheable')" in app.test_client().get('/sw.js').get_data(as_text=True)
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from avatars import AvatarStore
+import blog
+from models import email_hash
+from test_routes import create_test_app, register_admin
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 200
+
+
+class FakeGravatar(BaseHTTPRequestHandler):
+    """Serves a PNG for any hash except 'missing', which gets a 404."""
+
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        if 'missing' in self.path:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(PNG)))
+        self.end_headers()
+        self.wfile.write(PNG)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGravatar)
+    server.hits = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    server.url = f'http://{host}:{port}/avatar/{{hash}}?s=100'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_store_fetches_once_then_serves_from_disk(upstream, tmp_path):
+    store = AvatarStore(str(tmp_path), upstream.url)
+    first = store.get('abc')
+    second = store.get('abc')
+    assert first == second == os.path.join(tmp_path, 'abc')
+    assert open(first, 'rb').read() == PNG
+    assert upstream.hits == ['/avatar/abc?s=100']
+    assert store.get('missing') is None
+
+
+def test_store_remembers_misses_for_a_while(upstream, tmp_path, monkeypatch):
+    store = AvatarStore(str(tmp_path), upstream.url, miss_ttl=60)
+    assert store.get('missing') is None
+    assert store.get('missing') is None
+    assert upstream.hits == ['/avatar/missing?s=100']
+
+    monotonic = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: monotonic + 61)
+    assert store.get('missing') is None
+    assert len(upstream.hits) == 2
+
+
+def test_store_evicts_least_recently_used(upstream, tmp_path):
+    store = AvatarStore(str(tmp_path), upstream.url, max_bytes=len(PNG) * 2)
+    store.get('a')
+    store.get('b')
+    os.utime(tmp_path / 'a', (1, 1))  # 'a' is the stalest
+    store.get('c')
+    assert sorted(os.listdir(tmp_path)) == ['b', 'c']
+
+
+def test_avatar_route_serves_cached_image_with_long_lifetime(upstream, tmp_path):
+    app, db = create_test_app(AVATAR_CACHE_DIR=str(tmp_path), AVATAR_UPSTREAM=upstream.url)
+    with app.app_context():
+        register_admin(app.test_client())
+    client = app.test_client()
+
+    response = client.get('/avatar/1')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.get_data() == PNG
+    assert response.cache_control.max_age == blog.AVATAR_MAX_AGE
+    client.get('/avatar/1')
+    assert len(upstream.hits) == 1
+    assert upstream.hits[0] == f'/avatar/{email_hash("admin@example.com")}?s=100'
+    assert client.get('/avatar/99').status_code == 404
+
+
+def test_avatar_route_falls_back_to_default_image(tmp_path):
+    # nothing listens on port 9
+    app, db = create_test_app(AVATAR_CACHE_DIR=str(tmp_path), AVATAR_UPSTREAM='http://127.0.0.1:9/{hash}')
+    with app.app_context():
+        register_admin(app.test_client())
+    response = app.test_client().get('/avatar/1')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert response.cache_control.max_age == blog.DEFAULT_AVATAR_MAX_AGE
+
+
+def test_avatar_route_refetches_an_image_evicted_before_it_was_sent(upstream, tmp_path, monkeypatch):
+    app, db = create_test_app(AVATAR_CACHE_DIR=str(tmp_path), AVATAR_UPSTREAM=upstream.url)
+    with app.app_context():
+        register_admin(app.test_client())
+    store = app.extensions['avatar_store']
+    get = store.get
+
+    def get_then_evict(email_hash):
+        path = get(email_hash)
+        if len(upstream.hits) == 1:
+            os.remove(path)
+        return path
+
+    monkeypatch.setattr(store, 'get', get_then_evict)
+    response = app.test_client().get('/avatar/1')
+    assert response.status_code == 200
+    assert response.get_data() == PNG
+    assert len(upstream.hits) == 2
@@ -0,0 +1,57 @@
+from sqlalchemy import text
+
+from application import create_app
+from bench.load import InProcessClient, compare, percentile, run_scenario
+from bench.seed import SeedSpec, seed_database
+from extensions import db
+
+
+def test_seed_is_reproducible_and_builds_deep_threads(tmp_path):
+    spec = SeedSpec(users=5, posts=4, comments_per_post=6, chain_depth=30)
+    rows = []
+    for name in ('a.db', 'b.db'):
+        url = f'sqlite:///{tmp_path / name}'
+        counts = seed_database(url, spec)
+        app = create_app({'SQLALCHEMY_DATABASE_URI': url, 'SCHEMA_CHECK': False})
+        with app.app_context():
+            rows.append(db.session.execute(text('SELECT id, parent_id, path, content FROM comments')).all())
+            assert db.session.execute(text('SELECT MAX(depth) FROM comments')).scalar() >= 29
+            assert db.session.execute(text('SELECT COUNT(*) FROM search_index')).scalar() == \
+                counts['posts'] + counts['comments']
+    assert counts['users'] == 5 and counts['posts'] == 4
+    assert rows[0] == rows[1]
+
+
+def test_load_run_reports_latency_and_queries(tmp_path):
+    url = f'sqlite:///{tmp_path / "bench.db"}'
+    seed_database(url, SeedSpec(users=3, posts=3, comments_per_post=3), index=False)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': url, 'SQL_PROFILE': True, 'SCHEMA_CHECK': False,
+                      'SECRET_KEY': 'bench'})
+    result = run_scenario('comment', lambda: InProcessClient(app), requests=4, concurrency=2, seed=1,
+                          post_count=3, user_count=3)
+    assert result['requests'] == 4 and result['errors'] == 0
+    assert result['p50_ms'] <= result['p95_ms'] <= result['p99_ms']
+    assert result['queries_per_request'] > 0
+
+
+def test_streamed_and_anonymous_pages_report_their_queries(tmp_path):
+    url = f'sqlite:///{tmp_path / "bench.db"}'
+    seed_database(url, SeedSpec(users=3, posts=3, comments_per_post=3), index=False)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': url, 'SQL_PROFILE': True, 'SCHEMA_CHECK': False,
+                      'PAGE_CACHE_ENABLED': False, 'STREAM_POST_PAGES': True, 'SECRET_KEY': 'bench'})
+    for scenario in ('index', 'post'):
+        result = run_scenario(scenario, lambda: InProcessClient(app), requests=4, concurrency=2, seed=1,
+                              post_count=3, user_count=3, warmup=1)
+        assert result['errors'] == 0
+        # the post page streams, so its count comes from the profiler's history
+        assert result['queries_per_request'] >= 1
+
+
+def test_compare_flags_slowdowns_and_extra_queries():
+    base = {'p95_ms': 10.0, 'throughput_rps': 100.0, 'error_rate': 0.0, 'queries_per_request': 2.0}
+    baseline = {'scenarios': {'post': base}}
+    same = {'scenarios': {'post': dict(base, p95_ms=11.0)}}
+    assert compare(same, baseline, tolerance=0.25) == []
+    worse = {'scenarios': {'post': dict(base, p95_ms=20.0, queries_per_request=3.0)}}
+    assert len(compare(worse, baseline, tolerance=0.25)) == 2
+    assert percentile([1, 2, 3, 4], 0.5) == 2 and percentile([1, 2, 3, 4], 0.99) == 4
@@ -0,0 +1,40 @@
+import gzip
+
+from test_routes import create_post, create_test_app, register_admin
+
+
+def test_rendered_pages_are_gzipped_for_clients_that_accept_it():
+    app, db = create_test_app()
+    client = app.test_client()
+    plain = client.get('/about')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    compressed = client.get('/about', headers={'Accept-Encoding': 'gzip, deflate, br'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert int(compressed.headers['Content-Length']) < len(plain.get_data())
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+
+    # static files are left to build-assets
+    assert 'Content-Encoding' not in client.get('/static/js/push.js', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in create_test_app(COMPRESS_RESPONSES=False)[0].test_client().get(
+        '/about', headers={'Accept-Encoding': 'gzip'}).headers
+
+
+def test_streamed_and_cached_pages_are_gzipped_and_still_revalidate():
+    app, db = create_test_app()
+    with app.app_context():
+        admin = app.test_client()
+        register_admin(admin)
+        create_post(admin)
+    anonymous = app.test_client()
+
+    streamed = anonymous.get('/post/1', headers={'Accept-Encoding': 'gzip'})
+    assert streamed.headers['Content-Encoding'] == 'gzip' and 'Content-Length' not in streamed.headers
+    html = gzip.decompress(streamed.get_data()).decode()
+    assert 'First post' in html and html.rstrip().endswith('</html>')
+
+    first = anonymous.get('/', headers={'Accept-Encoding': 'gzip'})
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    assert anonymous.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
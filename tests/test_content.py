@@ -0,0 +1,31 @@
+from content import compile_content, html_to_text, sanitize_html
+
+
+def test_sanitizer_drops_scripts_handlers_and_unsafe_urls():
+    dirty = (
+        '<p onclick="steal()">Hi <script>alert(1)</script><b>there</b></p>'
+        '<a href="javascript:alert(1)">x</a><a href=" JaVa\tscript:alert(1)">y</a>'
+        '<a href="https://example.com" target="_blank">ok</a>'
+        '<img src="data:text/html,evil"><iframe src="https://evil.example"><p>gone</p></iframe>'
+    )
+    assert sanitize_html(dirty) == (
+        '<p>Hi <b>there</b></p><a>x</a><a>y</a>'
+        '<a href="https://example.com" rel="nofollow noopener">ok</a><img>'
+    )
+
+
+def test_sanitizer_escapes_text_and_balances_tags():
+    assert sanitize_html('<ul><li>1 &lt; 2<li>two</ul><p>open') == '<ul><li>1 &lt; 2<li>two</li></li></ul><p>open</p>'
+    assert sanitize_html('<em>a</strong>b</em>') == '<em>ab</em>'
+    assert sanitize_html('<p><unknown>kept text</unknown></p>') == '<p>kept text</p>'
+
+
+def test_compile_content_precomputes_excerpt_and_reading_time():
+    body = '<h2>Title</h2><p>' + ' '.join(['word'] * 450) + '</p>'
+    compiled = compile_content(body, excerpt_words=5)
+    assert compiled.word_count == 451
+    assert compiled.reading_minutes == 3
+    assert compiled.excerpt == 'Title word word word word…'
+    assert compiled.content_hash == compile_content(body).content_hash
+    assert compile_content('').reading_minutes == 1
+    assert html_to_text('<p>one</p><p>two</p>') == 'one two'
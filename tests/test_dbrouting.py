@@ -0,0 +1,82 @@
+from sqlalchemy import text
+
+import dbrouting
+from extensions import db
+from test_routes import create_test_app, create_post, post_comment, register_admin
+
+
+def create_replicated_app(tmp_path, **config):
+    primary = f'sqlite:///{tmp_path / "primary.db"}'
+    replica = f'sqlite:///{tmp_path / "replica.db"}'
+    # the page cache is off so every GET really hits the database
+    app, _ = create_test_app(SQLALCHEMY_DATABASE_URI=primary, DATABASE_REPLICA_URLS=[replica],
+                             PAGE_CACHE_ENABLED=False, **config)
+    with app.app_context():
+        db.metadata.create_all(app.extensions['db_replicas']['replica_0'])
+    return app
+
+
+def replica_title(app, title):
+    with app.app_context(), app.extensions['db_replicas']['replica_0'].begin() as connection:
+        connection.execute(text(
+            "INSERT INTO blog_posts (title, subtitle, date, published_at, body, author_id, img_url, "
+            "word_count, reading_minutes) VALUES (:title, 'Sub', 'x', '2024-01-01 00:00:00', '<p>b</p>', 1, "
+            "'https://example.com/i.jpg', 1, 1)"
+        ), {'title': title})
+
+
+def test_anonymous_reads_go_to_the_replica_and_writers_stick_to_the_primary(tmp_path):
+    app = create_replicated_app(tmp_path)
+    replica_title(app, 'Only on the replica')
+    admin = app.test_client()
+    with app.app_context():
+        register_admin(admin)
+        create_post(admin, title='Fresh on the primary')
+
+    anonymous = app.test_client()
+    html = anonymous.get('/').get_data(as_text=True)
+    assert 'Only on the replica' in html
+    assert 'Fresh on the primary' not in html
+
+    # the author's own write is visible straight away
+    html = admin.get('/').get_data(as_text=True)
+    assert 'Fresh on the primary' in html
+    assert 'Only on the replica' not in html
+
+    # writes on a read-only route still go to the primary
+    with app.app_context():
+        post_comment(admin, 1, 'Hello')
+        assert db.session.execute(text('SELECT COUNT(*) FROM comments')).scalar() == 1
+
+
+def test_routes_that_are_not_read_only_use_the_primary(tmp_path):
+    app = create_replicated_app(tmp_path)
+    replica_title(app, 'Only on the replica')
+    anonymous = app.test_client()
+    with app.app_context():
+        register_admin(app.test_client())
+    # /avatar is not marked read-only, so the user it looks up is found on the primary
+    assert anonymous.get('/avatar/1').status_code == 200
+
+
+def test_pool_settings_and_saturation_stats(tmp_path):
+    app = create_replicated_app(tmp_path, DB_POOL_SIZE=2, DB_MAX_OVERFLOW=0, DB_POOL_TIMEOUT=1)
+    with app.app_context():
+        assert db.engines[None].pool.size() == 2
+        assert app.extensions['db_replicas']['replica_0'].pool.size() == 2
+        first = db.engines[None].connect()
+        second = db.engines[None].connect()
+        stats = dbrouting.pool_stats()['primary']
+        first.close()
+        second.close()
+    assert stats['limit'] == 2
+    assert stats['checked_out'] == 2
+    assert stats['saturated_checkouts'] == 1
+    assert set(dbrouting.pool_stats(app)) == {'primary', 'replica_0'}
+
+
+def test_in_memory_sqlite_keeps_its_static_pool():
+    assert dbrouting.pool_options('sqlite:///:memory:', {}) == {}
+    app, _ = create_test_app()
+    with app.app_context():
+        assert type(db.engines[None].pool).__name__ == 'StaticPool'
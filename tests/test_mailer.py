@@ -0,0 +1,135 @@
+import socketserver
+import threading
+
+import pytest
+
+import metrics
+from mailer import SMTPPool, BulkSendError, build_message
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of RFC 5321 for smtplib, without TLS or auth."""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        if server.max_connections and server.connections > server.max_connections:
+            return  # refuse: hang up before the greeting
+        sent_here = 0
+        self.reply('220 fake ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 fake')
+            elif command.startswith(('MAIL', 'RCPT', 'RSET', 'NOOP')):
+                if command.startswith('MAIL') and server.drop_after and sent_here >= server.drop_after:
+                    return  # hang up mid-session
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                while (chunk := self.rfile.readline()) not in (b'.\r\n', b''):
+                    data.append(chunk)
+                server.messages.append(b''.join(data).decode())
+                sent_here += 1
+                self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 not implemented')
+
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeSMTPHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.messages = []
+    server.drop_after = None
+    server.max_connections = None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_pool(server, **kwargs):
+    host, port = server.server_address
+    return SMTPPool(host, port, starttls=False, timeout=5, **kwargs)
+
+
+def messages(count):
+    return [build_message('blog@example.com', f'user{i}@example.com', 'New post', 'Hello') for i in range(count)]
+
+
+def test_connections_are_reused_across_sends(smtp_server):
+    pool = make_pool(smtp_server)
+    for message in messages(3):
+        pool.send(message)
+    pool.close()
+    assert len(smtp_server.messages) == 3
+    assert smtp_server.connections == 1
+
+
+def test_bulk_send_uses_one_session_per_chunk_and_recycles(smtp_server):
+    pool = make_pool(smtp_server, max_messages_per_connection=4)
+    pool.send_bulk(messages(10), chunk_size=5)
+    pool.close()
+    assert len(smtp_server.messages) == 10
+    assert smtp_server.connections == 3
+
+
+def test_bulk_send_reconnects_when_server_drops(smtp_server):
+    smtp_server.drop_after = 3
+    pool = make_pool(smtp_server)
+    pool.send_bulk(messages(7))
+    pool.close()
+    assert len(smtp_server.messages) == 7
+    assert smtp_server.connections == 3
+
+
+def test_bulk_send_reports_failed_recipients(smtp_server, monkeypatch):
+    pool = make_pool(smtp_server)
+    batch = messages(3)
+    batch[1].replace_header('To', 'bad@example.com')
+    original = pool._send_one
+
+    def send_one(conn, message):
+        if message['To'] == 'bad@example.com':
+            raise ValueError('rejected')
+        original(conn, message)
+
+    monkeypatch.setattr(pool, '_send_one', send_one)
+    with pytest.raises(BulkSendError) as excinfo:
+        pool.send_bulk(batch)
+    assert list(excinfo.value.failed) == ['bad@example.com']
+    assert len(smtp_server.messages) == 2
+
+
+def test_bulk_send_fails_the_unsent_rest_when_the_server_refuses_reconnects(smtp_server):
+    smtp_server.drop_after = 3
+    smtp_server.max_connections = 1
+    pool = make_pool(smtp_server)
+    with pytest.raises(BulkSendError) as excinfo:
+        pool.send_bulk(messages(8), chunk_size=5)
+    pool.close()
+    # the three sent ones must not be retried; everyone else must be
+    assert len(smtp_server.messages) == 3
+    assert sorted(excinfo.value.failed) == sorted(f'user{i}@example.com' for i in range(3, 8))
+
+
+def test_each_smtp_send_is_timed(smtp_server):
+    before = sum(sum(counts) for key, counts, _ in metrics.SMTP_SECONDS.samples() if key == ['ok'])
+    pool = make_pool(smtp_server)
+    pool.send_bulk(messages(3))
+    pool.close()
+    after = sum(sum(counts) for key, counts, _ in metrics.SMTP_SECONDS.samples() if key == ['ok'])
+    assert after - before == 3
@@ -0,0 +1,94 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+import metrics
+from models import OutboxMessage
+from test_routes import create_test_app, register_admin
+
+
+def sample(text, series):
+    match = re.search(rf'^{re.escape(series)} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_metrics_report_requests_db_time_pool_and_outbox():
+    app, db = create_test_app()
+    client = app.test_client()
+    with app.app_context():
+        register_admin(client)
+        db.session.add_all([OutboxMessage(kind='email', payload='{}'), OutboxMessage(kind='push', payload='{}')])
+        db.session.commit()
+
+    before = client.get('/metrics').get_data(as_text=True)
+    client.get('/')
+    client.get('/no-such-page').get_data()
+    response = client.get('/metrics')
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+
+    requests = 'http_requests_total{endpoint="blog.get_all_posts",method="GET",status="200"}'
+    assert sample(text, requests) == sample(before, requests) + 1
+    assert sample(text, 'http_requests_total{endpoint="unmatched",method="GET",status="404"}') >= 1
+    latency = 'http_request_duration_seconds_count{endpoint="blog.get_all_posts",method="GET"}'
+    assert sample(text, latency) == sample(before, latency) + 1
+    assert 'http_request_duration_seconds_bucket{endpoint="blog.get_all_posts",method="GET",le="+Inf"}' in text
+    assert sample(text, 'db_query_duration_seconds_count{bind="primary",operation="SELECT"}') > 0
+    assert 'db_pool_checked_out{bind="primary"}' in text
+    assert sample(text, 'outbox_messages{status="pending"}') == 2
+
+
+def test_metrics_token_is_required_when_configured():
+    app, db = create_test_app(METRICS_TOKEN='s3cret')
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+
+def test_workers_are_added_up_and_dead_workers_keep_their_counts(tmp_path):
+    directory = str(tmp_path)
+    # two real processes standing in for gunicorn workers
+    worker = (
+        'import sys, metrics\n'
+        'metrics.REGISTRY.configure(sys.argv[1])\n'
+        'for _ in range(int(sys.argv[2])):\n'
+        '    metrics.REQUESTS.inc(endpoint="blog.get_all_posts", method="GET", status=200)\n'
+        '    metrics.REQUEST_SECONDS.observe(0.02, endpoint="blog.get_all_posts", method="GET")\n'
+        'metrics.Gauge("db_pool_checked_out", "", ("bind",), lambda: {("primary",): 1})\n'
+        'metrics.REGISTRY.flush()\n'
+        'print(__import__("os").getpid())\n'
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pids = [subprocess.run([sys.executable, '-c', worker, directory, str(count)], cwd=root,
+                           capture_output=True, text=True, check=True).stdout.strip() for count in (3, 4)]
+    assert sorted(os.listdir(directory)) == sorted(f'{pid}.json' for pid in pids)
+
+    registry = metrics.Registry()
+    requests = metrics.Counter('http_requests_total', 'Responses.', ('endpoint', 'method', 'status'), registry=registry)
+    latency = metrics.Histogram('http_request_duration_seconds', 'Latency.', ('endpoint', 'method'), registry=registry)
+    metrics.Gauge('db_pool_checked_out', 'In use.', ('bind',), lambda: {('primary',): 2}, registry=registry)
+    registry.configure(directory)
+    requests.inc(endpoint='blog.get_all_posts', method='GET', status=200)
+    latency.observe(0.3, endpoint='blog.get_all_posts', method='GET')
+
+    text = registry.expose()
+    assert sample(text, 'http_requests_total{endpoint="blog.get_all_posts",method="GET",status="200"}') == 8
+    assert sample(text, 'http_request_duration_seconds_bucket{endpoint="blog.get_all_posts",method="GET",le="0.025"}') == 7
+    assert sample(text, 'http_request_duration_seconds_count{endpoint="blog.get_all_posts",method="GET"}') == 8
+    # the two workers have exited, so only this process's gauge counts
+    assert sample(text, 'db_pool_checked_out{bind="primary"}') == 2
+
+    # as gunicorn's master does it: a process that never built the app or registered any gauge
+    master = (
+        'import sys, metrics\n'
+        'assert "application" not in sys.modules and not metrics.REGISTRY.gauges\n'
+        'metrics.mark_process_dead(int(sys.argv[2]), sys.argv[1])\n'
+    )
+    subprocess.run([sys.executable, '-c', master, directory, pids[0]], cwd=root, check=True)
+    assert not os.path.exists(os.path.join(directory, f'{pids[0]}.json'))
+    with open(os.path.join(directory, metrics.ARCHIVE)) as f:
+        archived = json.load(f)['samples']
+    assert 'http_requests_total' in archived and 'db_pool_checked_out' not in archived
+    assert sample(registry.expose(), 'http_requests_total{endpoint="blog.get_all_posts",method="GET",status="200"}') == 8
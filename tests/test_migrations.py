@@ -0,0 +1,89 @@
+import sqlite3
+
+from sqlalchemy import create_engine, inspect
+
+import migrations
+from extensions import db
+from models import email_hash
+
+# The tables as the first release created them, before migrations existed
+BASELINE_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR(100), email VARCHAR UNIQUE,
+                    password VARCHAR(100), is_admin BOOLEAN);
+CREATE TABLE blog_posts (id INTEGER PRIMARY KEY, title VARCHAR(250) NOT NULL UNIQUE,
+                         subtitle VARCHAR(250) NOT NULL, date VARCHAR(250) NOT NULL, body TEXT NOT NULL,
+                         author_id INTEGER REFERENCES users(id), img_url VARCHAR(250) NOT NULL);
+CREATE TABLE comments (id INTEGER PRIMARY KEY, content TEXT NOT NULL, author_id INTEGER REFERENCES users(id),
+                       post_id INTEGER REFERENCES blog_posts(id), created_at DATETIME,
+                       parent_id INTEGER REFERENCES comments(id));
+CREATE TABLE push_subscriptions (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users(id), data TEXT);
+INSERT INTO users VALUES (1, 'Admin', 'Admin@Example.com ', 'x', 1);
+INSERT INTO blog_posts VALUES (1, 'Old', 'Sub', 'August 03, 2023', '<p>Hi<script>x()</script></p>', 1, 'u');
+INSERT INTO blog_posts VALUES (2, 'New', 'Sub', 'April 10, 2024', '<p>Later</p>', 1, 'u');
+INSERT INTO comments VALUES (1, '<p>root</p>', 1, 1, '2024-01-01 00:00:00', NULL);
+INSERT INTO comments VALUES (2, '<p>reply<img src=x onerror=alert(1)></p>', 1, 1, '2024-01-02 00:00:00', 1);
+INSERT INTO comments VALUES (3, '<p>deeper</p>', 1, 1, '2024-01-03 00:00:00', 2);
+INSERT INTO comments VALUES (4, '<p>left behind by a deleted post</p>', 1, 9, '2024-01-04 00:00:00', NULL);
+INSERT INTO comments VALUES (5, '<p>and its reply</p>', 1, 9, '2024-01-05 00:00:00', 4);
+"""
+
+
+def baseline_engine(tmp_path):
+    path = tmp_path / 'blog.db'
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.close()
+    return create_engine(f'sqlite:///{path}')
+
+
+def test_upgrade_brings_a_baseline_database_to_the_latest_schema(tmp_path, caplog):
+    engine = baseline_engine(tmp_path)
+    assert not migrations.check_schema(engine)
+
+    assert migrations.upgrade(engine, db.metadata) == [1, 2, 3, 4, 5, 6]
+    assert migrations.check_schema(engine)
+    assert 'Deleted 2 comments whose post or parent comment no longer exists' in caplog.text
+
+    inspector = inspect(engine)
+    assert {'outbox', 'schema_version'} <= set(inspector.get_table_names())
+    assert {'path', 'depth'} <= {c['name'] for c in inspector.get_columns('comments')}
+    comment_indexes = {index['name'] for index in inspector.get_indexes('comments')}
+    assert {'ix_comments_post_parent_created', 'ix_comments_parent_id', 'ix_comments_post_id_path'} <= comment_indexes
+    assert 'ix_blog_posts_author_id' in {index['name'] for index in inspector.get_indexes('blog_posts')}
+    assert 'ix_push_subscriptions_user_id' in {i['name'] for i in inspector.get_indexes('push_subscriptions')}
+
+    with engine.connect() as connection:
+        posts = connection.exec_driver_sql(
+            'SELECT title, published_at, body_html FROM blog_posts ORDER BY published_at DESC').all()
+        assert [title for title, _, _ in posts] == ['New', 'Old']
+        assert posts[1][2] == '<p>Hi</p>'
+        comments = connection.exec_driver_sql('SELECT path, depth, content FROM comments ORDER BY id').all()
+        assert comments[2][:2] == ('0000000001/0000000002/0000000003', 2)
+        assert comments[1][2] == '<p>reply<img src="x"></p>'
+        activity = connection.exec_driver_sql(
+            'SELECT comment_count, last_comment_at FROM blog_posts ORDER BY id').all()
+        assert activity == [(3, '2024-01-03 00:00:00'), (0, None)]
+        replies = connection.exec_driver_sql('SELECT reply_count FROM comments ORDER BY id').scalars().all()
+        assert replies == [1, 1, 0]
+        stored_hash = connection.exec_driver_sql('SELECT email_hash FROM users').scalar()
+        assert stored_hash == email_hash('admin@example.com')
+
+    foreign_keys = {fk['constrained_columns'][0]: fk['options'].get('ondelete')
+                    for fk in inspect(engine).get_foreign_keys('comments')}
+    assert foreign_keys['post_id'] == foreign_keys['parent_id'] == 'CASCADE'
+    assert {'ix_comments_post_id_path', 'ix_comments_parent_id'} <= {
+        index['name'] for index in inspect(engine).get_indexes('comments')}
+    with engine.begin() as connection:
+        connection.exec_driver_sql('PRAGMA foreign_keys = ON')
+        connection.exec_driver_sql('DELETE FROM comments WHERE id = 2')
+        assert connection.exec_driver_sql('SELECT id FROM comments').scalars().all() == [1]
+        connection.exec_driver_sql('DELETE FROM blog_posts WHERE id = 1')
+        assert connection.exec_driver_sql('SELECT COUNT(*) FROM comments').scalar() == 0
+
+
+def test_upgrade_is_idempotent_and_works_on_an_empty_database(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "fresh.db"}')
+    assert migrations.upgrade(engine, db.metadata) == [1, 2, 3, 4, 5, 6]
+    assert migrations.upgrade(engine, db.metadata) == []
+    with engine.connect() as connection:
+        assert migrations.current_version(connection) == migrations.LATEST_VERSION
@@ -0,0 +1,96 @@
+import base64
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from push import PushDispatcher, parse_subscription
+
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def vapid_private_key() -> str:
+    key = ec.generate_private_key(ec.SECP256R1())
+    return b64url(key.private_numbers().private_value.to_bytes(32, 'big'))
+
+
+def browser_keys() -> dict:
+    key = ec.generate_private_key(ec.SECP256R1())
+    public = key.public_key().public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+    return {'p256dh': b64url(public), 'auth': b64url(os.urandom(16))}
+
+
+class FakePushService(BaseHTTPRequestHandler):
+    """Answers 201 for /ok/..., 410 for /gone/... and 500 for anything else."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, self.headers.get('Authorization', '')))
+        if self.path.startswith('/ok/'):
+            status = 201
+        elif self.path.startswith('/gone/'):
+            status = 410
+        else:
+            status = 500
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def push_service():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakePushService)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    server.url = f'http://{host}:{port}'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def subscription(push_service, path):
+    return {'endpoint': f'{push_service.url}{path}', **browser_keys()}
+
+
+def test_parse_subscription_rejects_incomplete_data():
+    with pytest.raises(ValueError):
+        parse_subscription({'endpoint': 'https://push.example.com/abc'})
+    parsed = parse_subscription('{"endpoint": "https://push.example.com/abc", "keys": {"p256dh": "x", "auth": "y"}}')
+    assert parsed == {'endpoint': 'https://push.example.com/abc', 'p256dh': 'x', 'auth': 'y'}
+
+
+def test_dispatch_sorts_results_and_signs_once_per_origin(push_service, monkeypatch):
+    dispatcher = PushDispatcher(vapid_private_key(), 'mailto:admin@example.com', max_workers=4)
+    signs = []
+    original = dispatcher._vapid_headers_for
+
+    def counting_headers(origin):
+        headers = original(origin)
+        signs.append(id(headers))
+        return headers
+
+    monkeypatch.setattr(dispatcher, '_vapid_headers_for', counting_headers)
+    subscriptions = {i: subscription(push_service, f'/ok/{i}') for i in range(6)}
+    subscriptions['expired'] = subscription(push_service, '/gone/1')
+    subscriptions['broken'] = subscription(push_service, '/error/1')
+
+    result = dispatcher.dispatch(subscriptions, {'title': 'Hi', 'body': 'There'})
+    dispatcher.close()
+
+    assert result.sent == 6
+    assert result.gone == ['expired']
+    assert list(result.failed) == ['broken']
+    assert len(push_service.requests) == 8
+    assert all(auth.startswith('vapid ') for _, auth in push_service.requests)
+    # every request reused the same signed headers for the single origin
+    assert len(set(signs)) == 1
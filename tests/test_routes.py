@@ -1,25 +1,37 @@
-import os
-import importlib
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
 import pytest
+
+import blog
+import commands
+import notifications
+from application import config_from_env, create_app
+from bench.seed import ADMIN_EMAIL, PASSWORD, SeedSpec, generate
+from extensions import db, page_cache, search_index
+from models import BlogPost, Comment, OutboxMessage, PushSubscription, User
+from sqlprofiler import assert_max_queries, statement_shape
 from werkzeug.security import check_password_hash
 
 
-def create_test_app():
-    os.environ.setdefault('DATABASE_URL', '')
-    import main
-    importlib.reload(main)
-    app = main.app
-    app.config.update(
-        TESTING=True,
-        WTF_CSRF_ENABLED=False,
-        SQLALCHEMY_DATABASE_URI='sqlite:///:memory:'
-    )
-    # reset engines and create tables for in-memory DB
-    if 'sqlalchemy' in app.extensions and 'engines' in app.extensions['sqlalchemy']:
-        app.extensions['sqlalchemy']['engines'] = {}
+def create_test_app(**config):
+    # every app gets its own engine on a fresh in-memory DB
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SECRET_KEY': 'test-secret',
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+        'SCHEMA_CHECK': False,
+        # one process here, so the per-process version store is coherent
+        'PAGE_CACHE_ENABLED': True,
+        **config,
+    })
     with app.app_context():
-        main.db.create_all()
-    return app, main.db
+        db.create_all()
+    return app, db
 
 
 @pytest.fixture
@@ -50,7 +62,7 @@ def test_register_and_login(client):
         }
         response = app.test_client().post('/register', data=register_data, follow_redirects=True)
         assert response.status_code == 200
-        assert db.session.query(main.User).count() == 1
+        assert db.session.query(User).count() == 1
 
         login_data = {
             'email': 'tester@example.com',
@@ -79,7 +91,7 @@ def test_password_reset_flow(monkeypatch):
         def fake_send_email(to_addr, subject, body):
             captured['body'] = body
 
-        monkeypatch.setattr(importlib.import_module('main'), 'send_email', fake_send_email)
+        monkeypatch.setattr(notifications, 'send_email', fake_send_email)
 
         request_data = {
             'email': 'tester@example.com',
@@ -87,7 +99,7 @@ def test_password_reset_flow(monkeypatch):
         }
         app.test_client().post('/reset-password', data=request_data, follow_redirects=True)
 
-        token = captured['body'].split('/')[-1].strip()
+        token = captured['body'].split('/reset/')[1].split()[0]
 
         reset_data = {
             'password': 'newsecret',
@@ -97,5 +109,599 @@ def test_password_reset_flow(monkeypatch):
         response = app.test_client().post(f'/reset/{token}', data=reset_data, follow_redirects=True)
 
         assert response.status_code == 200
-        user = db.session.execute(db.select(importlib.import_module('main').User).where(importlib.import_module('main').User.email == 'tester@example.com')).scalar()
-        assert user and importlib.import_module('main').check_password_hash(user.password, 'newsecret')
+        user = db.session.execute(db.select(User).where(User.email == 'tester@example.com')).scalar()
+        assert user and check_password_hash(user.password, 'newsecret')
+
+
+def register_admin(client):
+    client.post('/register', data={
+        'name': 'Admin',
+        'email': 'admin@example.com',
+        'password': 'secret',
+        'accept_rules': True,
+        'submit': 'Sign Me Up!'
+    }, follow_redirects=True)
+
+
+def create_post(client, title='First post'):
+    return client.post('/new-post', data={
+        'title': title,
+        'subtitle': 'A subtitle',
+        'img_url': 'https://example.com/image.jpg',
+        'body': '<p>Hello world</p>',
+        'submit': 'Submit Post'
+    })
+
+
+def test_new_post_is_delivered_through_outbox(monkeypatch):
+    app, db = create_test_app()
+    sent, pushed = [], []
+    monkeypatch.setattr(notifications, 'send_bulk_email', lambda to_addrs, subject, body: sent.extend(to_addrs))
+    monkeypatch.setattr(notifications, 'broadcast_push', lambda title, body, user_id=None, subscription_ids=None: pushed.append(title))
+
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        create_post(client)
+
+        # nothing is sent inside the request, only queued
+        assert sent == [] and pushed == []
+        kinds = db.session.execute(db.select(OutboxMessage.kind)).scalars().all()
+        assert sorted(kinds) == ['email_all', 'push']
+
+        notifications.process_outbox()  # expands email_all into per-session batches
+        notifications.process_outbox()
+
+        assert sent == ['admin@example.com']
+        assert pushed == ['New post']
+        statuses = db.session.execute(db.select(OutboxMessage.status)).scalars().all()
+        assert set(statuses) == {'sent'}
+
+
+def test_outbox_retries_with_backoff_then_dead_letters(monkeypatch):
+    app, db = create_test_app(OUTBOX_MAX_ATTEMPTS=2)
+
+    def failing_send_email(to_addr, subject, body):
+        raise ConnectionError('smtp down')
+
+    monkeypatch.setattr(notifications, 'send_email', failing_send_email)
+
+    with app.app_context():
+        notifications.enqueue_notification('email', to_addr='a@example.com', subject='Hi', body='Body')
+        db.session.commit()
+
+        notifications.process_outbox()
+        message = db.session.execute(db.select(OutboxMessage)).scalar()
+        assert message.status == 'pending'
+        assert message.attempts == 1
+        assert message.next_attempt_at > datetime.utcnow()
+
+        # not due yet, so a second pass leaves it alone
+        assert notifications.process_outbox() == 0
+
+        message.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        notifications.process_outbox()
+        assert message.status == 'dead'
+        assert 'smtp down' in message.last_error
+
+
+def test_concurrent_outbox_workers_send_each_message_once_on_sqlite(monkeypatch, tmp_path):
+    # a file, so every thread's connection sees the same database
+    app, db = create_test_app(SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "outbox.db"}')
+    sent = []
+
+    def slow_send_email(to_addr, subject, body):
+        time.sleep(0.01)
+        sent.append(to_addr)
+
+    monkeypatch.setattr(notifications, 'send_email', slow_send_email)
+    with app.app_context():
+        for n in range(40):
+            notifications.enqueue_notification('email', to_addr=f'user{n}@example.com', subject='Hi', body='Body')
+        db.session.commit()
+
+    start = threading.Barrier(4)
+
+    def work():
+        with app.app_context():
+            start.wait()
+            while notifications.process_outbox(limit=5):
+                pass
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(sent) == sorted(f'user{n}@example.com' for n in range(40))
+
+
+def test_broadcast_prunes_gone_subscriptions_and_returns_failures(monkeypatch):
+    app, db = create_test_app()
+
+    def fake_send(subscription, data):
+        return {'gone': 410, 'ok': 201}.get(subscription['endpoint'].rsplit('/', 1)[1], 503)
+
+    with app.app_context():
+        monkeypatch.setattr(notifications.push_dispatcher(), 'send', fake_send)
+        client = app.test_client()
+        register_admin(client)
+        for path in ('/ok', '/gone', '/down'):
+            keys = {'p256dh': 'key', 'auth': 'auth'}
+            db.session.add(PushSubscription(user_id=1, data='{}', endpoint=f'https://push.example.com{path}', **keys))
+        db.session.commit()
+
+        failed = notifications.broadcast_push('Title', 'Body')
+
+        endpoints = db.session.execute(db.select(PushSubscription.endpoint)).scalars().all()
+        assert sorted(endpoints) == ['https://push.example.com/down', 'https://push.example.com/ok']
+        assert len(failed) == 1
+
+
+def test_subscribe_stores_parsed_subscription():
+    app, db = create_test_app()
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        assert client.post('/subscribe', json={'endpoint': 'https://push.example.com/x'}).status_code == 400
+        response = client.post('/subscribe', json={
+            'endpoint': 'https://push.example.com/x',
+            'keys': {'p256dh': 'pub', 'auth': 'secret'},
+        })
+        assert response.status_code == 201
+        sub = db.session.execute(db.select(PushSubscription)).scalar()
+        assert (sub.endpoint, sub.p256dh, sub.auth) == ('https://push.example.com/x', 'pub', 'secret')
+
+
+def post_comment(client, post_id, text, parent_id=None):
+    data = {'comment_text': text, 'submit': 'Submit Comment'}
+    if parent_id:
+        data['parent_id'] = parent_id
+    return client.post(f'/post/{post_id}', data=data)
+
+
+def test_comment_thread_loads_in_constant_queries():
+    app, db = create_test_app()
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        create_post(client)
+        post_comment(client, 1, 'Root comment')
+        parent_id = 1
+        for depth in range(5):
+            post_comment(client, 1, f'Reply level {depth}', parent_id=parent_id)
+            parent_id += 1
+        post_comment(client, 1, 'Second root')
+
+        deepest = db.session.get(Comment, 6)
+        assert deepest.depth == 5
+        assert deepest.path == '/'.join(str(i).zfill(10) for i in range(1, 7))
+
+        # the post, then one chunk of threads: its roots and all of their replies
+        with assert_max_queries(3) as stats:
+            html = client.get('/post/1').get_data(as_text=True)
+
+        assert 'Reply level 4' in html
+        assert html.index('Second root') < html.index('Root comment') < html.index('Reply level 0')
+        assert sum(count for shape, count in stats.shapes.items() if 'FROM comments' in shape) == 2
+
+
+def test_post_page_streams_threads_in_chunks_and_pages_the_rest(monkeypatch):
+    monkeypatch.setattr(blog, 'COMMENT_THREADS_PER_PAGE', 5)
+    monkeypatch.setattr(blog, 'COMMENT_CHUNK_SIZE', 2)
+    app, db = create_test_app()
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        create_post(client)
+        for i in range(7):
+            post_comment(client, 1, f'Thread {i}')
+        post_comment(client, 1, 'Reply to thread 2', parent_id=3)
+
+        with assert_max_queries(5) as stats:
+            response = client.get('/post/1')
+            assert 'Content-Length' not in response.headers
+            html = response.get_data(as_text=True)
+        # roots once, then replies only for the one chunk whose threads have any
+        assert sum(count for shape, count in stats.shapes.items() if 'FROM comments' in shape) == 2
+        assert html.index('Thread 6') < html.index('Thread 3') < html.index('Thread 2') < html.index('Reply to thread 2')
+        assert 'Thread 1' not in html and html.rstrip().endswith('</html>')
+        assert 'href="/post/1/comments?before=3"' in html
+
+        fragment = client.get('/post/1/comments?before=3').get_data(as_text=True)
+        assert 'Thread 1' in fragment and 'Thread 0' in fragment
+        assert 'Thread 2' not in fragment and 'Load more comments' not in fragment
+        assert '<html' not in fragment
+
+
+def test_streamed_post_page_is_cached_once_fully_sent():
+    app, db = create_test_app()
+    with app.app_context():
+        admin = app.test_client()
+        register_admin(admin)
+        create_post(admin)
+        post_comment(admin, 1, 'First!')
+    anonymous = app.test_client()
+
+    first = anonymous.get('/post/1').get_data()
+    with assert_max_queries(0):
+        again = anonymous.get('/post/1')
+        assert again.headers['Content-Length'] == str(len(first))
+        assert again.get_data() == first
+
+
+def test_post_page_renders_in_one_go_when_streaming_is_off():
+    app, db = create_test_app(STREAM_POST_PAGES=False)
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        create_post(client)
+        post_comment(client, 1, 'Root comment')
+        post_comment(client, 1, 'A reply', parent_id=1)
+        response = client.get('/post/1')
+        assert 'Content-Length' in response.headers
+        html = response.get_data(as_text=True)
+        assert html.index('Root comment') < html.index('A reply')
+        assert 'Load more comments' not in html
+
+
+def test_reply_to_comment_on_another_post_is_rejected():
+    app, db = create_test_app()
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        create_post(client)
+        create_post(client, title='Second post')
+        post_comment(client, 1, 'On the first post')
+        assert post_comment(client, 2, 'Sneaky', parent_id=1).status_code == 400
+        for bad in ('abc', '-1', '1.5', '0'):
+            assert post_comment(client, 1, 'Malformed', parent_id=bad).status_code == 400
+        assert db.session.query(Comment).count() == 1
+
+
+def test_index_paginates_by_publication_time():
+    app, db = create_test_app()
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        base = datetime(2024, 1, 1)
+        for day in range(12):
+            db.session.add(BlogPost(
+                title=f'Post {day:02d}', subtitle='Sub', body='<p>Body</p>', img_url='https://example.com/i.jpg',
+                author_id=1, date='ignored', published_at=base + timedelta(days=day),
+            ))
+        db.session.commit()
+
+        first = client.get('/').get_data(as_text=True)
+        assert first.index('Post 11') < first.index('Post 02')
+        assert 'Post 01' not in first
+        cursor = blog.encode_post_cursor(db.session.execute(
+            db.select(BlogPost).where(BlogPost.title == 'Post 02')).scalar())
+        assert f'before={cursor}' in first
+
+        second = client.get('/', query_string={'before': cursor}).get_data(as_text=True)
+        assert 'Post 01' in second and 'Post 00' in second
+        assert 'Post 02' not in second
+        assert 'Older Posts' not in second
+        assert client.get('/?before=garbage').status_code == 400
+
+
+def test_route_query_budgets():
+    app, db = create_test_app()
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        for i in range(5):
+            create_post(client, title=f'Post {i}')
+            post_comment(client, i + 1, 'Nice')
+            post_comment(client, i + 1, 'Agreed', parent_id=2 * i + 1)
+
+    # each request gets its own session here, as in production
+    with assert_max_queries(2):
+        client.get('/')  # loads and caches the logged-in user
+    with assert_max_queries(1):
+        client.get('/')
+    with assert_max_queries(3):
+        client.get('/post/1').get_data()
+    with assert_max_queries(0):
+        client.get('/about')
+
+
+def test_sql_profile_headers_flag_repeated_shapes(monkeypatch):
+    monkeypatch.setenv('SQL_PROFILE', '1')
+    monkeypatch.setenv('SQL_PROFILE_REPEAT_THRESHOLD', '2')
+    app, db = create_test_app()
+
+    @app.route('/n-plus-one')
+    def n_plus_one():
+        for user_id in range(4):
+            db.session.get(User, user_id)
+        return 'ok'
+
+    with app.app_context():
+        client = app.test_client()
+        response = client.get('/')
+        assert response.headers['X-SQL-Queries'] == '1'
+        assert 'X-SQL-Repeated' not in response.headers
+
+        response = client.get('/n-plus-one')
+        assert response.headers['X-SQL-Repeated'] == '4'
+        report = client.get('/_debug/sql').get_json()
+        assert report[-1]['endpoint'] == 'n_plus_one'
+
+    assert statement_shape("SELECT * FROM t WHERE a = 'x' AND b IN (1, 2, 3)") == \
+        'SELECT * FROM t WHERE a = ? AND b IN (...)'
+
+
+def test_anonymous_pages_are_cached_and_invalidated_by_writes():
+    app, db = create_test_app()
+    with app.app_context():
+        admin = app.test_client()
+        register_admin(admin)
+        create_post(admin)
+    anonymous = app.test_client()
+
+    first = anonymous.get('/')
+    assert first.status_code == 200 and first.headers['ETag']
+    with assert_max_queries(0):
+        again = anonymous.get('/')
+    assert again.get_data() == first.get_data()
+
+    # conditional GET skips rendering altogether
+    with assert_max_queries(0):
+        not_modified = anonymous.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert not_modified.status_code == 304
+    assert anonymous.get('/', headers={'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+
+    post_page = anonymous.get('/post/1')
+    post_page.get_data()
+    create_post(admin, title='Second post')
+    assert b'Second post' in anonymous.get('/').get_data()
+    assert anonymous.get('/', headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+
+    post_comment(admin, 1, 'Fresh comment')
+    refreshed = anonymous.get('/post/1')
+    assert refreshed.headers['ETag'] != post_page.headers['ETag']
+    assert b'Fresh comment' in refreshed.get_data()
+    assert b'1 comment<' in anonymous.get('/').get_data()
+
+
+def test_logged_in_pages_bypass_the_page_cache():
+    app, db = create_test_app()
+    client = app.test_client()
+    with app.app_context():
+        register_admin(client)
+    response = client.get('/')
+    assert 'ETag' not in response.headers
+    assert b'Create New Post' in response.get_data()
+
+
+class FakeRedis:
+    """The few hash commands RedisVersionStore uses, on a dict shared by every client."""
+
+    def __init__(self, hashes):
+        self.hashes = hashes
+
+    def hmget(self, key, *fields):
+        values = self.hashes.get(key, {})
+        return [values.get(field) for field in fields]
+
+    def hincrby(self, key, field, amount):
+        values = self.hashes.setdefault(key, {})
+        values[field] = str(int(values.get(field, 0)) + amount).encode()
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = str(value).encode()
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        for name, args in self.commands:
+            getattr(self.client, name)(*args)
+
+
+def test_redis_version_store_shares_invalidations_between_workers(monkeypatch):
+    hashes = {}
+    fake_redis = type(sys)('redis')
+    fake_redis.Redis = type('Redis', (), {'from_url': staticmethod(lambda url: FakeRedis(hashes))})
+    monkeypatch.setitem(sys.modules, 'redis', fake_redis)
+
+    # two workers: separate apps and page LRUs, one Redis
+    serving, _ = create_test_app(PAGE_CACHE_REDIS_URL='redis://cache')
+    writing, _ = create_test_app(PAGE_CACHE_REDIS_URL='redis://cache')
+    anonymous = serving.test_client()
+    first = anonymous.get('/')
+    assert anonymous.get('/', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    with writing.app_context():
+        page_cache.invalidate('posts')
+    assert hashes['pagecache:posts']['version'] == b'1'
+    fresh = anonymous.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert fresh.status_code == 200 and fresh.headers['ETag'] != first.headers['ETag']
+
+
+def test_page_cache_is_on_by_default_only_with_redis(monkeypatch):
+    monkeypatch.delenv('PAGE_CACHE_ENABLED', raising=False)
+    monkeypatch.delenv('PAGE_CACHE_REDIS_URL', raising=False)
+    assert not config_from_env()['PAGE_CACHE_ENABLED']
+    monkeypatch.setenv('PAGE_CACHE_REDIS_URL', 'redis://cache')
+    assert config_from_env()['PAGE_CACHE_ENABLED']
+    monkeypatch.setenv('PAGE_CACHE_ENABLED', '0')
+    assert not config_from_env()['PAGE_CACHE_ENABLED']
+
+
+def test_search_finds_posts_and_comments_and_follows_edits():
+    app, db = create_test_app()
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        client.post('/new-post', data={
+            'title': 'Neurons and coffee', 'subtitle': 'Caffeine', 'img_url': 'https://example.com/i.jpg',
+            'body': '<p>Adenosine <b>receptors</b> get blocked.</p>', 'submit': 'Submit Post'})
+        create_post(client, title='Unrelated')
+        post_comment(client, 2, '<p>Receptors are <script>alert(1)</script> everywhere</p>')
+
+        html = client.get('/search', query_string={'q': 'receptors'}).get_data(as_text=True)
+        assert 'Neurons and coffee' in html
+        assert 'Comment on Unrelated' in html
+        assert '<mark>receptors</mark>' in html.lower()
+        assert '<script>alert' not in html
+
+        client.post('/edit-post/1', data={
+            'title': 'Neurons and tea', 'subtitle': 'Theanine', 'img_url': 'https://example.com/i.jpg',
+            'body': '<p>Nothing to see</p>', 'submit': 'Submit Post'})
+        html = client.get('/search?q=adenosine').get_data(as_text=True)
+        assert 'No results' in html
+
+        client.get('/delete-comment/1')
+        assert 'Comment on' not in client.get('/search?q=receptors').get_data(as_text=True)
+
+        # unbalanced quotes or FTS operators are searched as plain words
+        assert client.get('/search', query_string={'q': 'tea" OR NEAR('}).status_code == 200
+
+
+def test_search_rebuild_command_indexes_existing_rows():
+    app, db = create_test_app()
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        db.session.add(BlogPost(title='Imported', subtitle='Sub', body='<p>Quantum tunnelling</p>',
+                                     img_url='https://example.com/i.jpg', author_id=1, date='x'))
+        db.session.commit()
+        assert search_index.search('tunnelling') == ([], False)
+
+        result = app.test_cli_runner().invoke(commands.search_rebuild_command)
+        assert 'Indexed 1 documents' in result.output
+        hits, _ = search_index.search('tunnelling')
+        assert [hit.post_id for hit in hits] == [1]
+
+
+def test_comment_counters_follow_writes_and_can_be_repaired():
+    app, db = create_test_app()
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        create_post(client)
+        post_comment(client, 1, 'Root')
+        post_comment(client, 1, 'Reply', parent_id=1)
+        post_comment(client, 1, 'Reply to reply', parent_id=2)
+        post_comment(client, 1, 'Second reply', parent_id=1)
+        db.session.expire_all()
+
+        post = db.session.get(BlogPost, 1)
+        assert post.comment_count == 4
+        assert post.last_comment_at == db.session.get(Comment, 4).created_at
+        assert [db.session.get(Comment, i).reply_count for i in (1, 2, 3, 4)] == [2, 1, 0, 0]
+        assert '4 comments' in client.get('/').get_data(as_text=True)
+
+        # the whole subtree under comment 2 goes, and the newest comment with it
+        client.get('/delete-comment/2')
+        client.get('/delete-comment/4')
+        db.session.expire_all()
+        assert post.comment_count == 1
+        assert post.last_comment_at == db.session.get(Comment, 1).created_at
+        assert db.session.get(Comment, 1).reply_count == 0
+
+        db.session.execute(db.update(BlogPost).values(comment_count=9, last_comment_at=None))
+        db.session.execute(db.update(Comment).values(reply_count=5))
+        db.session.commit()
+        result = app.test_cli_runner().invoke(commands.repair_counters_command)
+        assert result.exit_code == 0
+        db.session.expire_all()
+        assert (post.comment_count, post.last_comment_at) == (1, db.session.get(Comment, 1).created_at)
+        assert db.session.get(Comment, 1).reply_count == 0
+
+
+def test_deleting_a_thread_without_paths_counts_every_reply():
+    app, db = create_test_app()
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        create_post(client)
+        post_comment(client, 1, 'Other root')
+        post_comment(client, 1, 'Root')
+        for parent_id in (2, 3, 4):
+            post_comment(client, 1, 'Reply', parent_id=parent_id)
+        # as if written before paths were backfilled
+        db.session.execute(db.update(Comment).values(path=None))
+        db.session.commit()
+
+        client.get('/delete-comment/2')
+        db.session.expire_all()
+        assert db.session.scalars(db.select(Comment.id)).all() == [1]
+        assert db.session.get(BlogPost, 1).comment_count == 1
+        assert search_index.search('Reply') == ([], False)
+
+
+def test_deep_reply_chains_are_deleted_in_a_fixed_number_of_statements():
+    # deeper than SQLite's limit of 1000 nested cascade triggers
+    app, db = create_test_app()
+    with app.app_context():
+        generate(db, SeedSpec(users=2, posts=2, comments_per_post=0, chain_depth=1100))
+        client = app.test_client()
+        client.post('/login', data={'email': ADMIN_EMAIL, 'password': PASSWORD, 'submit': 'Let Me In!'})
+        client.get('/')
+
+        # the chain hangs off comment 1; cut it at comment 101
+        with assert_max_queries(6):
+            client.get('/delete-comment/101')
+        db.session.expire_all()
+        assert db.session.scalar(db.select(db.func.count(Comment.id))) == 100
+        assert db.session.get(BlogPost, 1).comment_count == 100
+        assert db.session.get(Comment, 100).reply_count == 0
+
+        with assert_max_queries(6):
+            client.get('/delete/1')
+        assert db.session.scalar(db.select(db.func.count(Comment.id))) == 0
+        assert db.session.get(BlogPost, 1) is None
+
+
+def test_user_loader_caches_session_fields_until_user_changes():
+    app, db = create_test_app()
+    client = app.test_client()
+    with app.app_context():
+        register_admin(client)
+    client.get('/about')
+    with assert_max_queries(0):
+        assert b'Log Out' in client.get('/about').get_data()
+
+    with app.app_context():
+        user = db.session.get(User, 1)
+        user.is_admin = False
+        db.session.commit()
+    # the update evicted the cached entry, so the new flag is seen at once
+    assert b'Create New Post' not in client.get('/').get_data()
+    assert app.extensions['user_cache'].get(1).is_admin is False
+
+
+def test_post_and_comment_bodies_are_compiled_on_write():
+    app, db = create_test_app()
+    with app.app_context():
+        client = app.test_client()
+        register_admin(client)
+        client.post('/new-post', data={
+            'title': 'Compiled', 'subtitle': 'Sub', 'img_url': 'https://example.com/i.jpg',
+            'body': '<p onmouseover="x()">Safe <script>bad()</script>words here</p>', 'submit': 'Submit Post'})
+        post_comment(client, 1, '<p>Nice<script>steal()</script></p>')
+
+        post = db.session.get(BlogPost, 1)
+        assert post.body_html == '<p>Safe words here</p>'
+        assert post.excerpt == 'Safe words here'
+        assert post.word_count == 3 and post.reading_minutes == 1
+        assert post.content_hash
+        assert db.session.get(Comment, 1).content == '<p>Nice</p>'
+
+        index = client.get('/').get_data(as_text=True)
+        assert 'Safe words here' in index and '1 min read' in index
+        assert 'bad()' not in client.get('/post/1').get_data(as_text=True)
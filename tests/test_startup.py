@@ -0,0 +1,21 @@
+import json
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_serving_a_page_does_not_load_the_mail_or_push_stacks():
+    probe = (
+        'import json, sys, main\n'
+        'with main.app.app_context():\n'
+        '    main.db.create_all()\n'
+        'assert main.app.test_client().get("/").status_code == 200\n'
+        'print(json.dumps([m for m in ("smtplib", "pywebpush", "py_vapid") if m in sys.modules]))\n'
+    )
+    env = dict(os.environ, DATABASE_URL='sqlite:///:memory:', SECRET_KEY='test-secret', SCHEMA_CHECK='0')
+    result = subprocess.run([sys.executable, '-c', probe], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout.splitlines()[-1]) == []
@@ -0,0 +1,26 @@
+from streaming import after_stream
+
+
+class Body:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_after_stream_closes_the_body_then_calls_back_even_when_abandoned():
+    events = []
+    body = Body(['a', 'b', 'c'])
+    stream = after_stream(body, lambda: events.append(body.closed), chunks=(chunk.upper() for chunk in body))
+    assert next(stream) == 'A'
+    stream.close()
+    assert events == [True]
+
+    body = Body(['a', 'b'])
+    assert list(after_stream(body, lambda: events.append('done'))) == ['a', 'b']
+    assert body.closed and events[-1] == 'done'
@@ -0,0 +1,106 @@
+import json
+
+from bench.seed import SeedSpec, generate
+from models import BlogPost, Comment, PushSubscription, User
+from test_routes import create_test_app
+import transfer
+
+
+def table_rows(db, model):
+    table = model.__table__
+    return [dict(row._mapping) for row in db.session.execute(db.select(table).order_by(table.c.id))]
+
+
+def seeded_app():
+    app, db = create_test_app()
+    with app.app_context():
+        generate(db, SeedSpec(users=12, posts=6, comments_per_post=15, chain_depth=30, post_words=50))
+        db.session.add(PushSubscription(user_id=2, data='{}', endpoint='https://push.example.com/1',
+                                        p256dh='key', auth='secret'))
+        db.session.commit()
+    return app, db
+
+
+def test_export_then_import_round_trips_every_row(tmp_path):
+    source, db = seeded_app()
+    dump = tmp_path / 'dump.jsonl'
+    result = source.test_cli_runner().invoke(args=['export-data', str(dump), '--batch-size', '7'])
+    assert result.exit_code == 0, result.output
+    with source.app_context():
+        expected = {model: table_rows(db, model) for model in (User, BlogPost, Comment, PushSubscription)}
+
+    target, _ = create_test_app()
+    result = target.test_cli_runner().invoke(args=['import-data', str(dump), '--batch-size', '50'])
+    assert result.exit_code == 0, result.output
+    assert f"{len(expected[Comment])} comments" in result.output
+    with target.app_context():
+        for model, rows in expected.items():
+            assert table_rows(db, model) == rows
+        # new rows continue after the imported ids
+        db.session.add(User(name='New', email='new@example.com', password='x'))
+        db.session.commit()
+        assert db.session.execute(db.select(db.func.max(User.id))).scalar() == len(expected[User]) + 1
+
+
+def test_interrupted_export_and_import_resume(tmp_path):
+    source, db = seeded_app()
+    with source.app_context():
+        full = []
+        transfer.export_records(db, full.append, batch_size=5)
+        lines = ''.join(full).splitlines(keepends=True)
+
+    # the export died halfway through a comment line
+    dump = tmp_path / 'dump.jsonl'
+    cut = next(i for i, line in enumerate(lines) if '"type":"comment"' in line) + 10
+    dump.write_text(''.join(lines[:cut]) + lines[cut][:15])
+    result = source.test_cli_runner().invoke(args=['export-data', str(dump), '--resume', '--batch-size', '5'])
+    assert result.exit_code == 0, result.output
+    assert dump.read_text() == ''.join(lines)
+
+    # the import committed its first batches before failing
+    target, _ = create_test_app()
+    with target.app_context():
+        transfer.import_records(db, lines[:cut], batch_size=4)
+    result = target.test_cli_runner().invoke(args=['import-data', str(dump), '--resume', '--batch-size', '4'])
+    assert result.exit_code == 0, result.output
+    with target.app_context():
+        assert db.session.execute(db.select(db.func.count(Comment.id))).scalar() == \
+            sum('"type":"comment"' in line for line in lines)
+
+
+def test_import_fills_in_paths_and_derived_fields():
+    app, db = create_test_app()
+    lines = [
+        {'type': 'user', 'id': 5, 'name': 'Ann', 'email': 'Ann@Example.com', 'password': 'x'},
+        {'type': 'post', 'id': 3, 'title': 'Hello', 'subtitle': 'Sub', 'date': 'May 1, 2024',
+         'body': '<p>Some words here</p>', 'author_id': 5, 'img_url': 'https://example.com/i.jpg'},
+        {'type': 'comment', 'id': 10, 'content': 'Root', 'author_id': 5, 'post_id': 3},
+        {'type': 'comment', 'id': 11, 'content': 'Reply', 'author_id': 5, 'post_id': 3, 'parent_id': 10},
+        {'type': 'comment', 'id': 12, 'content': 'Deeper', 'author_id': 5, 'post_id': 3, 'parent_id': 11},
+    ]
+    with app.app_context():
+        # one comment per batch, so parents are looked up in the database
+        transfer.import_records(db, [json.dumps(line) for line in lines], batch_size=1)
+        deepest = db.session.get(Comment, 12)
+        assert (deepest.path, deepest.depth) == ('0000000010/0000000011/0000000012', 2)
+        post = db.session.get(BlogPost, 3)
+        assert post.body_html and post.word_count == 3
+        assert db.session.get(User, 5).email_hash
+
+
+def test_import_sanitizes_post_and_comment_markup():
+    app, db = create_test_app()
+    lines = [
+        {'type': 'user', 'id': 1, 'name': 'Ann', 'email': 'ann@example.com', 'password': 'x'},
+        {'type': 'post', 'id': 1, 'title': 'Hello', 'subtitle': 'Sub', 'date': 'May 1, 2024',
+         'body': '<p>Hi<script>alert(1)</script></p>', 'body_html': '<p>Hi<script>alert(1)</script></p>',
+         'author_id': 1, 'img_url': 'https://example.com/i.jpg'},
+        {'type': 'comment', 'id': 1, 'content': '<p>Nice<img src=x onerror=alert(1)></p>',
+         'author_id': 1, 'post_id': 1},
+    ]
+    with app.app_context():
+        transfer.import_records(db, [json.dumps(line) for line in lines])
+        assert db.session.get(BlogPost, 1).body_html == '<p>Hi</p>'
+        assert db.session.get(Comment, 1).content == '<p>Nice<img src="x"></p>'
+    page = app.test_client().get('/post/1').get_data(as_text=True)
+    assert 'alert(1)' not in page and 'onerror' not in page
@@ -0,0 +1,221 @@
+"""Streaming JSONL export and import of users, posts, comments and push subscriptions.
+
+Each line is one row tagged with its type, e.g.
+``{"type": "comment", "id": 7, "parent_id": 3, ...}``. Exports list the
+types in ``RECORD_TYPES`` order and each type by id, so every row comes
+after the rows it references (replies after their parents). Imports rely
+on that order, keep the ids, and commit every ``batch_size`` rows.
+Either side can be resumed after an interruption, see ``last_exported``
+and ``import_records(resume=True)``.
+"""
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import DateTime
+
+import migrations
+from content import compile_content, sanitize_html
+from models import COMMENT_PATH_WIDTH, BlogPost, Comment, PushSubscription, User, email_hash
+
+
+RECORD_TYPES = {
+    'user': User,
+    'post': BlogPost,
+    'comment': Comment,
+    'push_subscription': PushSubscription,
+}
+BATCH_SIZE = 1000
+
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_records(db, write, batch_size: int = BATCH_SIZE, start: tuple[str, int] | None = None,
+                   progress=None) -> dict:
+    """Write every row as a JSON line through ``write`` and return the counts per type.
+
+    ``start`` is the ``(type, id)`` of the last row already written; the
+    export picks up right after it. Rows are read from server-side cursors
+    ``batch_size`` at a time, so memory stays flat however big the tables are.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        # one snapshot for all tables, so no row can reference one exported after it
+        db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+    types = list(RECORD_TYPES)
+    skip_until, after_id = (types.index(start[0]), start[1]) if start else (0, 0)
+    counts = {}
+    for position, kind in enumerate(types):
+        if position < skip_until:
+            continue
+        table = RECORD_TYPES[kind].__table__
+        query = db.select(table).order_by(table.c.id).execution_options(yield_per=batch_size)
+        if position == skip_until and after_id:
+            query = query.where(table.c.id > after_id)
+        counts[kind] = 0
+        for rows in db.session.execute(query).partitions():
+            write(''.join(
+                json.dumps({'type': kind, **{key: _encode(value) for key, value in row._mapping.items()}},
+                           separators=(',', ':')) + '\n'
+                for row in rows
+            ))
+            counts[kind] += len(rows)
+            if progress:
+                progress(kind, counts[kind])
+    db.session.rollback()
+    return counts
+
+
+def last_exported(path: str) -> tuple[str, int] | None:
+    """The ``(type, id)`` of the last complete line in an interrupted export.
+
+    A partly written last line is cut off so the export can be appended to.
+    """
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        tail = b''
+        position = end
+        # read backwards until the last full line is in hand; post bodies can be long
+        while position > 0 and tail.count(b'\n') < 2:
+            step = min(65536, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+        complete, _, partial = tail.rpartition(b'\n')
+        if partial:
+            f.truncate(end - len(partial))
+        if not complete:
+            return None
+        record = json.loads(complete.rpartition(b'\n')[2])
+        return record['type'], record['id']
+
+
+def _column_defaults(table) -> dict:
+    defaults = {}
+    for column in table.columns:
+        default = column.default
+        if default is not None and default.is_scalar:
+            defaults[column.name] = lambda arg=default.arg: arg
+        elif default is not None and default.is_callable:
+            defaults[column.name] = lambda arg=default.arg: arg(None)
+        elif not column.primary_key:
+            defaults[column.name] = lambda: None
+    return defaults
+
+
+def _prepare(kind: str, record: dict) -> dict:
+    """Fill in what older or hand-written exports may leave out, and sanitize what pages show as HTML.
+
+    A post's compiled fields are always rebuilt from its body, never taken
+    from the file, so an import can't store markup the editor would reject.
+    """
+    if kind == 'user' and not record.get('email_hash'):
+        record['email_hash'] = email_hash(record.get('email'))
+    elif kind == 'post':
+        compiled = compile_content(record.get('body') or '')
+        record.update(body_html=compiled.html, excerpt=compiled.excerpt, word_count=compiled.word_count,
+                      reading_minutes=compiled.reading_minutes, content_hash=compiled.content_hash)
+    elif kind == 'comment':
+        record['content'] = sanitize_html(record.get('content'))
+    return record
+
+
+def _fill_comment_paths(db, rows: list[dict]):
+    """Give comments without a materialized path one built from their parent's."""
+    batch_ids = {row['id'] for row in rows}
+    outside = {row['parent_id'] for row in rows
+               if not row.get('path') and row.get('parent_id') and row['parent_id'] not in batch_ids}
+    known = {}
+    if outside:
+        known = {id_: (path, depth) for id_, path, depth in db.session.execute(
+            db.select(Comment.id, Comment.path, Comment.depth).where(Comment.id.in_(outside)))}
+    for row in rows:
+        if not row.get('path'):
+            segment = str(row['id']).zfill(COMMENT_PATH_WIDTH)
+            parent = known.get(row.get('parent_id'))
+            if row.get('parent_id') and parent is None:
+                raise ValueError(f"Comment {row['id']} replies to {row['parent_id']}, which comes later or is missing")
+            row['path'] = f'{parent[0]}/{segment}' if parent else segment
+            row['depth'] = parent[1] + 1 if parent else 0
+        known[row['id']] = (row['path'], row['depth'])
+
+
+def import_records(db, lines, batch_size: int = BATCH_SIZE, resume: bool = False, progress=None) -> dict:
+    """Insert the rows in an iterable of JSON lines, committing every ``batch_size`` rows.
+
+    With ``resume``, rows whose id is not above the highest one already in
+    their table are skipped, which picks an interrupted import up where its
+    last commit left off. Comment and reply counts are recomputed at the
+    end, whatever the file said. Returns the counts of inserted rows per type.
+    """
+    tables = {kind: model.__table__ for kind, model in RECORD_TYPES.items()}
+    defaults = {kind: _column_defaults(table) for kind, table in tables.items()}
+    dates = {kind: {column.name for column in table.columns if isinstance(column.type, DateTime)}
+             for kind, table in tables.items()}
+    done = {}
+    if resume:
+        done = {kind: db.session.execute(db.select(db.func.max(table.c.id))).scalar() or 0
+                for kind, table in tables.items()}
+    counts = {kind: 0 for kind in tables}
+    batch, batch_kind = [], None
+
+    def flush():
+        if not batch:
+            return
+        if batch_kind == 'comment':
+            _fill_comment_paths(db, batch)
+        db.session.execute(db.insert(tables[batch_kind]), batch)
+        db.session.commit()
+        counts[batch_kind] += len(batch)
+        if progress:
+            progress(batch_kind, counts[batch_kind])
+        batch.clear()
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        kind = record.pop('type', None)
+        if kind not in tables:
+            raise ValueError(f'Line {number}: unknown record type {kind!r}')
+        if record.get('id') is None:
+            raise ValueError(f'Line {number}: {kind} has no id')
+        if record['id'] <= done.get(kind, 0):
+            continue
+        if kind != batch_kind:
+            # parents have to be committed before the rows that reference them
+            flush()
+            batch_kind = kind
+        record = _prepare(kind, record)
+        row = {}
+        for name, default in defaults[kind].items():
+            if name not in record:
+                value = default()
+            elif name in dates[kind] and record[name] is not None:
+                value = datetime.fromisoformat(record[name])
+            else:
+                value = record[name]
+            row[name] = value
+        row['id'] = record['id']
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    migrations.recount_activity(db.session.connection(), db.metadata)
+    db.session.commit()
+    reset_sequences(db)
+    return counts
+
+
+def reset_sequences(db):
+    """Move Postgres id sequences past the imported ids; SQLite needs nothing."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in RECORD_TYPES.values():
+        table = model.__tablename__
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+        ))
+    db.session.commit()